@@ -0,0 +1,57 @@
+import agents.helper
+from agents.cppmodule.agent import OnlineMCTSAgent
+from model.model_av import Model_AV as Model
+from model.cache import EvalCache
+
+
+def training(state, value, variance, visit, d_size, a_value, a_variance, a_mask, model):
+
+    model.train_data([state[:d_size], value[:d_size], variance[:d_size],
+                      a_value[:d_size], a_variance[:d_size], a_mask[:d_size], visit[:d_size]],
+                     iters_per_val=100, batch_size=512, max_iters=50000,
+                     sample_replacement=True, oversampling=False)
+    model.training(False)
+
+class ActionValueSimC(OnlineMCTSAgent):
+
+    def __init__(
+            self, sims=100, max_nodes=100000, online=False, accumulation_policy=1, memory_size=10000000, episodes_per_train=25,
+            memory_growth_rate=5000, min_visit=40, projection=True, gamma=0.999, benchmark=False, batch_size=1,
+            virtual_loss=0., threads=1, tt_size=0, eval_cache=0, **kwargs):
+
+        self.model = Model()
+        self.model.load()
+        self.model.training(False)
+
+        if eval_cache > 0:
+            inference = EvalCache(self.model, eval_cache)
+        else:
+            inference = self.model.inference
+
+        super().__init__(
+            sims=sims,
+            max_nodes=max_nodes,
+            online=online,
+            accumulation_policy=accumulation_policy,
+            memory_size=memory_size,
+            episodes_per_train=episodes_per_train,
+            memory_growth_rate=memory_growth_rate,
+            min_visit=min_visit,
+            projection=projection,
+            gamma=gamma,
+            benchmark=benchmark,
+            evaluator=inference,
+            evaluation_type=3,
+            train=self.train_model,
+            LP=False,
+            batch_size=batch_size,
+            virtual_loss=virtual_loss,
+            threads=threads,
+            tt_size=tt_size)
+
+    def train_model(self, state, val, var, vis, size, a_val, a_var, a_mask):
+
+        training(state, val, var, vis, size, a_val, a_var, a_mask, self.model)
+
+    def close(self):
+        pass
@@ -93,7 +93,7 @@ class ApproxPolicyIter(TreeAgent):
 
         leaf_index = trace[-1]
 
-        leaf_game = self.game_arr[leaf_index]
+        leaf_game = self.get_game(leaf_index)
 
         value = leaf_game.score
         if not leaf_game.end:
@@ -132,26 +132,41 @@ class ApproxPolicyIter(TreeAgent):
 
         print('\nWARNING: REMOVING UNUSED NODES...', **perr)
 
-        _c = get_all_childs(self.root, self.arrays['child'])
-
-        self.update_available(_c)
+        self.update_available()
 
         if not self.benchmark and self.online:
             if self.projection:
-                nodes_to_store = self.obs_available
+                nodes_to_store = self.released_obs
             else:
-                nodes_to_store = self.available
+                nodes_to_store = self.released
             self.store_nodes(nodes_to_store)
             self.train_nodes()
 
         if self.node_saver:
-            self.save_nodes(self.available)
+            self.save_nodes(self.released)
 
         self.reset_arrays()
 
-    def store_nodes(self, nodes):
+    def collect_released(self):
+
+        if not self.benchmark and self.online:
+            if self.projection:
+                nodes_to_store = self.released_obs
+            else:
+                nodes_to_store = self.released
+            self.store_nodes(nodes_to_store, verbose=False)
+
+        super().collect_released()
+
+    def end_episode(self):
 
-        print('Storing unused nodes...', **perr)
+        if not self.benchmark and self.online and self.memory_index:
+            self.train_nodes()
+
+    def store_nodes(self, nodes, verbose=True):
+
+        if verbose:
+            print('Storing unused nodes...', **perr)
 
         states, values, policy, weights = self.memory
 
@@ -167,24 +182,24 @@ class ApproxPolicyIter(TreeAgent):
             _value = self.arrays['value']
             _policy = self.arrays['policy_new']
             _end = self.arrays['end']
-            g_arr = self.game_arr
 
         for idx in nodes:
+            if m_idx >= self.memory_size:
+                break
             if _visit[idx] < self.min_visits_to_store or _end[idx]:
                 continue
             if self.projection:
                 states[m_idx, 0] = self.obs_arrays['state'][idx]
             else:
-                states[m_idx, 0] = g_arr[idx].getState()
+                states[m_idx, 0] = self.get_game(idx, self.g_save).getState()
             values[m_idx] = _value[idx]
             policy[m_idx] = _policy[idx]
             weights[m_idx] = _visit[idx]
 
             m_idx += 1
-            if m_idx >= self.memory_size:
-                break
 
-        print('{} nodes stored.'.format(m_idx - self.memory_index), **perr)
+        if verbose:
+            print('{} nodes stored.'.format(m_idx - self.memory_index), **perr)
 
         self.memory_index = m_idx
 
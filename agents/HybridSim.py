@@ -1,70 +1,66 @@
 import numpy as np
-from agents.agent import Agent
-from agents.core import select_index, backup_trace, choose_action
-np.set_printoptions(precision=2)
-n_actions = 6
+import agents.helper
+from agents.agent import TreeAgent
+from agents.rollout import DepthRollout
+from agents.cppmodule.core import backup_traces_obs
+from model.model_vp import Model_VP as Model
 
-class HybridSim(Agent):
 
-    def __init__(self,conf,sims,depth=30,tau=None,backend='pytorch'):
+class HybridSim(TreeAgent):
 
-        super().__init__(sims=sims,backend=backend)
+    def __init__(self, depth=30, gamma=0.99, batch_size=1, virtual_loss=0., rollout_variance=1e3, bootstrap=True,
+                 **kwargs):
 
-        self.depth = depth 
+        super().__init__(projection=True, **kwargs)
 
-    def mcts(self,root_index):
-        trace = select_index(root_index,self.arrs['child'],self.arrs['node_stats'])
+        self.gamma = gamma
+        self.batch_size = max(batch_size, 1)
+        self.virtual_loss = virtual_loss
+        self.rollout_variance = rollout_variance
 
-        leaf_index = trace[-1]
-        #leaf_index = select_index(root_index,self.arrs['child'],self.arrs['child_stats'])
+        self.g_tmp = self.env(*self.env_args)
 
-        leaf_game = self.game_arr[leaf_index]
+        self.model = Model()
+        self.model.load()
+        self.model.training(False)
 
-        value = leaf_game.getScore() #- self.game_arr[root_index].getScore()
+        self.rollout = DepthRollout(self.env, self.env_args, self.model.inference, depth, gamma, bootstrap)
 
+    def mcts(self, root_index, sims):
 
-        if not leaf_game.end:
+        score = self.arrays['score']
+        end = self.arrays['end']
+        visit = self.obs_arrays['visit']
+        value = self.obs_arrays['value']
+        variance = self.obs_arrays['variance']
+        n_to_o = self.node_to_obs
 
-            _g = leaf_game.clone()
+        s_args = [root_index, 1]
 
-            _depth = 0
-            
-            _ma = 0
-            _record = []
-            
-            while not _g.end and _depth < self.depth:
-                v, p = self.evaluate_state(_g.getState())
-                _record.append(v+_g.getScore())
-                if _depth == 0:
-                    _ma = (v+_g.getScore())
-                else:
-                    _ma = _ma * 0.9 + (v+_g.getScore()) * 0.1
-                _act = choose_action(p)
-                _g.play(_act)
-                _depth += 1
+        for i in range(0, sims, self.batch_size):
+            n = min(self.batch_size, sims - i)
+            traces, lengths = self.select_traces(s_args, n, self.virtual_loss)
+            leaf_indices = traces[np.arange(n), lengths - 1]
 
-            
-            if _g.end:
-                v = 0
-                _ma *= 0.9
-                _record.append(0)
-                print(_record)            
-            else:           
-                v, p = self.evaluate_state(leaf_game.getState())
-                _ma = _ma * 0.9 + (v+_g.getScore()) * 0.1
-                _record.append(v+_g.getScore())
-            print("%.3f %.3f %.3f %.3f %.3f %.3f"%(np.mean(_record),np.std(_record),np.amax(_record),np.amin(_record),_ma,_ma-np.mean(_record)))
-            value = _g.getScore() + v
+            leaves = list(dict.fromkeys(l for l in leaf_indices if not end[l]))
+            if leaves:
+                result = dict(zip(leaves, self.rollout.run(self.get_game(l) for l in leaves)))
+                for l in leaves:
+                    self.expand(self.get_game(l))
 
-            for i in range(n_actions):
-                _g = leaf_game.clone()
-                _g.play(i)
-                _n = self.new_node(_g)
+            values = score[leaf_indices].astype(np.float32)
+            variances = np.zeros(n, dtype=np.float32)
+            for k, leaf_index in enumerate(leaf_indices):
+                if not end[leaf_index]:
+                    values[k] = result[leaf_index]
+                    variances[k] = self.rollout_variance
 
-                self.arrs['child'][leaf_index][i] = _n
-                self.arrs['node_stats'][_n][2] = _g.getScore()
-            
-        
-        backup_trace(trace,self.arrs['node_stats'],value)
+            backup_traces_obs(traces, lengths, visit, value, variance, n_to_o, score, values, variances, self.gamma)
 
+    def close(self):
 
+        super().close()
+
+        if self.rollout.n_calls:
+            print('Rollout inference calls: {}    mean batch size: {:.1f}'.format(
+                self.rollout.n_calls, self.rollout.n_rows / self.rollout.n_calls), flush=True)
@@ -0,0 +1,135 @@
+import agents.helper
+import os
+import random
+import numpy as np
+import multiprocessing as mp
+from importlib import import_module
+from agents.agent import Agent, get_game_state, set_game_state, perr
+from agents.core import seed_random
+from agents.cppmodule import agent as cpp_agent
+from agents.cppmodule import core as cpp_core
+
+
+def seed_all(seed):
+
+    random.seed(seed)
+    np.random.seed(seed)
+    seed_random(seed)
+    cpp_core.seed(seed)
+    cpp_agent.seed(seed)
+
+
+def merge_stats(stats):
+    """
+    pooled visit-weighted mean and variance of the root child statistics
+    stats: [processes, 3, n_actions] with rows visit, value, variance
+    """
+    stats = np.asarray(stats, dtype=np.float64)
+
+    visit, value, variance = stats[:, 0], stats[:, 1], stats[:, 2]
+
+    n = visit.sum(axis=0)
+    w = visit / np.maximum(n, 1)
+
+    mean = (w * value).sum(axis=0)
+    var = (w * (variance + (value - mean) ** 2)).sum(axis=0)
+
+    unvisited = n == 0
+    mean[unvisited] = value.mean(axis=0)[unvisited]
+    var[unvisited] = variance.mean(axis=0)[unvisited]
+
+    return np.stack([n, mean, var]).astype(np.float32)
+
+
+def worker(conn, agent_type, agent_args, seed):
+
+    seed_all(seed)
+
+    _agent_module = import_module('agents.' + agent_type)
+    agent = getattr(_agent_module, agent_type)(**agent_args)
+
+    game = agent_args['env'](*agent_args['env_args'])
+
+    while True:
+        cmd, arg = conn.recv()
+        if cmd == 'update_root':
+            set_game_state(game, arg)
+            agent.update_root(game)
+            conn.send(None)
+        elif cmd == 'play':
+            agent.play()
+            conn.send(agent.get_stats())
+        elif cmd == 'close':
+            agent.close()
+            conn.send(None)
+            break
+
+    conn.close()
+
+
+class RootParallel(Agent):
+
+    def __init__(self, agent_type, processes=2, seed=None, sims=100, **kwargs):
+
+        super().__init__(**kwargs)
+
+        # a fresh base seed per run unless one is given, the processes use seed, seed+1, ...
+        if seed is None:
+            seed = int.from_bytes(os.urandom(4), 'little')
+        self.seed = seed
+        print('Root-parallel base seed: {}'.format(seed), **perr)
+
+        agent_args = dict(kwargs, sims=-(-sims // processes))
+
+        ctx = mp.get_context('fork')
+
+        self.conns = []
+        self.workers = []
+        for p in range(processes):
+            parent_conn, child_conn = ctx.Pipe()
+            w = ctx.Process(target=worker, args=(child_conn, agent_type, agent_args, (seed + p) % 2 ** 32), daemon=True)
+            w.start()
+            child_conn.close()
+            self.conns.append(parent_conn)
+            self.workers.append(w)
+
+        self.stats = np.zeros((3, self.n_actions), dtype=np.float32)
+
+    def broadcast(self, cmd, arg=None):
+
+        for c in self.conns:
+            c.send((cmd, arg))
+
+        return [c.recv() for c in self.conns]
+
+    def update_root(self, game):
+
+        self.broadcast('update_root', get_game_state(game))
+
+        if game.end:
+            self.episode += 1
+
+    def play(self):
+
+        self.stats = merge_stats(self.broadcast('play'))
+
+        return self.get_action()
+
+    def get_action(self):
+
+        return np.argmax(self.stats[1])
+
+    def get_prob(self):
+
+        return self.stats[0] / np.sum(self.stats[0])
+
+    def get_stats(self):
+
+        return np.copy(self.stats)
+
+    def close(self):
+
+        self.broadcast('close')
+
+        for w in self.workers:
+            w.join()
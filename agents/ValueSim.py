@@ -1,8 +1,10 @@
 import numpy as np
 from agents.agent import TreeAgent
-from agents.core import select_trace, backup_trace
-from agents.cppmodule.core import get_all_childs, select_trace_obs, backup_trace_obs
-from model.model_vv import Model_VV as Model
+from agents.core import select_trace, backup_trace, virtual_loss_trace
+from agents.cppmodule.core import backup_trace_obs, backup_traces_obs
+from model.model_vv import Model_VV as Model, Model_VV_Ensemble
+from model.cache import EvalCache
+from model.server import InferenceClient
 from sys import stderr
 
 eps = 1e-7
@@ -11,10 +13,15 @@ perr = dict(file=stderr, flush=True)
 
 class ValueSim(TreeAgent):
 
-    def __init__(self, online=True, memory_size=500000, min_visits_to_store=10, gamma=0.999, memory_growth_rate=5000, **kwargs):
+    def __init__(self, online=True, memory_size=500000, min_visits_to_store=10, gamma=0.999, memory_growth_rate=5000,
+                 batch_size=1, virtual_loss=0., eval_cache=0, inference_server=None, model_backend='torch', ensemble=0,
+                 **kwargs):
 
         super().__init__(max_nodes=100000, **kwargs)
 
+        self.batch_size = max(batch_size, 1)
+        self.virtual_loss = virtual_loss
+
         self.g_tmp = self.env(*self.env_args)
 
         self.online = online
@@ -39,17 +46,46 @@ class ValueSim(TreeAgent):
 
         self.gamma = gamma
 
-        self.model = Model()
-        self.model.load()
-        self.model.training(False)
+        if inference_server:
+            if online:
+                raise ValueError('Online training needs a local model, not an inference server')
+            self.model = InferenceClient(inference_server)
+        else:
+            if ensemble > 1:
+                self.model = Model_VV_Ensemble(n_models=ensemble, backend=model_backend)
+            else:
+                self.model = Model(backend=model_backend)
+            self.model.load()
+            self.model.training(False)
+
+        if eval_cache > 0:
+            self.inference = EvalCache(self.model, eval_cache)
+        else:
+            self.inference = self.model.inference
 
     def evaluate_state(self, state):
 
-        v, var = self.model.inference(state[None, None, :, :])
+        v, var = self.inference(state[None, None, :, :])
 
         return v[0][0], var[0][0]
 
-    def mcts(self, root_index, sims):
+    def select_batch(self, selection, s_args, n):
+
+        visit = self.arrays['visit']
+        value = self.arrays['value']
+
+        traces = []
+        for i in range(n):
+            trace = selection(*s_args)
+            traces.append(trace)
+            virtual_loss_trace(trace, visit, value, self.virtual_loss, 1)
+
+        for t in traces:
+            virtual_loss_trace(t, visit, value, self.virtual_loss, -1)
+
+        return traces
+
+    def mcts_args(self, root_index):
 
         child = self.arrays['child']
         score = self.arrays['score']
@@ -59,8 +95,8 @@ class ValueSim(TreeAgent):
             value = self.obs_arrays['value']
             variance = self.obs_arrays['variance']
             n_to_o = self.node_to_obs
-            s_args = [root_index, child, visit, value, variance, score, n_to_o, 1]
-            selection = select_trace_obs
+            s_args = [root_index, 1]
+            selection = self.select_trace
             b_args = [None, visit, value, variance, n_to_o, score, None, None, self.gamma]
             #backup = backup_trace_mixture_obs
             backup = backup_trace_obs
@@ -73,12 +109,21 @@ class ValueSim(TreeAgent):
             b_args = [None, visit, value, variance, score, None, None, self.gamma]
             backup = backup_trace
 
+        return selection, s_args, backup, b_args
+
+    def mcts(self, root_index, sims):
+
+        if self.batch_size > 1:
+            return self.mcts_batch(root_index, sims)
+
+        selection, s_args, backup, b_args = self.mcts_args(root_index)
+
         for i in range(sims):
             trace = selection(*s_args)
 
             leaf_index = trace[-1]
 
-            leaf_game = self.game_arr[leaf_index]
+            leaf_game = self.get_game(leaf_index)
 
             _value, _variance = leaf_game.score, 0
             if not leaf_game.end:
@@ -98,30 +143,85 @@ class ValueSim(TreeAgent):
         #print(self.compute_stats().astype(int))
         #input()
 
+    def mcts_batch(self, root_index, sims):
+
+        selection, s_args, backup, b_args = self.mcts_args(root_index)
+
+        score = self.arrays['score']
+        end = self.arrays['end']
+
+        for i in range(0, sims, self.batch_size):
+            n = min(self.batch_size, sims - i)
+            if self.projection:
+                traces, lengths = self.select_traces(s_args, n, self.virtual_loss)
+                leaf_indices = traces[np.arange(n), lengths - 1]
+            else:
+                traces = self.select_batch(selection, s_args, n)
+                leaf_indices = [t[-1] for t in traces]
+
+            leaves = list(dict.fromkeys(l for l in leaf_indices if not end[l]))
+            if leaves:
+                states = np.stack([np.array(self.get_game(l).getState()) for l in leaves])
+                v, var = self.inference(states[:, None, :, :])
+                result = {l: (v[j][0], var[j][0]) for j, l in enumerate(leaves)}
+                for l in leaves:
+                    self.expand(self.get_game(l))
+
+            values = score[leaf_indices]
+            variances = np.zeros(n, dtype=np.float32)
+            for k, leaf_index in enumerate(leaf_indices):
+                if not end[leaf_index]:
+                    v, variances[k] = result[leaf_index]
+                    values[k] += v
+
+            if self.projection:
+                backup_traces_obs(traces, lengths, *b_args[1:6], values, variances, self.gamma)
+            else:
+                for trace, _value, _variance in zip(traces, values, variances):
+                    b_args[0] = trace
+                    b_args[-3] = _value
+                    b_args[-2] = _variance
+                    backup(*b_args)
+
     def remove_nodes(self):
 
         print('\nWARNING: REMOVING UNUSED NODES...', **perr)
 
-        _c = get_all_childs(self.root, self.arrays['child'])
-
-        self.update_available(_c)
+        self.update_available()
 
         if not self.benchmark and self.online:
             if self.projection:
-                nodes_to_store = self.obs_available
+                nodes_to_store = self.released_obs
             else:
-                nodes_to_store = self.available
+                nodes_to_store = self.released
             self.store_nodes(nodes_to_store)
             self.train_nodes()
 
         if self.node_saver:
-            self.save_nodes(self.available)
+            self.save_nodes(self.released)
 
         self.reset_arrays()
 
-    def store_nodes(self, nodes):
+    def collect_released(self):
 
-        print('Storing unused nodes...', **perr)
+        if not self.benchmark and self.online:
+            if self.projection:
+                nodes_to_store = self.released_obs
+            else:
+                nodes_to_store = self.released
+            self.store_nodes(nodes_to_store, verbose=False)
+
+        super().collect_released()
+
+    def end_episode(self):
+
+        if not self.benchmark and self.online and self.memory_index:
+            self.train_nodes()
+
+    def store_nodes(self, nodes, verbose=True):
+
+        if verbose:
+            print('Storing unused nodes...', **perr)
 
         states, values, variance, weights = self.memory
 
@@ -137,24 +237,24 @@ class ValueSim(TreeAgent):
             _value = self.arrays['value']
             _variance = self.arrays['variance']
             _end = self.arrays['end']
-            g_arr = self.game_arr
 
         for idx in nodes:
+            if m_idx >= self.memory_size:
+                break
             if _visit[idx] < self.min_visits_to_store or _end[idx]:
                 continue
             if self.projection:
                 states[m_idx, 0] = self.obs_arrays['state'][idx]
             else:
-                states[m_idx, 0] = g_arr[idx].getState()
+                states[m_idx, 0] = self.get_game(idx, self.g_save).getState()
             values[m_idx] = _value[idx]
             variance[m_idx] = _variance[idx]
             weights[m_idx] = _visit[idx]
 
             m_idx += 1
-            if m_idx >= self.memory_size:
-                break
 
-        print('{} nodes stored.'.format(m_idx - self.memory_index), **perr)
+        if verbose:
+            print('{} nodes stored.'.format(m_idx - self.memory_index), **perr)
 
         self.memory_index = m_idx
 
@@ -1,6 +1,8 @@
 import agents.helper
 from agents.cppmodule.agent import OnlineMCTSAgent
-from model.model_vv import Model_VV as Model
+from model.model_vv import Model_VV as Model, Model_VV_Ensemble
+from model.cache import EvalCache
+from model.server import InferenceClient
 import numpy as np
 
 def training(state, value, variance, visit, d_size, model):
@@ -16,13 +18,33 @@ class ValueSimC(OnlineMCTSAgent):
 
     def __init__(
             self, sims=100, max_nodes=100000, online=False, accumulation_policy=1, memory_size=10000000, episodes_per_train=25,
-            memory_growth_rate=5000, min_visit=40, projection=True, gamma=0.999, benchmark=False, leaf_parallel=True, **kwargs):
+            memory_growth_rate=5000, min_visit=40, projection=True, gamma=0.999, benchmark=False, leaf_parallel=True,
+            batch_size=1, virtual_loss=0., threads=1, tt_size=0, eval_cache=0, inference_server=None, model_backend='torch', ensemble=0,
+            native_model=False, zero_copy=False, **kwargs):
 
-        self.model = Model()
-        self.model.load()
-        self.model.training(False)
-        
-        inference = self.model.inference
+        if native_model and (inference_server or ensemble > 1):
+            raise ValueError('The native evaluator runs a single in-process Model_VV')
+        if zero_copy and (native_model or inference_server or eval_cache > 0):
+            raise ValueError('Zero-copy evaluation needs a local model writing into the agent buffers')
+
+        if inference_server:
+            if online:
+                raise ValueError('Online training needs a local model, not an inference server')
+            self.model = InferenceClient(inference_server)
+        else:
+            if ensemble > 1:
+                self.model = Model_VV_Ensemble(n_models=ensemble, backend=model_backend)
+            else:
+                self.model = Model(backend=model_backend)
+            self.model.load()
+            self.model.training(False)
+
+        if eval_cache > 0:
+            inference = EvalCache(self.model, eval_cache)
+        elif zero_copy:
+            inference = self.evaluate_buffers
+        else:
+            inference = self.model.inference
 
         super().__init__(
             sims=sims,
@@ -37,9 +59,39 @@ class ValueSimC(OnlineMCTSAgent):
             gamma=gamma,
             benchmark=benchmark,
             evaluator=inference,
-            evaluation_type=0,
-            train=lambda state, val, var, vis, size: training(state, val, var, vis, size, self.model),
-            LP=leaf_parallel)
+            evaluation_type=4 if native_model else 5 if zero_copy else 0,
+            train=self.train_model,
+            LP=leaf_parallel,
+            batch_size=batch_size,
+            virtual_loss=virtual_loss,
+            threads=threads,
+            tt_size=tt_size)
+
+        if native_model:
+            self.load_native_model()
+
+        if zero_copy:
+            self.buffers = (self.eval_input, self.eval_output)
+
+    def evaluate_buffers(self, n):
+
+        boards, out = self.buffers
+        self.model.inference_into(boards[:n], out[:n])
+
+    def load_native_model(self):
+
+        from model.model_vv_cpu import Model_VV_CPU
+
+        cpu = Model_VV_CPU(None)
+        cpu.load_state({k: v.detach().cpu().numpy() for k, v in self.model.model.state_dict().items()})
+        self.set_native_model(cpu.params)
+
+    def train_model(self, state, val, var, vis, size):
+
+        training(state, val, var, vis, size, self.model)
+
+        if self.evaluation_type == 4:
+            self.load_native_model()
 
     def close(self):
         pass
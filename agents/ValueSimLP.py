@@ -1,7 +1,6 @@
 import numpy as np
 from agents.ValueSim import ValueSim
-from agents.cppmodule.core import get_all_childs, select_trace_obs, backup_trace_obs_LP
-from agents.cppmodule.core import get_unique_child_obs
+from agents.cppmodule.core import backup_trace_obs_LP, backup_traces_obs_LP
 
 
 class ValueSimLP(ValueSim):
@@ -10,22 +9,19 @@ class ValueSimLP(ValueSim):
 
         super().__init__(min_visits_to_store=25, **kwargs)
 
-    def mcts(self, root_index, sims):
+    def mcts_args(self, root_index):
 
         child = self.arrays['child']
         score = self.arrays['score']
-        games = self.game_arr
-        eval = self.model.inference
 
         if self.projection:
-            state = self.obs_arrays['state']
             visit = self.obs_arrays['visit']
             value = self.obs_arrays['value']
             variance = self.obs_arrays['variance']
             end = self.arrays['end']
             n_to_o = self.node_to_obs
-            s_args = [root_index, child, visit, value, variance, score, n_to_o, 1]
-            selection = select_trace_obs
+            s_args = [root_index, 1]
+            selection = self.select_trace
             mixture = False
             averaged = True
             b_args = [
@@ -41,18 +37,29 @@ class ValueSimLP(ValueSim):
             b_args = [None, visit, value, variance, score, None, None, self.gamma]
             backup = backup_trace
 
+        return selection, s_args, backup, b_args
+
+    def mcts(self, root_index, sims):
+
+        if self.batch_size > 1:
+            return self.mcts_batch(root_index, sims)
+
+        state = self.obs_arrays['state']
+        end = self.arrays['end']
+        eval = self.inference
+
+        selection, s_args, backup, b_args = self.mcts_args(root_index)
+
         for i in range(sims):
             trace = selection(*s_args)
 
             leaf_index = trace[-1]
 
-            leaf_game = games[leaf_index]
-
-            if not leaf_game.end:
+            if not end[leaf_index]:
 
-                self.expand(leaf_game)
+                self.expand(self.get_game(leaf_index))
 
-                _c, _o = get_unique_child_obs(leaf_index, child, score, n_to_o)
+                _c, _o = self.unique_children(leaf_index)
 
                 states = state[_o]
 
@@ -73,3 +80,44 @@ class ValueSimLP(ValueSim):
             #_ro = n_to_o[child[self.root]]
             #print(visit[_ro].astype(int), score[child[self.root]], value[_ro].astype(int), variance[_ro].astype(int))
             #input()
+
+    def mcts_batch(self, root_index, sims):
+
+        state = self.obs_arrays['state']
+        end = self.arrays['end']
+        eval = self.inference
+
+        selection, s_args, backup, b_args = self.mcts_args(root_index)
+
+        for i in range(0, sims, self.batch_size):
+            n = min(self.batch_size, sims - i)
+            traces, lengths = self.select_traces(s_args, n, self.virtual_loss)
+            leaf_indices = traces[np.arange(n), lengths - 1]
+
+            leaves = list(dict.fromkeys(l for l in leaf_indices if not end[l]))
+            for l in leaves:
+                self.expand(self.get_game(l))
+
+            unique = {l: self.unique_children(l) for l in leaves}
+
+            obs = list(dict.fromkeys(o for _c, _o in unique.values() for o in _o))
+            if obs:
+                v, var = eval(state[obs][:, None, :, :])
+                v, var = v.ravel(), var.ravel()
+                position = {o: j for j, o in enumerate(obs)}
+
+            offsets = np.zeros(n + 1, dtype=np.int32)
+            _c, _o = [], []
+            for k, leaf_index in enumerate(leaf_indices):
+                if leaf_index in unique:
+                    _c += unique[leaf_index][0]
+                    _o += unique[leaf_index][1]
+                offsets[k + 1] = len(_c)
+
+            _p = [position[o] for o in _o]
+            _c = np.array(_c, dtype=np.int32)
+            _o = np.array(_o, dtype=np.int32)
+            _v = v[_p] if _p else np.empty(0, dtype=np.float32)
+            _var = var[_p] if _p else np.empty(0, dtype=np.float32)
+
+            backup_traces_obs_LP(traces, lengths, *b_args[1:7], offsets, _c, _o, _v, _var, *b_args[-3:])
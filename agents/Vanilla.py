@@ -1,12 +1,12 @@
 import agents.helper
 from agents.agent import TreeAgent
 from agents.core import select_trace, backup_trace
-from random import randint
-from agents.cppmodule.core import backup_trace_obs, select_trace_obs
+from agents.cppmodule.core import backup_trace_obs
+from agents.cppmodule.rollout import RolloutEngine
 
 
 class Vanilla(TreeAgent):
-    def __init__(self, gamma=0.99, **kwargs):
+    def __init__(self, gamma=0.99, rollouts=1, rollout_policy=0, rollout_threads=1, **kwargs):
 
         super().__init__(projection=True, **kwargs)
 
@@ -14,6 +14,9 @@ class Vanilla(TreeAgent):
 
         self.g_tmp = self.env(*self.env_args)
 
+        self.rollouts = rollouts
+        self.rollout = RolloutEngine(threads=rollout_threads, policy=rollout_policy, prior_variance=1e3)
+
     def mcts(self, root_index, sims):
 
         child = self.arrays['child']
@@ -24,8 +27,8 @@ class Vanilla(TreeAgent):
             value = self.obs_arrays['value']
             variance = self.obs_arrays['variance']
             n_to_o = self.node_to_obs
-            s_args = [root_index, child, visit, value, variance, score, n_to_o, 5]
-            selection = select_trace_obs
+            s_args = [root_index, 5]
+            selection = self.select_trace
             b_args = [None, visit, value, variance, n_to_o, score, None, None, self.gamma]
             #backup = backup_trace_mixture_obs
             backup = backup_trace_obs
@@ -42,17 +45,11 @@ class Vanilla(TreeAgent):
             trace = selection(*s_args)
             leaf_index = trace[-1]
 
-            leaf_game = self.game_arr[leaf_index]
+            leaf_game = self.get_game(leaf_index)
 
             if not leaf_game.end:
 
-                _g = self.g_tmp
-                _g.copy_from(leaf_game)
-                while not _g.end:
-                    _act = randint(0, self.n_actions-1)
-                    _g.play(_act)
-                _value = _g.score
-                _variance = 1e3
+                _value, _variance = self.rollout.run(leaf_game, self.rollouts)
 
                 self.expand(leaf_game)
             else:
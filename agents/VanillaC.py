@@ -1,16 +1,22 @@
 import agents.helper
 from agents.cppmodule.agent import MCTSAgent
-from random import randint
 
-def random_playout(game):
-    while not game.end:
-        game.play(randint(0, 7))
-    return game.score, 1e5
 
 class VanillaC(MCTSAgent):
 
-    def __init__(self, sims=100, max_nodes=500000, projection=True, gamma=0.99, benchmark=False, LP=False, **kwargs):
-        super().__init__(sims, max_nodes, projection, gamma, benchmark, random_playout, 1, False)
+    def __init__(self, sims=100, max_nodes=500000, projection=True, gamma=0.99, benchmark=False, LP=False,
+                 rollouts=1, rollout_policy=0, rollout_threads=1, **kwargs):
+        super().__init__(
+            sims=sims,
+            max_nodes=max_nodes,
+            projection=projection,
+            gamma=gamma,
+            benchmark=benchmark,
+            evaluation_type=2,
+            LP=LP,
+            rollouts=rollouts,
+            rollout_policy=rollout_policy,
+            rollout_threads=rollout_threads)
     
     def close(self):
         pass
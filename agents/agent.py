@@ -1,12 +1,21 @@
 import numpy as np
 import agents.helper
-from agents.cppmodule.core import get_all_childs
+from agents.cppmodule.agent import TreeAgent as NodePool, TraceOverflow
 from sys import stderr
-from collections import deque
 
 perr = dict(file=stderr, flush=True)
 
 
+def get_game_state(game):
+
+    return bytes(memoryview(game))
+
+
+def set_game_state(game, state):
+
+    memoryview(game).cast('B')[:] = state
+
+
 class Agent:
 
     def __init__(self, n_actions=7, benchmark=False, **kwargs):
@@ -31,119 +40,79 @@ class Agent:
         raise NotImplementedError('close not implemented')
 
 
-class TreeAgent(Agent):
+class TreeAgent(NodePool, Agent):
 
     def __init__(self, sims=100, max_nodes=500000, env=None, env_args=None,
-                 node_saver=None, projection=True, min_visits=30, **kwargs):
+                 node_saver=None, projection=True, min_visits=30, benchmark=False, **kwargs):
 
-        super().__init__(**kwargs)
+        # the node pool, expansion and garbage collection are native, python keeps views of the arrays
+        NodePool.__init__(self, max_nodes, projection, benchmark)
 
-        self.sims = sims
+        Agent.__init__(self, benchmark=benchmark, **kwargs)
 
-        self.max_nodes = max_nodes
+        self.sims = sims
 
         self.env = env
         self.env_args = env_args
 
-        self.episode = 0
-
         self.min_visits = min_visits
 
         self.node_saver = node_saver
 
-        self.projection = projection
+        self.trace_buffer = np.zeros((1, 64), dtype=np.int32)
+        self.trace_lengths = np.zeros(1, dtype=np.int32)
 
         self.init_array()
 
-    def init_array(self):
-
-        self.arrays = {
-                'child': np.zeros((self.max_nodes, self.n_actions), dtype=np.int32),
-                'visit': np.zeros(self.max_nodes, dtype=np.int32),
-                'value': np.zeros(self.max_nodes, dtype=np.float32),
-                'variance': np.zeros(self.max_nodes, dtype=np.float32),
-                'episode': np.zeros(self.max_nodes, dtype=np.int32),
-                'score': np.zeros(self.max_nodes, dtype=np.float32),
-                'end': np.zeros(self.max_nodes, dtype=bool)
-                }
-
-        self.game_arr = [self.env(*self.env_args) for i in range(self.max_nodes)]
-
-        self.available = deque(range(1, self.max_nodes), maxlen=self.max_nodes)
-        self.occupied = deque([0], maxlen=self.max_nodes)
-
-        self.node_index_dict = dict()
-
-        if self.projection:
-            self.node_to_obs = np.zeros(self.max_nodes, dtype=np.int32)
-            self.obs_arrays = {
-                    'state': np.zeros((self.max_nodes, *self.env_args[0]), dtype=np.int8),
-                    'visit': np.zeros(self.max_nodes, dtype=np.int32),
-                    'value': np.zeros(self.max_nodes, dtype=np.float32),
-                    'variance': np.zeros(self.max_nodes, dtype=np.float32),
-                    'end': np.zeros(self.max_nodes, dtype=bool),
-                }
-            self.obs_index_dict = dict()
-            self.obs_available = deque(range(1, self.max_nodes), maxlen=self.max_nodes)
-            self.obs_occupied = deque([0], maxlen=self.max_nodes)
-
-    def new_node(self, game):
-
-        idx = self.node_index_dict.get(game)
-
-        if not idx:
-
-            if not self.available:
-                self.remove_nodes()
-
-            idx = self.available.pop()
-
-            _g = self.game_arr[idx]
-
-            _g.copy_from(game)
-
-            self.arrays['episode'][idx] = self.episode
-            self.arrays['score'][idx] = game.score
+    @property
+    def episode(self):
 
-            self.node_index_dict[_g] = idx
+        return self.current_episode
 
-            self.occupied.append(idx)
+    @episode.setter
+    def episode(self, value):
 
-            if self.projection:
+        self.current_episode = value
 
-                state = _g.getState()
-                key = state.tobytes()
-
-                o_idx = self.obs_index_dict.get(key)
-                if not o_idx:
+    def init_array(self):
 
-                    o_idx = self.obs_available.pop()
+        self.arrays, self.obs_arrays, self.node_to_obs = self.pool_views()
+        self.pool_keys = set(self.arrays), set(self.obs_arrays)
+
+        self.g_node = self.env(*self.env_args)
+        self.g_save = self.env(*self.env_args)
+
+    def select_traces(self, s_args, n, virtual_loss=0.):
+        """
+        n projected selections in one native call, rows of the trace buffer
+        are only valid up to the next call
+        """
+        if len(self.trace_lengths) < n:
+            self.trace_buffer = np.zeros((n, self.trace_buffer.shape[1]), dtype=np.int32)
+            self.trace_lengths = np.zeros(n, dtype=np.int32)
+
+        while True:
+            traces, lengths = self.trace_buffer[:n], self.trace_lengths[:n]
+            try:
+                self.fill_traces(*s_args, virtual_loss, traces, lengths)
+            except TraceOverflow:
+                self.trace_buffer = np.zeros((len(self.trace_lengths), 2 * self.trace_buffer.shape[1]), dtype=np.int32)
+                continue
+            return traces, lengths
 
-                    self.obs_arrays['state'][o_idx] = state
-                    self.obs_arrays['end'][o_idx] = _g.end
+    def get_game(self, idx, game=None):
 
-                    self.obs_index_dict[key] = o_idx
-                    self.obs_occupied.append(o_idx)
+        if game is None:
+            game = self.g_node
 
-                self.node_to_obs[idx] = o_idx
+        super().get_game(idx, game)
 
-        return idx
+        return game
 
     def mcts(self):
 
         raise NotImplementedError('mcts not implemented for this agent.')
 
-    def expand(self, game):
-
-        idx = self.new_node(game)
-
-        _g = self.g_tmp
-        child = self.arrays['child'][idx]
-        for i in range(self.n_actions):
-            _g.copy_from(game)
-            _g.play(i)
-            child[i] = self.new_node(_g)
-
     def play(self):
 
         self.mcts(self.root, self.sims)
@@ -203,65 +172,33 @@ class TreeAgent(Agent):
         else:
             return self.arrays['value'][node], self.arrays['variance'][node]
 
-    def update_available(self, occupied):
+    def collect_released(self):
 
-        self.occupied.clear()
-        self.occupied.extend(occupied)
-
-        self.available.clear()
-        self.available.extend(i for i in range(self.max_nodes) if i not in occupied)
-
-        print('Number of occupied nodes: {}'.format(len(self.occupied)), **perr)
-        print('Number of available nodes: {}'.format(len(self.available)), **perr)
-
-        if self.projection:
-            _o = set(self.node_to_obs[i] for i in occupied)
-            self.obs_occupied.clear()
-            self.obs_occupied.extend(_o)
-            self.obs_available.clear()
-            self.obs_available.extend(i for i in range(self.max_nodes) if i not in _o)
-
-            print('Number of occupied observation nodes: {}'.format(len(self.obs_occupied)), **perr)
-            print('Number of available observation nodes: {}'.format(len(self.obs_available)), **perr)
+        if self.node_saver:
+            self.save_nodes(self.released)
 
     def reset_arrays(self):
 
-        arr = self.game_arr
-        pop = self.node_index_dict.pop
-        for idx in self.available:
-            pop(arr[idx], None)
-
-        for arr in self.arrays.values():
-            arr[self.available] = 0
+        # arrays added by subclasses are not part of the native pool
+        node_keys, obs_keys = self.pool_keys
+        released = self.released
+        for key, arr in self.arrays.items():
+            if key not in node_keys:
+                arr[released] = 0
 
         if self.projection:
-            arr = self.obs_arrays['state']
-            pop = self.obs_index_dict.pop
-            for idx in self.obs_available:
-                pop(arr[idx].tobytes(), None)
-
-            for arr in self.obs_arrays.values():
-                arr[self.obs_available] = 0
-
-    def remove_nodes(self):
-
-        print('\nWARNING: REMOVING UNUSED NODES...', **perr)
-
-        occupied = get_all_childs(self.root, self.arrays['child'])
-
-        self.update_available(occupied)
+            released = self.released_obs
+            for key, arr in self.obs_arrays.items():
+                if key not in obs_keys:
+                    arr[released] = 0
 
-        if self.node_saver:
-            self.save_nodes(self.available)
-
-        self.reset_arrays()
+        super().reset_arrays()
 
     def save_nodes(self, nodes_to_save):
 
         saver = self.node_saver
 
         episode = self.arrays['episode']
-        game = self.game_arr
         visit = self.arrays['visit']
         value = self.arrays['value']
         variance = self.arrays['variance']
@@ -274,7 +211,7 @@ class TreeAgent(Agent):
 
             stats = self.compute_stats(idx)
 
-            _g = game[idx]
+            _g = self.get_game(idx, self.g_save)
 
             saver.add_raw(episode[idx],
                           _g.getState(),
@@ -283,7 +220,7 @@ class TreeAgent(Agent):
                           _g.combo,
                           _g.line_clears,
                           _g.line_stats,
-                          _g.score,
+                          self.arrays['score'][idx],
                           stats,
                           value[idx],
                           variance[idx])
@@ -293,13 +230,6 @@ class TreeAgent(Agent):
         if self.node_saver:
             self.save_nodes(self.occupied)
 
-    def update_root(self, game):
-
-        self.root = self.new_node(game)
-
-        if game.end:
-            self.episode += 1
-
     def close(self):
 
         if self.node_saver:
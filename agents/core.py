@@ -14,6 +14,11 @@ eps = 1e-7
 __stats = np.zeros((6, n_actions), dtype=np.float32)
 
 
+@jit(**jit_args)
+def seed_random(seed):
+    np.random.seed(seed)
+
+
 @jit(**jit_args)
 def findZero(arr):
     for i in range(n_actions):
@@ -459,6 +464,13 @@ def backup_trace_with_variance(trace, node_stats, value, variance):
         node_stats[idx][4] = max(v, node_stats[idx][4])
 
 
+@jit(**jit_args)
+def virtual_loss_trace(trace, visit, value, loss, n=1):
+    for idx in trace:
+        visit[idx] += n
+        value[idx] -= n * loss
+
+
 @jit(**jit_args)
 def check_low(indices, count, n=1):
     low = [i for i in indices if count[i] < n]
@@ -1,8 +1,9 @@
 /*
 <%
 from sysconfig import get_path
-cfg['include_dirs'] = [get_path('include') + '/pyTetris/']
-cfg['compiler_args'] = ['-O3', '-fvisibility=hidden']
+cfg['include_dirs'] = [get_path('include') + '/pyTetris/', '../../model/cppmodule/']
+cfg['compiler_args'] = ['-O3', '-march=native', '-fvisibility=hidden', '-std=c++14', '-pthread']
+cfg['linker_args'] = ['-pthread']
 setup_pybind11(cfg)
 %>
 */
@@ -10,42 +11,50 @@ setup_pybind11(cfg)
 #include<vector>
 #include<deque>
 #include<unordered_map>
+#include<unordered_set>
 #include<iostream>
 #include<numeric>
 #include<random>
+#include<stdexcept>
 #include<iterator>
+#include<memory>
+#include<array>
+#include<atomic>
+#include<chrono>
+#include<condition_variable>
+#include<cstring>
+#include<exception>
+#include<mutex>
+#include<thread>
 #include<pyTetris.h>
 #include<pybind11/pybind11.h>
 #include<pybind11/numpy.h>
 #include<pybind11/stl.h>
 #include<core.h>
-#define P 919
+#include<zobrist.h>
+#include<index_table.h>
+#include<transposition.h>
+#include<rollout.h>
+#include<vv_cpu.h>
 #define SEED 123
 
 namespace py = pybind11;
 
 const size_t bStride = 200;
+const size_t n_stat_locks = 64;
+// nodes freed per reclaim, so the release hooks run once per batch instead of once per allocation
+const size_t reclaim_batch = 256;
+const auto eval_wait = std::chrono::microseconds(500);
 
 std::mt19937 mt(SEED);
 std::uniform_real_distribution<double> unif(0., 1.);
 
-namespace std{
-    template<>
-    struct hash<Tetris>{
-        size_t operator()(const Tetris &t) const{
-            return t.hash();
-        }
-    };
+const Zobrist zobrist_game(sizeof(Tetris), SEED, game_padding());
+const Zobrist zobrist_obs(bStride, SEED + 1);
 
-    template<>
-    struct hash<vector<char>>{
-        size_t operator()(const vector<char> &v) const{
-            size_t sum = 0;
-            for(auto tmp : v)
-                sum = P * sum + tmp;
-            return sum;
-        }
-    };
+void seed(unsigned int s){
+    mt.seed(s);
+    srand(s);
 }
 
 class IntSampler{
@@ -63,6 +72,37 @@ class IntSampler{
         }
 };
 
+// Tetris states by node id in fixed blocks allocated on first use, so the pool only pays for the
+// slots it has reached. Blocks never move, references into them stay valid while others are added.
+class GameStore{
+    public:
+        static const size_t block_size = 4096;
+
+        void reserve(size_t n){
+            blocks.resize((n + block_size - 1) / block_size);
+        }
+
+        void ensure(size_t i){
+            auto &b = blocks[i / block_size];
+            if(!b)
+                b.reset(new Tetris[block_size]);
+        }
+
+        size_t allocated() const {
+            size_t n = 0;
+            for(auto &b : blocks)
+                n += b ? block_size : 0;
+            return n;
+        }
+
+        Tetris &operator[](size_t i){
+            return blocks[i / block_size][i % block_size];
+        }
+
+    private:
+        std::vector<std::unique_ptr<Tetris[]>> blocks;
+};
+
 class Agent{
     public:
         int current_episode;
@@ -81,6 +121,18 @@ class Agent{
         */
 };
 
+// child of an expanded node, score_delta is the child score minus the parent score
+struct Edge{
+    int node, obs;
+    float score_delta;
+};
+
+// children of a node deduplicated by obs, the score-maximal child per obs in action order
+struct NodeEdges{
+    int n;
+    Edge edge[n_actions];
+};
+
 class TreeAgent: public Agent {
     public:
         int root, max_nodes;
@@ -89,29 +141,46 @@ class TreeAgent: public Agent {
         std::vector<std::array<int, n_actions>> child;
         std::vector<int> visit, episode;
         std::vector<float> value, variance, score;
-        std::vector<bool> end;
+        // one byte per flag so python can view them as bool arrays
+        std::vector<char> end;
 
         Tetris game_tmp;
-        std::vector<Tetris> games;
+        GameStore games;
 
         std::vector<int> available, occupied;
 
-        std::unordered_map<Tetris, int> node_index_map; 
+        std::vector<uint64_t> key;
+        IndexTable node_index_map;
+
+        std::vector<int> refs, occupied_pos, mark, pending, released;
+        std::vector<bool> in_pending;
+        int gc_epoch, expanding;
 
         std::vector<int> visit_obs, node_to_obs;
         std::vector<float> value_obs, variance_obs;
-        std::vector<bool> end_obs;
-        std::vector<std::vector<char>> state_obs;
+        // built once when a node is expanded, selection reads them instead of child and node_to_obs
+        std::vector<NodeEdges> edges;
+        std::vector<char> end_obs;
+        // boards of all obs nodes in one slab, bStride bytes per obs id
+        std::vector<char> state_obs;
 
         std::vector<int> available_obs, occupied_obs;
 
-        std::unordered_map<std::vector<char>, int> obs_index_map;
+        std::vector<uint64_t> key_obs;
+        IndexTable obs_index_map;
+
+        std::vector<int> refs_obs, occupied_obs_pos, released_obs;
+
+        TranspositionTable transposition;
 
         std::vector<float> stats;
 
-        TreeAgent(int _max_nodes, bool _projection, bool _benchmark) : Agent(_benchmark) {
+        TreeAgent(int _max_nodes, bool _projection, bool _benchmark, int _tt_size=0) : Agent(_benchmark), transposition(_projection ? _tt_size : 0, bStride) {
             max_nodes = _max_nodes;
             projection = _projection;
+            root = 0;
+            gc_epoch = 0;
+            expanding = 0;
             
             child.resize(max_nodes);
             visit.resize(max_nodes, 0);
@@ -120,32 +189,49 @@ class TreeAgent: public Agent {
             episode.resize(max_nodes, 0);
             score.resize(max_nodes, 0);
             end.resize(max_nodes, 0);
-            games.resize(max_nodes);
+            games.reserve(max_nodes);
+            games.ensure(0);
+            key.resize(max_nodes, 0);
+            node_index_map.reserve(max_nodes);
+
+            refs.resize(max_nodes, 0);
+            occupied_pos.resize(max_nodes, 0);
+            mark.resize(max_nodes, 0);
+            in_pending.resize(max_nodes, false);
 
             available.reserve(max_nodes);
             occupied.reserve(max_nodes);
-            for(int i=1;i<max_nodes;++i)
+            pending.reserve(max_nodes);
+            // lowest ids are handed out first so game blocks fill in order
+            for(int i=max_nodes-1;i>0;--i)
                 available.push_back(i);
-            occupied.push_back(0);
 
             stats.resize(3 * n_actions, 0);
 
             if(projection){
                 node_to_obs.resize(max_nodes, 0);
-                state_obs.resize(max_nodes);
+                edges.resize(max_nodes, NodeEdges{});
+                state_obs.resize(size_t(max_nodes) * bStride, 0);
                 visit_obs.resize(max_nodes, 0);
                 value_obs.resize(max_nodes, 0);
                 variance_obs.resize(max_nodes, 0);
                 end_obs.resize(max_nodes, 0);
+                key_obs.resize(max_nodes, 0);
+                obs_index_map.reserve(max_nodes);
+                refs_obs.resize(max_nodes, 0);
+                occupied_obs_pos.resize(max_nodes, 0);
                 
                 available_obs.reserve(max_nodes);
                 occupied_obs.reserve(max_nodes);
                 for(int i=1;i<max_nodes;++i)
                     available_obs.push_back(i);
-                occupied_obs.push_back(0);
             }
         }
 
+        char *obs_state(int o){
+            return &state_obs[size_t(o) * bStride];
+        }
+
         void compute_stats(int index){
             if(index == 0)
                 index = root;
@@ -165,6 +251,11 @@ class TreeAgent: public Agent {
             }
         }
 
+        py::array_t<float> get_stats(){
+            compute_stats(root);
+            return py::array_t<float>({size_t(3), n_actions}, &stats[0]);
+        }
+
         int get_action(){
             compute_stats(root);
             auto max_it = std::max_element(&stats[n_actions], &stats[2 * n_actions]);
@@ -200,11 +291,25 @@ class TreeAgent: public Agent {
 
         void _expand(Tetris &g){
             int idx = _new_node(g);
+            if(child[idx][0] != 0)
+                return;
+
+            expanding = idx;
             for(size_t i=0;i<n_actions;++i){
                 game_tmp.copy_from(g);
                 game_tmp.play(i);
-                child[idx][i] = _new_node(game_tmp);
+                uint64_t c_key = zobrist_game.update(key[idx], &games[idx], &game_tmp, sizeof(Tetris));
+                int c = _new_node(game_tmp, c_key, idx);
+                child[idx][i] = c;
+                ++refs[c];
             } 
+            expanding = 0;
+
+            if(projection)
+                build_edges(idx);
+
+            if(refs[idx] == 0 && idx != root)
+                push_pending(idx);
         } 
 
         void expand(py::buffer &game){
@@ -216,50 +321,75 @@ class TreeAgent: public Agent {
         }
 
         int _new_node(Tetris &g){
+            return _new_node(g, zobrist_game.hash(&g, sizeof(Tetris)), 0);
+        }
+
+        int _new_node(Tetris &g, uint64_t g_key, int parent){
 
-            auto it = node_index_map.find(g);
+            int found = node_index_map.find(g_key, [&](int v){ return games[v] == g; });
 
-            if(it == node_index_map.end()){
+            if(found == 0){
                 
+                if(available.empty())
+                    reclaim();
+
                 if(available.empty())
                     remove_nodes();
 
                 if(available.empty())
-                    std::cerr << "MAX_NODES EXCEEDED" << std::endl;
+                    throw std::runtime_error("MAX_NODES EXCEEDED");
 
                 int idx = available.back();
                 available.pop_back();
 
+                games.ensure(idx);
                 games[idx].copy_from(g);
+                key[idx] = g_key;
 
                 episode[idx] = current_episode;
                 score[idx] = g.score;
+                end[idx] = g.end;
 
-                node_index_map[games[idx]] = idx;
+                node_index_map.insert(g_key, idx);
 
+                refs[idx] = 0;
+                occupied_pos[idx] = occupied.size();
                 occupied.push_back(idx);
                 
                 if(projection){
                     std::vector<char> state = g._getState();
 
-                    auto o_it = obs_index_map.find(state);
+                    uint64_t o_key;
+                    if(parent != 0){
+                        int p_obs = node_to_obs[parent];
+                        o_key = zobrist_obs.update(key_obs[p_obs], obs_state(p_obs), state.data(), state.size());
+                    }else{
+                        o_key = zobrist_obs.hash(state.data(), state.size());
+                    }
 
-                    if(o_it == obs_index_map.end()){
+                    int o_found = obs_index_map.find(o_key, [&](int v){ return std::memcmp(obs_state(v), state.data(), bStride) == 0; });
+
+                    if(o_found == 0){
                         int o_idx = available_obs.back();
                         available_obs.pop_back();
-                        state_obs[o_idx] = state;
+                        std::memcpy(obs_state(o_idx), state.data(), bStride);
                         end_obs[o_idx] = g.end;
-                        obs_index_map[state] = o_idx;
+                        key_obs[o_idx] = o_key;
+                        obs_index_map.insert(o_key, o_idx);
+                        if(transposition.capacity > 0 && !g.end)
+                            transposition.lookup(o_key, state.data(), visit_obs[o_idx], value_obs[o_idx], variance_obs[o_idx]);
+                        occupied_obs_pos[o_idx] = occupied_obs.size();
                         occupied_obs.push_back(o_idx);
                         node_to_obs[idx] = o_idx;
                     }else{
-                        node_to_obs[idx] = o_it->second;
+                        node_to_obs[idx] = o_found;
                     }
+                    ++refs_obs[node_to_obs[idx]];
                 }
                 
                 return idx;
             }else{
-                return it->second;
+                return found;
             }
         }
 
@@ -270,65 +400,154 @@ class TreeAgent: public Agent {
             return _new_node(*g);
         }
 
+        void get_game(int index, py::buffer &game){
+            py::buffer_info info = game.request();
+
+            Tetris *g = (Tetris*) (info.ptr);
+            g->copy_from(games[index]);
+        }
+
         void update_root(py::buffer &game){
 
             py::buffer_info info = game.request();
             Tetris *g = (Tetris*) (info.ptr);
 
-            root = _new_node(*g);
+            int new_root = _new_node(*g);
+
+            ++refs[new_root];
+            if(root != 0 && --refs[root] == 0)
+                push_pending(root);
 
-            if(g->end)
+            root = new_root;
+
+            if(g->end){
                 current_episode += 1;
+                end_episode();
+            }
+        }
+
+        virtual void end_episode(){}
+
+        void push_pending(int v){
+            if(!in_pending[v]){
+                in_pending[v] = true;
+                pending.push_back(v);
+            }
+        }
+
+        void release_node(int v){
+            int last = occupied.back();
+            occupied[occupied_pos[v]] = last;
+            occupied_pos[last] = occupied_pos[v];
+            occupied.pop_back();
+
+            available.push_back(v);
+            released.push_back(v);
+
+            if(projection){
+                int o = node_to_obs[v];
+                if(--refs_obs[o] == 0){
+                    last = occupied_obs.back();
+                    occupied_obs[occupied_obs_pos[o]] = last;
+                    occupied_obs_pos[last] = occupied_obs_pos[o];
+                    occupied_obs.pop_back();
+
+                    available_obs.push_back(o);
+                    released_obs.push_back(o);
+                }
+            }
+        }
+
+        void reclaim(){
+            while(available.size() < reclaim_batch && !pending.empty()){
+                int v = pending.back();
+                pending.pop_back();
+                in_pending[v] = false;
+
+                if(refs[v] > 0 || v == root || v == expanding)
+                    continue;
+
+                for(auto c : child[v]){
+                    if(c != 0 && --refs[c] == 0)
+                        push_pending(c);
+                }
+
+                release_node(v);
+            }
+
+            if(released.empty())
+                return;
+            collect_released();
+            reset_arrays();
         }
 
         void update_available(){
-            std::deque<size_t> to_traverse({root});
 
-            std::unordered_set<size_t> traversed;
+            ++gc_epoch;
+
+            std::vector<int> to_traverse({root});
+            if(expanding != 0 && expanding != root)
+                to_traverse.push_back(expanding);
+
+            for(auto v : to_traverse)
+                mark[v] = gc_epoch;
 
             for(size_t i=0; i < to_traverse.size(); ++i){
-                auto pair = traversed.insert(to_traverse[i]);
-                if(pair.second){
-                    for(size_t c=0; c < n_actions; ++c){
-                        size_t _c = child[*(pair.first)][c];
-                        if(traversed.find(_c) == traversed.end())
-                            to_traverse.push_back(_c);
+                for(auto c : child[to_traverse[i]]){
+                    if(c != 0 && mark[c] != gc_epoch){
+                        mark[c] = gc_epoch;
+                        to_traverse.push_back(c);
                     }
                 }
             }
 
-            occupied.resize(traversed.size());
-            occupied.insert(occupied.begin(), traversed.begin(), traversed.end());
+            for(auto v : pending)
+                in_pending[v] = false;
+            pending.clear();
 
-            available.resize(0);
-            for(int i=0; i<max_nodes; ++i){
-                if(traversed.find(i) == traversed.end())
-                    available.push_back(i);
+            for(size_t i=0; i < occupied.size();){
+                int v = occupied[i];
+                if(mark[v] == gc_epoch){
+                    ++i;
+                    continue;
+                }
+                for(auto c : child[v]){
+                    if(c != 0)
+                        --refs[c];
+                }
+                release_node(v);
             }
 
             std::cerr << "Number of occupied nodes: " << occupied.size() << std::endl;
             std::cerr << "Number of available nodes: " << available.size() << std::endl;
+            std::cerr << "Game states allocated: " << games.allocated() << " / " << max_nodes << std::endl;
 
             if(projection){
-                std::unordered_set<int> _o;
-                for(auto v : occupied)
-                    _o.insert(node_to_obs[v]);
-                occupied_obs.resize(_o.size());
-                occupied_obs.insert(occupied_obs.begin(), _o.begin(), _o.end());
-                available_obs.resize(0);
-                for(int i=0; i<max_nodes; ++i){
-                    if(_o.find(i) == _o.end())
-                        available_obs.push_back(i);
-                }
                 std::cerr << "Number of occupied observation nodes: " << occupied_obs.size() << std::endl;
                 std::cerr << "Number of available observation nodes: " << available_obs.size() << std::endl;
             }
+
+            if(transposition.capacity > 0){
+                std::cerr << "Transposition table usage: " << transposition.size() << " / " << transposition.capacity
+                    << "    hits/misses: " << transposition.hits << "/" << transposition.misses << std::endl;
+            }
         }
 
-        void reset_arrays(){
+        virtual void collect_released(){}
+
+        virtual void reset_arrays(){
 
-            for(auto v : available){
-                node_index_map.erase(games[v]);
+            if(released.size() * 4 > node_index_map.capacity()){
+                node_index_map.clear();
+                for(auto v : occupied)
+                    node_index_map.insert(key[v], v);
+            }else{
+                for(auto v : released)
+                    node_index_map.erase(key[v], v);
+            }
+
+            for(auto v : released){
+                key[v] = 0;
                 visit[v] = 0;
                 std::fill_n(child[v].begin(), n_actions, 0);
                 episode[v] = 0;
@@ -336,16 +555,33 @@ class TreeAgent: public Agent {
                 variance[v] = 0;
                 score[v] = 0;
                 end[v] = false;
+                refs[v] = 0;
+                if(projection)
+                    edges[v].n = 0;
             }
+            released.clear();
+
             if(projection){
-                for(auto v : available_obs){
+                if(released_obs.size() * 4 > obs_index_map.capacity()){
+                    obs_index_map.clear();
+                    for(auto v : occupied_obs)
+                        obs_index_map.insert(key_obs[v], v);
+                }else{
+                    for(auto v : released_obs)
+                        obs_index_map.erase(key_obs[v], v);
+                }
+
+                for(auto v : released_obs){
+                    if(visit_obs[v] > 0 && !end_obs[v])
+                        transposition.store(key_obs[v], obs_state(v), visit_obs[v], value_obs[v], variance_obs[v]);
                     visit_obs[v] = 0;
                     value_obs[v] = 0;
                     variance_obs[v] = 0;
                     end_obs[v] = false;
-                    obs_index_map.erase(state_obs[v]);
-                    std::fill(state_obs[v].begin(), state_obs[v].end(), 0);
+                    key_obs[v] = 0;
+                    std::memset(obs_state(v), 0, bStride);
                 }
+                released_obs.clear();
             }
         }
 
@@ -354,41 +590,184 @@ class TreeAgent: public Agent {
             std::cerr << "\nWARNING: REMOVING UNUSED NODES..." << std::endl;
             update_available();
         
+            collect_released();
             reset_arrays();         
         }
 
         std::vector<char> fetch_observations(const std::vector<int> indices){
             std::vector<char> result(indices.size() * bStride);
+            fetch_observations(indices, result.data());
+            return result;
+        }
 
-            int offset = 0;
+        void fetch_observations(const std::vector<int> &indices, char *dst){
             for(auto idx : indices){
-                std::copy(state_obs[idx].begin(), state_obs[idx].end(), result.begin() + offset);
-                offset += bStride;
+                std::memcpy(dst, obs_state(idx), bStride);
+                dst += bStride;
+            }
+        }
+
+        // board of a game node, projected nodes already hold it as their observation
+        void leaf_observation(int index, char *dst){
+            if(projection){
+                std::memcpy(dst, obs_state(node_to_obs[index]), bStride);
+            }else{
+                std::vector<char> state = games[index]._getState();
+                std::copy(state.begin(), state.end(), dst);
+            }
+        }
+
+        void build_edges(int idx){
+            NodeEdges &e = edges[idx];
+            e.n = 0;
+            for(size_t i=0;i<n_actions;++i){
+                int c = child[idx][i];
+                if(c == 0) continue;
+                int o = node_to_obs[c];
+                int j = 0;
+                while(j < e.n && e.edge[j].obs != o)
+                    ++j;
+                if(j == e.n)
+                    e.edge[e.n++] = {c, o, score[c] - score[idx]};
+                else if(score[c] > score[e.edge[j].node])
+                    e.edge[j] = {c, o, score[c] - score[idx]};
             }
-            return result;
         }
 
         void get_unique_obs(size_t index, std::vector<int> &c, std::vector<int> &o){
             c.clear();
             o.clear();
 
-            for(size_t i=0;i<n_actions;++i){
-                int _c = child[index][i];
-                if(_c == 0) continue;
-                int _o = node_to_obs[_c];
-                auto o_idx = std::find(o.begin(), o.end(), _o);
-                if(o_idx == o.end()){
-                    c.push_back(_c);
-                    o.push_back(_o);
-                }else{
-                    int idx = o_idx - o.begin();
-                    if(score[_c] > score[c[idx]])
-                        c[idx] = _c;
+            const NodeEdges &e = edges[index];
+            for(int i=0;i<e.n;++i){
+                c.push_back(e.edge[i].node);
+                o.push_back(e.edge[i].obs);
+            }
+        }
+
+        // same choices as _check_low and policy_clt over get_unique_obs, without gathering the children per level.
+        // the stats of each child are read under lock_stats(obs) so threaded backups never race the reads
+        template<typename Lock>
+        int select_edge(int index, int low, const Lock &lock_stats){
+            const NodeEdges &e = edges[index];
+
+            int vis[n_actions];
+            float val[n_actions], var[n_actions];
+            for(int i=0;i<e.n;++i){
+                int o = e.edge[i].obs;
+                auto lock = lock_stats(o);
+                vis[i] = visit_obs[o];
+                val[i] = value_obs[o];
+                var[i] = variance_obs[o];
+            }
+
+            int n_low = 0, low_idx[n_actions];
+            for(int i=0;i<e.n;++i)
+                if(vis[i] < low)
+                    low_idx[n_low++] = i;
+            if(n_low > 0)
+                return e.edge[low_idx[rand() % n_low]].node;
+
+            int n = 0;
+            for(int i=0;i<e.n;++i)
+                n += vis[i];
+
+            int max_idx = 0;
+            float max_q = 0;
+            float bound_coeff = norm_quantile(n);
+            for(int i=0;i<e.n;++i){
+                float q = val[i] + e.edge[i].score_delta + bound_coeff * sqrt(var[i] / vis[i]);
+                if(i == 0 || q > max_q){
+                    max_q = q;
+                    max_idx = i;
                 }
             }
+            return e.edge[max_idx].node;
+        }
+
+        struct NoLock{
+            int operator()(int) const { return 0; }
+        };
+
+        template<typename Lock=NoLock>
+        std::vector<int> selection_obs(int low, int index=0, const Lock &lock_stats=Lock()){
+            std::vector<int> trace;
+            if(index == 0)
+                index = root;
+
+            while(true){
+                trace.push_back(index);
+                if(edges[index].n == 0) break;
+                index = select_edge(index, low, lock_stats);
+            }
+            return trace;
         }
+
+        py::array_t<int> select_trace(int index, int low){
+            std::vector<int> trace = selection_obs(low, index);
+            return py::array_t<int>(trace.size(), trace.data());
+        }
+
+        // n traces with virtual loss between them, the contract of core.select_traces_obs
+        void fill_traces(int index, int low, double virtual_loss, py::array_t<int> &traces, py::array_t<int> &lengths){
+            check_trace_buffers(traces, lengths);
+
+            auto traces_uc = traces.mutable_unchecked<2>();
+            auto lengths_uc = lengths.mutable_unchecked<1>();
+            size_t m = lengths.shape(0);
+            size_t depth = traces.shape(1);
+
+            auto loss = [&](size_t k, int n){
+                for(int i=0;i<lengths_uc(k);++i){
+                    int o = node_to_obs[traces_uc(k, i)];
+                    visit_obs[o] += n;
+                    value_obs[o] -= n * virtual_loss;
+                }
+            };
+
+            size_t selected = 0;
+            {
+                py::gil_scoped_release release;
+
+                for(;selected<m;++selected){
+                    std::vector<int> trace = selection_obs(low, index);
+                    if(trace.size() > depth)
+                        break;
+                    std::copy(trace.begin(), trace.end(), traces_uc.mutable_data(selected, 0));
+                    lengths_uc(selected) = trace.size();
+                    loss(selected, 1);
+                }
+
+                for(size_t k=0;k<selected;++k)
+                    loss(k, -1);
+            }
+
+            if(selected < m)
+                throw TraceOverflow("trace deeper than the traces buffer");
+        }
+
+        py::tuple unique_children(int index){
+            std::vector<int> c, o;
+            get_unique_obs(index, c, o);
+            return py::make_tuple(c, o);
+        }
+};
+
+struct EvalRequest{
+    std::vector<char> obs;
+    size_t n = 0;
+    std::vector<float> value, variance, action_value, action_variance;
+    bool done = false;
 };
 
+// evaluator types: 0 board value, 1 python game evaluator, 2 native rollouts,
+// 3 action values (board value plus one estimate per afterstate in one call),
+// 4 board value from the built-in Model_VV network, no python during play,
+// 5 board value through agent-owned buffers: evaluator(n) reads eval_input[:n] and fills eval_output[:n] in place
+const int ACTION_VALUE = 3;
+const int NATIVE_VALUE = 4;
+const int BUFFERED_VALUE = 5;
+
 class MCTSAgent: public TreeAgent {
     public:
         int sims, max_nodes;
@@ -396,22 +775,187 @@ class MCTSAgent: public TreeAgent {
         py::function evaluator;
         int evaluator_type;
         double gamma;
-        MCTSAgent(int _sims, int _max_nodes, bool _projection, double _gamma, bool _benchmark, py::function _eval, int _eval_type, bool _LP): TreeAgent(_max_nodes, _projection, _benchmark){
+        int batch_size;
+        float virtual_loss;
+        int threads;
+        int rollouts;
+        RolloutEngine rollout;
+        vv::Net native_net;
+        vv::Net::Scratch native_scratch;
+        size_t eval_capacity = 0;
+        py::array_t<char> eval_input;
+        py::array_t<float> eval_output;
+        char *eval_in = nullptr;
+        float *eval_out = nullptr;
+
+        std::mutex tree_mutex, queue_mutex;
+        std::array<std::mutex, n_stat_locks> stat_locks;
+        std::condition_variable queue_cv, done_cv;
+        std::vector<EvalRequest*> eval_queue;
+        std::atomic<int> sims_left;
+        int active_workers;
+        std::atomic<bool> search_stop;
+        std::exception_ptr search_error;
+
+        MCTSAgent(int _sims, int _max_nodes, bool _projection, double _gamma, bool _benchmark, py::object _eval, int _eval_type, bool _LP, int _batch_size, float _virtual_loss, int _threads, int _tt_size, int _rollouts=1, int _rollout_policy=0, int _rollout_threads=1): TreeAgent(_max_nodes, _projection, _benchmark, _tt_size), rollout(_eval_type == 2 ? _rollout_threads : 1, _rollout_policy, 1e5, mt()){
             sims = _sims;
-            leaf_parallelization = _LP;
-            evaluator = _eval;
+            // action values already cover the children of a leaf
+            leaf_parallelization = _LP && _eval_type != ACTION_VALUE;
+            evaluator = py::reinterpret_borrow<py::function>(_eval);
             evaluator_type = _eval_type;
             gamma = _gamma;
+            batch_size = std::max(_batch_size, 1);
+            virtual_loss = _virtual_loss;
+            threads = std::max(_threads, 1);
+            rollouts = std::max(_rollouts, 1);
+
+            if(evaluator_type == BUFFERED_VALUE){
+                // a leaf contributes at most one observation per action, a batch or each worker at most one leaf
+                eval_capacity = std::max(batch_size, threads) * n_actions;
+                eval_input = py::array_t<char>({eval_capacity, size_t(1), size_t(20), size_t(10)});
+                eval_output = py::array_t<float>({eval_capacity, size_t(2)});
+                eval_in = eval_input.mutable_data();
+                eval_out = eval_output.mutable_data();
+            }
+        }
+
+        bool value_evaluator() const {
+            return evaluator_type == 0 || evaluator_type == NATIVE_VALUE || evaluator_type == BUFFERED_VALUE;
+        }
+
+        // weights in the order and layouts of Model_VV_CPU.params
+        void set_native_model(const std::vector<py::array_t<float, py::array::c_style | py::array::forcecast>> &params){
+            std::vector<std::vector<float>> data;
+            std::vector<std::vector<long>> shapes;
+            for(auto &p : params){
+                data.emplace_back(p.data(), p.data() + p.size());
+                shapes.emplace_back(p.shape(), p.shape() + p.ndim());
+            }
+            native_net.load(data, shapes);
+            native_scratch = vv::Net::Scratch(native_net.n_fc);
         }
 
         int play(){
-            for(int i=0;i<sims;++i)
-                mcts();
+            if(evaluator_type == NATIVE_VALUE && !native_net.loaded())
+                throw std::logic_error("evaluation_type 4 needs set_native_model before play");
+
+            if(threads > 1 && (value_evaluator() || evaluator_type == ACTION_VALUE)){
+                py::gil_scoped_release release;
+                mcts_parallel();
+            }else if(evaluator_type == NATIVE_VALUE){
+                py::gil_scoped_release release;
+                if(batch_size > 1){
+                    for(int i=0;i<sims;i+=batch_size)
+                        mcts_batch(std::min(batch_size, sims - i));
+                }else{
+                    for(int i=0;i<sims;++i)
+                        mcts();
+                }
+            }else if(evaluator_type == 2){
+                py::gil_scoped_release release;
+                for(int i=0;i<sims;++i)
+                    mcts();
+            }else if(batch_size > 1 && (evaluator_type == 0 || evaluator_type == BUFFERED_VALUE || evaluator_type == ACTION_VALUE)){
+                for(int i=0;i<sims;i+=batch_size)
+                    mcts_batch(std::min(batch_size, sims - i));
+            }else{
+                for(int i=0;i<sims;++i)
+                    mcts();
+            }
            
             compute_stats(root);
             return get_action();
         } 
 
+        // where to gather n observations, the agent-owned input buffer for buffered evaluators
+        char *observation_buffer(std::vector<char> &f_obs, size_t n){
+            if(evaluator_type == BUFFERED_VALUE){
+                if(n > eval_capacity)
+                    throw std::length_error("evaluation batch exceeds the evaluator buffers");
+                return eval_in;
+            }
+            f_obs.resize(n * bStride);
+            return f_obs.data();
+        }
+
+        void evaluate(const char *obs, size_t n, std::vector<float> &_val, std::vector<float> &_var){
+
+            if(evaluator_type == NATIVE_VALUE || evaluator_type == BUFFERED_VALUE){
+                std::vector<float> native_out;
+                const float *out = eval_out;
+                if(evaluator_type == NATIVE_VALUE){
+                    native_out.resize(2 * n);
+                    native_net.forward(reinterpret_cast<const int8_t*>(obs), n, native_out.data(), native_scratch);
+                    out = native_out.data();
+                }else{
+                    evaluator(n);
+                }
+                _val.resize(n);
+                _var.resize(n);
+                for(size_t i=0;i<n;++i){
+                    _val[i] = out[2 * i];
+                    _var[i] = out[2 * i + 1];
+                }
+                return;
+            }
+
+            std::vector<size_t> shape = {n, 1, 20, 10};
+
+            py::array_t<char> observations = py::array_t<char>(shape, obs);
+
+            auto _result = evaluator(observations).cast<std::vector<py::object>>();
+            copy_floats(_result[0], _val);
+            copy_floats(_result[1], _var);
+        }
+
+        static void copy_floats(py::handle h, std::vector<float> &dst){
+            auto a = py::array_t<float, py::array::c_style | py::array::forcecast>::ensure(h);
+            if(!a)
+                throw std::invalid_argument("evaluator must return arrays");
+            dst.assign(a.data(), a.data() + a.size());
+        }
+
+        // board values (n) and action values (n x n_actions) from a single evaluator call
+        void evaluate_actions(const char *obs, size_t n, std::vector<float> &_val, std::vector<float> &_var,
+                              std::vector<float> &_a_val, std::vector<float> &_a_var){
+
+            std::vector<size_t> shape = {n, 1, 20, 10};
+
+            py::array_t<char> observations = py::array_t<char>(shape, obs);
+
+            auto _result = evaluator(observations).cast<std::vector<py::object>>();
+            if(_result.size() < 4)
+                throw std::invalid_argument("action-value evaluator must return value, variance, action value and action variance");
+            copy_floats(_result[0], _val);
+            copy_floats(_result[1], _var);
+            copy_floats(_result[2], _a_val);
+            copy_floats(_result[3], _a_var);
+            if(_val.size() != n || _a_val.size() != n * n_actions || _a_var.size() != n * n_actions)
+                throw std::invalid_argument("action-value evaluator returned arrays of the wrong size");
+        }
+
+        // children that were never visited take the afterstate estimates of their action as one pseudo-visit,
+        // they get a true evaluation only once selection reaches them
+        void seed_children(int index, const float *a_val, const float *a_var, std::vector<int> &c, std::vector<int> &o){
+            get_unique_obs(index, c, o);
+            for(size_t i=0;i<c.size();++i){
+                size_t a = 0;
+                while(a < n_actions && child[index][a] != c[i])
+                    ++a;
+                auto lock = lock_stats(o[i]);
+                if(visit_obs[o[i]] > 0)
+                    continue;
+                visit_obs[o[i]] = 1;
+                if(end_obs[o[i]]){
+                    value_obs[o[i]] = 0;
+                    variance_obs[o[i]] = 0;
+                }else{
+                    value_obs[o[i]] = a_val[a];
+                    variance_obs[o[i]] = a_var[a];
+                }
+            }
+        }
+
         void mcts(){
             
             std::vector<int> trace = selection_obs(1);
@@ -419,30 +963,26 @@ class MCTSAgent: public TreeAgent {
             std::vector<int> c_nodes, c_obs;
             if(!games[trace.back()].end){
                 _expand(games[trace.back()]);
-                if(evaluator_type == 0){
+                if(value_evaluator()){
+                    std::vector<char> f_obs;
                     if(leaf_parallelization){
                         get_unique_obs(trace.back(), c_nodes, c_obs);
                          
-                        std::vector<char> f_obs = fetch_observations(c_obs);
+                        char *obs = observation_buffer(f_obs, c_obs.size());
+                        fetch_observations(c_obs, obs);
                         
-                        std::vector<size_t> shape = {c_nodes.size(), 1, 20, 10};
-
-                        py::array_t<char> observations = py::array_t<char>(shape, &f_obs[0]);
-                        
-                        auto _result = evaluator(observations).cast<std::vector<py::object>>();
-                        std::vector<float> __val = _result[0].cast<std::vector<float>>();
-                        std::vector<float> __var = _result[1].cast<std::vector<float>>();
+                        std::vector<float> __val, __var;
+                        evaluate(obs, c_nodes.size(), __val, __var);
                         
                         backup_obs(trace, c_nodes, c_obs, __val, __var, false, true);
                     }else{
-                    
-                        std::vector<size_t> shape = {1, 1, 20, 10};
-                        auto observation = games[trace.back()].getState();
-                        observation.resize(shape);
+                        char *obs = observation_buffer(f_obs, 1);
+                        leaf_observation(trace.back(), obs);
 
-                        auto result = evaluator(observation).cast<std::vector<float>>();
+                        std::vector<float> __val, __var;
+                        evaluate(obs, 1, __val, __var);
 
-                        backup_obs_single(trace, score[trace.back()] + result[0], result[1]);
+                        backup_obs_single(trace, score[trace.back()] + __val[0], __var[0]);
                     }
 
 
@@ -453,44 +993,277 @@ class MCTSAgent: public TreeAgent {
                     float _val = result[0];
                     float _var = result[1];
                     backup_obs_single(trace, _val, _var); 
+                }else if(evaluator_type == 2){
+                    auto result = rollout.run(games[trace.back()], rollouts);
+                    backup_obs_single(trace, result[0], result[1]);
+                }else if(evaluator_type == ACTION_VALUE){
+                    std::vector<char> f_obs = games[trace.back()]._getState();
+
+                    std::vector<float> __val, __var, __a_val, __a_var;
+                    evaluate_actions(f_obs.data(), 1, __val, __var, __a_val, __a_var);
+
+                    seed_children(trace.back(), &__a_val[0], &__a_var[0], c_nodes, c_obs);
+                    backup_obs_single(trace, score[trace.back()] + __val[0], __var[0]);
                 }
             }else{
                 backup_obs_single(trace, games[trace.back()].score, 0);
             }
         }
 
+        void apply_virtual_loss(const std::vector<int> &trace, int n){
+            for(auto idx : trace){
+                int o = node_to_obs[idx];
+                auto lock = lock_stats(o);
+                visit_obs[o] += n;
+                value_obs[o] -= n * virtual_loss;
+            }
+        }
+
+        std::unique_lock<std::mutex> lock_stats(int o){
+            if(threads > 1)
+                return std::unique_lock<std::mutex>(stat_locks[o % n_stat_locks]);
+            return std::unique_lock<std::mutex>();
+        }
+
+        // backups only hold the stat locks, so selection takes them as well when workers share the tree
         std::vector<int> selection_obs(int low){
-            std::vector<int> trace;
-            int index = root;
+            if(threads > 1)
+                return TreeAgent::selection_obs(low, 0, [this](int o){ return lock_stats(o); });
+            return TreeAgent::selection_obs(low);
+        }
 
-            std::vector<float> _val, _var;
-            std::vector<int> _vis, c_nodes, c_obs;
+        void mcts_parallel(){
+            sims_left = sims;
+            active_workers = threads;
+            search_stop = false;
+            search_error = nullptr;
+
+            std::vector<std::thread> workers;
+            for(int t=0;t<threads;++t)
+                workers.emplace_back(&MCTSAgent::mcts_worker, this);
+
+            serve_evaluations();
+
+            for(auto &w : workers)
+                w.join();
+
+            if(search_error)
+                std::rethrow_exception(search_error);
+        }
+
+        void stop_search(std::exception_ptr error){
+            std::lock_guard<std::mutex> lock(queue_mutex);
+            if(!search_error)
+                search_error = error;
+            search_stop = true;
+        }
+
+        void submit(EvalRequest &request){
+            std::unique_lock<std::mutex> lock(queue_mutex);
+            eval_queue.push_back(&request);
+            queue_cv.notify_one();
+            done_cv.wait(lock, [&]{ return request.done; });
+        }
+
+        void serve_evaluations(){
+            std::vector<EvalRequest*> batch;
+            std::vector<char> f_obs;
+            std::vector<float> __val, __var, __a_val, __a_var;
             while(true){
-                trace.push_back(index);
+                {
+                    std::unique_lock<std::mutex> lock(queue_mutex);
+                    queue_cv.wait_for(lock, eval_wait, [&]{ return eval_queue.size() >= size_t(active_workers); });
+                    if(eval_queue.empty()){
+                        if(active_workers == 0) break;
+                        continue;
+                    }
+                    batch.swap(eval_queue);
+                }
 
-                get_unique_obs(index, c_nodes, c_obs);
-                
-                if(c_nodes.empty()) break;
-
-                int o = _check_low(c_obs, visit_obs, low);
-
-                if(o == 0){
-                    _vis.resize(c_nodes.size());
-                    _val.resize(c_nodes.size());
-                    _var.resize(c_nodes.size());
-                    for(size_t i=0;i<c_nodes.size(); ++i){
-                        int _o = c_obs[i], _c = c_nodes[i];
-                        _vis[i] = visit_obs[_o];
-                        _val[i] = value_obs[_o] + score[_c] - score[index];
-                        _var[i] = variance_obs[_o];
+                size_t n = 0;
+                for(auto r : batch)
+                    n += r->n;
+                bool failed = false;
+                try{
+                    char *obs = observation_buffer(f_obs, n);
+                    for(auto r : batch){
+                        std::copy(r->obs.begin(), r->obs.end(), obs);
+                        obs += r->obs.size();
+                    }
+                    obs -= n * bStride;
+
+                    if(evaluator_type == NATIVE_VALUE){
+                        evaluate(obs, n, __val, __var);
+                    }else{
+                        py::gil_scoped_acquire acquire;
+                        if(evaluator_type == ACTION_VALUE)
+                            evaluate_actions(obs, n, __val, __var, __a_val, __a_var);
+                        else
+                            evaluate(obs, n, __val, __var);
+                    }
+                }catch(...){
+                    failed = true;
+                    stop_search(std::current_exception());
+                }
+
+                size_t offset = 0;
+                for(auto r : batch){
+                    if(!failed){
+                        r->value.assign(__val.begin() + offset, __val.begin() + offset + r->n);
+                        r->variance.assign(__var.begin() + offset, __var.begin() + offset + r->n);
+                        if(evaluator_type == ACTION_VALUE){
+                            r->action_value.assign(__a_val.begin() + offset * n_actions, __a_val.begin() + (offset + r->n) * n_actions);
+                            r->action_variance.assign(__a_var.begin() + offset * n_actions, __a_var.begin() + (offset + r->n) * n_actions);
+                        }
+                    }
+                    offset += r->n;
+                }
+                {
+                    std::lock_guard<std::mutex> lock(queue_mutex);
+                    for(auto r : batch)
+                        r->done = true;
+                }
+                done_cv.notify_all();
+                batch.clear();
+            }
+        }
+
+        void mcts_worker(){
+            try{
+                std::vector<int> trace, c_nodes, c_obs;
+                while(sims_left.fetch_sub(1) > 0){
+                    EvalRequest request;
+                    int leaf;
+                    bool terminal;
+                    {
+                        std::lock_guard<std::mutex> lock(tree_mutex);
+                        if(search_stop) break;
+                        trace = selection_obs(1);
+                        apply_virtual_loss(trace, 1);
+
+                        leaf = trace.back();
+                        terminal = games[leaf].end;
+                        if(!terminal){
+                            _expand(games[leaf]);
+                            if(leaf_parallelization){
+                                get_unique_obs(leaf, c_nodes, c_obs);
+                                request.obs = fetch_observations(c_obs);
+                                request.n = c_obs.size();
+                            }else{
+                                request.obs.resize(bStride);
+                                leaf_observation(leaf, request.obs.data());
+                                request.n = 1;
+                            }
+                        }
+                    }
+
+                    if(!terminal)
+                        submit(request);
+
+                    apply_virtual_loss(trace, -1);
+
+                    if(terminal){
+                        backup_obs_single(trace, games[leaf].score, 0);
+                    }else if(request.value.size() != request.n){
+                        break;
+                    }else if(leaf_parallelization){
+                        backup_obs(trace, c_nodes, c_obs, request.value, request.variance, false, true);
+                    }else{
+                        if(evaluator_type == ACTION_VALUE){
+                            std::lock_guard<std::mutex> lock(tree_mutex);
+                            seed_children(leaf, &request.action_value[0], &request.action_variance[0], c_nodes, c_obs);
+                        }
+                        backup_obs_single(trace, score[leaf] + request.value[0], request.variance[0]);
+                    }
+                }
+            }catch(...){
+                stop_search(std::current_exception());
+            }
+            {
+                std::lock_guard<std::mutex> lock(queue_mutex);
+                --active_workers;
+            }
+            queue_cv.notify_one();
+        }
+
+        void mcts_batch(int n){
+
+            std::vector<std::vector<int>> traces(n);
+            for(int k=0;k<n;++k){
+                traces[k] = selection_obs(1);
+                apply_virtual_loss(traces[k], 1);
+            }
+
+            std::vector<int> leaves;
+            for(auto &trace : traces){
+                int leaf = trace.back();
+                if(games[leaf].end) continue;
+                if(std::find(leaves.begin(), leaves.end(), leaf) == leaves.end()){
+                    leaves.push_back(leaf);
+                    _expand(games[leaf]);
+                }
+            }
+
+            std::vector<float> __val, __var;
+            std::vector<std::vector<int>> c_nodes(n), c_obs(n);
+            std::unordered_map<int, size_t> batch_index;
+            if(leaf_parallelization){
+                std::vector<int> batch_obs;
+                for(int k=0;k<n;++k){
+                    if(games[traces[k].back()].end) continue;
+                    get_unique_obs(traces[k].back(), c_nodes[k], c_obs[k]);
+                    for(auto o : c_obs[k]){
+                        if(batch_index.emplace(o, batch_obs.size()).second)
+                            batch_obs.push_back(o);
                     }
-                    index = policy_clt(c_nodes, _vis, _val, _var);
+                }
+                if(!batch_obs.empty()){
+                    std::vector<char> f_obs;
+                    char *obs = observation_buffer(f_obs, batch_obs.size());
+                    fetch_observations(batch_obs, obs);
+                    evaluate(obs, batch_obs.size(), __val, __var);
+                }
+            }else if(!leaves.empty()){
+                std::vector<char> f_obs;
+                char *obs = observation_buffer(f_obs, leaves.size());
+                for(size_t i=0;i<leaves.size();++i){
+                    leaf_observation(leaves[i], obs + i * bStride);
+                    batch_index[leaves[i]] = i;
+                }
+                if(evaluator_type == ACTION_VALUE){
+                    std::vector<float> __a_val, __a_var;
+                    std::vector<int> _c, _o;
+                    evaluate_actions(obs, leaves.size(), __val, __var, __a_val, __a_var);
+                    for(size_t i=0;i<leaves.size();++i)
+                        seed_children(leaves[i], &__a_val[i * n_actions], &__a_var[i * n_actions], _c, _o);
                 }else{
-                    auto o_it = std::find(c_obs.begin(), c_obs.end(), o);
-                    index = c_nodes[o_it - c_obs.begin()];
+                    evaluate(obs, leaves.size(), __val, __var);
+                }
+            }
+
+            for(auto &trace : traces)
+                apply_virtual_loss(trace, -1);
+
+            std::vector<float> _val, _var;
+            for(int k=0;k<n;++k){
+                std::vector<int> &trace = traces[k];
+                int leaf = trace.back();
+                if(games[leaf].end){
+                    backup_obs_single(trace, games[leaf].score, 0);
+                }else if(leaf_parallelization){
+                    _val.clear();
+                    _var.clear();
+                    for(auto o : c_obs[k]){
+                        size_t b = batch_index[o];
+                        _val.push_back(__val[b]);
+                        _var.push_back(__var[b]);
+                    }
+                    backup_obs(trace, c_nodes[k], c_obs[k], _val, _var, false, true);
+                }else{
+                    size_t b = batch_index[leaf];
+                    backup_obs_single(trace, score[leaf] + __val[b], __var[b]);
                 }
             }
-            return trace;
         }
 
         void backup_obs_single(std::vector<int> &trace, float _val, float _var){
@@ -498,6 +1271,7 @@ class MCTSAgent: public TreeAgent {
                 int c_idx = trace[i];
                 int o_idx = node_to_obs[c_idx];
                 _val -= score[c_idx];
+                auto lock = lock_stats(o_idx);
                 if(visit_obs[o_idx] == 0){
                     value_obs[o_idx] = _val;
                     variance_obs[o_idx] = _var;    
@@ -533,24 +1307,30 @@ class MCTSAgent: public TreeAgent {
                 for(size_t i=0;i<_child.size(); ++i){
                     int __c = _child[i];
                     int __o = _obs[i];
-                    if(visit_obs[__o] == 0){
-                        visit_obs[__o] += 1;
-                        if(end_obs[__o]){
-                            value_obs[__o] = 0;
-                            variance_obs[__o] = 0;
-                        }else{
-                            value_obs[__o] = _value[i];
-                            variance_obs[__o] = _variance[i];
+                    float __val, __var;
+                    {
+                        auto lock = lock_stats(__o);
+                        if(visit_obs[__o] == 0){
+                            visit_obs[__o] += 1;
+                            if(end_obs[__o]){
+                                value_obs[__o] = 0;
+                                variance_obs[__o] = 0;
+                            }else{
+                                value_obs[__o] = _value[i];
+                                variance_obs[__o] = _variance[i];
+                            }
                         }
+                        __val = value_obs[__o];
+                        __var = variance_obs[__o];
                     }
                     if(averaged){
-                        _val_tmp += score[__c] + gamma * value_obs[__o];
-                        _var_tmp += variance_obs[__o];
+                        _val_tmp += score[__c] + gamma * __val;
+                        _var_tmp += __var;
                     }else{
                         if(mixture)
-                            backup_obs_single_mixture(trace, value_obs[__o] * gamma + score[__c], variance_obs[__o]);
+                            backup_obs_single_mixture(trace, __val * gamma + score[__c], __var);
                         else
-                            backup_obs_single(trace, value_obs[__o] * gamma + score[__c], variance_obs[__o]);
+                            backup_obs_single(trace, __val * gamma + score[__c], __var);
                     }
                 }
                 if(averaged){
@@ -571,6 +1351,8 @@ class MCTSAgent: public TreeAgent {
 class OnlineMCTSAgent: public MCTSAgent {
     public:
         bool online;
+        // action-value agents also store the afterstate stats of every action
+        bool afterstates;
 
         int accumulation_policy;
         int memory_size, memory_growth_rate, memory_index;
@@ -584,8 +1366,9 @@ class OnlineMCTSAgent: public MCTSAgent {
 
         py::function train;
         py::array_t<float> m_state, m_value, m_variance, m_visit;
+        py::array_t<float> m_a_value, m_a_variance, m_a_mask;
 
-        OnlineMCTSAgent(int _sims, int _max_nodes, bool _online, int _accumulation_policy, int _memory_size, int _episodes_per_train, int _memory_growth_rate, int _min_visit, bool _projection, double _gamma, bool _benchmark, py::function _eval, int _eval_type, py::function _train, bool _LP): MCTSAgent(_sims, _max_nodes, _projection, _gamma, _benchmark, _eval, _eval_type, _LP){
+        OnlineMCTSAgent(int _sims, int _max_nodes, bool _online, int _accumulation_policy, int _memory_size, int _episodes_per_train, int _memory_growth_rate, int _min_visit, bool _projection, double _gamma, bool _benchmark, py::function _eval, int _eval_type, py::function _train, bool _LP, int _batch_size, float _virtual_loss, int _threads, int _tt_size): MCTSAgent(_sims, _max_nodes, _projection, _gamma, _benchmark, _eval, _eval_type, _LP, _batch_size, _virtual_loss, _threads, _tt_size){
             accumulation_policy = _accumulation_policy;
 
             memory_size = _memory_size;
@@ -605,12 +1388,20 @@ class OnlineMCTSAgent: public MCTSAgent {
             last_training_episode = 0;
 
             online = _online;
+            afterstates = _eval_type == ACTION_VALUE;
 
             if(online){
+                if(afterstates && !projection)
+                    throw std::invalid_argument("afterstate targets need projection");
                 m_state.resize({memory_size, 1, 20, 10});
                 m_visit.resize({memory_size, 1});
                 m_value.resize({memory_size, 1});
                 m_variance.resize({memory_size, 1});
+                if(afterstates){
+                    m_a_value.resize({memory_size, int(n_actions)});
+                    m_a_variance.resize({memory_size, int(n_actions)});
+                    m_a_mask.resize({memory_size, int(n_actions)});
+                }
                 train = _train;
             }
 
@@ -623,88 +1414,118 @@ class OnlineMCTSAgent: public MCTSAgent {
         
             if(!benchmark && online){
                
-                if(projection){
-                    store_nodes(available_obs);
+                if(afterstates){
+                    store_afterstates(released);
+                }else if(projection){
+                    store_nodes(released_obs);
                 }else{
-                    store_nodes(available);
+                    store_nodes(released);
                 }
 
-                std::cerr << "Memory usage: " << memory_index << " / " << memory_size << std::endl;
+                train_nodes();
+            }
 
-                bool pass = false;
-                if(accumulation_policy == 0){
-                    if(last_accumulation_episode != current_episode){
-                        nodes_per_episode.push_back(accumulated_nodes);
-                        if(nodes_per_episode.size() > episodes_per_train)
-                            nodes_per_episode.pop_front();
-                        int sum = std::accumulate(nodes_per_episode.begin(), nodes_per_episode.end(), 0);
-                        memory_drop_prob = std::max(0., 1. - double(memory_size) / sum);
-                        
-                        accumulated_nodes = 0;
-                        last_accumulation_episode = current_episode;
+            reset_arrays();         
+        }
 
-                        std::cerr << "Average nodes stored per episode: " << sum / nodes_per_episode.size()
-                            << "    Memory dropping probability: " << memory_drop_prob << std::endl;
-                    }
+        void collect_released(){
+            if(!benchmark && online){
+                if(afterstates){
+                    store_afterstates(released, false);
+                }else if(projection){
+                    store_nodes(released_obs, false);
+                }else{
+                    store_nodes(released, false);
+                }
+            }
+        }
 
-                    int diff = current_episode - last_training_episode;
-                    pass = diff >= episodes_per_train;
-                    if(pass){
-                        std::cerr << "Enough episodes (" << diff << " >= " << episodes_per_train << "), proceed to training." << std::endl;
-                    }else{
-                        if(memory_index >= memory_size){
-                            std::cerr << "Memory limit exceeded, trimming memory." << std::endl;
-                            random_trimming(0.01);
-                            std::cerr << "Memory usage: " << memory_index << " / " << memory_size << std::endl;
-                        }
-                        std::cerr << "Not enough episodes (" << diff << " < " << episodes_per_train << "), collecting more episodes." << std::endl;
-                    }
-                }else if(accumulation_policy == 1){
-                    int diff = current_episode - last_training_episode;
-                    pass = diff >= episodes_per_train;
-                    if(pass){
-                        std::cerr << "Enough episodes (" << diff << " >= " << episodes_per_train << "), proceed to training." << std::endl;
-                    }else{
-                        if(memory_index >= memory_size){
-                            double percentile = 0.01;
-                            std::cerr << "Memory limit exceeded, trimming memory." << std::endl;
-                            weighted_trimming(percentile);
-                            std::cerr << "Memory usage: " << memory_index << " / " << memory_size << std::endl;
-                        }
-                        std::cerr << "Not enough episodes (" << diff << " < " << episodes_per_train << "), collecting more episodes." << std::endl;
-                    }
-                }else if(accumulation_policy == 2){
-                    int diff = current_episode - last_training_episode;
-                    pass = diff >= episodes_per_train || memory_index >= memory_size;
-                    if(diff >= episodes_per_train){
-                        std::cerr << "Enough episodes (" << diff << " >= " << episodes_per_train << "), proceed to training." << std::endl;
-                    }else if(memory_index >= memory_size){
-                        std::cerr << "Memory limit exceeded (" << memory_index << " >= " << memory_size << "), proceed to training." << std::endl;
-                    }else{
-                        std::cerr << "Not enough episodes (" << diff << " < " << episodes_per_train << "), collecting more episodes." << std::endl;
+        void end_episode(){
+            if(!benchmark && online)
+                train_nodes();
+        }
+
+        void train_nodes(){
+
+            std::cerr << "Memory usage: " << memory_index << " / " << memory_size << std::endl;
+
+            bool pass = false;
+            if(accumulation_policy == 0){
+                if(last_accumulation_episode != current_episode){
+                    nodes_per_episode.push_back(accumulated_nodes);
+                    if(nodes_per_episode.size() > episodes_per_train)
+                        nodes_per_episode.pop_front();
+                    int sum = std::accumulate(nodes_per_episode.begin(), nodes_per_episode.end(), 0);
+                    memory_drop_prob = std::max(0., 1. - double(memory_size) / sum);
+                    
+                    accumulated_nodes = 0;
+                    last_accumulation_episode = current_episode;
+
+                    std::cerr << "Average nodes stored per episode: " << sum / nodes_per_episode.size()
+                        << "    Memory dropping probability: " << memory_drop_prob << std::endl;
+                }
+
+                int diff = current_episode - last_training_episode;
+                pass = diff >= episodes_per_train;
+                if(pass){
+                    std::cerr << "Enough episodes (" << diff << " >= " << episodes_per_train << "), proceed to training." << std::endl;
+                }else{
+                    if(memory_index >= memory_size){
+                        std::cerr << "Memory limit exceeded, trimming memory." << std::endl;
+                        random_trimming(0.01);
+                        std::cerr << "Memory usage: " << memory_index << " / " << memory_size << std::endl;
                     }
-                }else if(accumulation_policy == 3){
-                    int m_size = std::min(n_trains * memory_growth_rate, memory_size);
-                    pass = memory_index >= m_size;
-                    if(pass){
-                        std::cerr << "Enough training data (" << memory_index << " >= " << m_size << "), proceed to training." << std::endl;
-                    }else{
-                        std::cerr << "Not enough training data (" << memory_index << " < " << m_size << "), collecting more data." << std::endl;
+                    std::cerr << "Not enough episodes (" << diff << " < " << episodes_per_train << "), collecting more episodes." << std::endl;
+                }
+            }else if(accumulation_policy == 1){
+                int diff = current_episode - last_training_episode;
+                pass = diff >= episodes_per_train;
+                if(pass){
+                    std::cerr << "Enough episodes (" << diff << " >= " << episodes_per_train << "), proceed to training." << std::endl;
+                }else{
+                    if(memory_index >= memory_size){
+                        double percentile = 0.01;
+                        std::cerr << "Memory limit exceeded, trimming memory." << std::endl;
+                        weighted_trimming(percentile);
+                        std::cerr << "Memory usage: " << memory_index << " / " << memory_size << std::endl;
                     }
- 
+                    std::cerr << "Not enough episodes (" << diff << " < " << episodes_per_train << "), collecting more episodes." << std::endl;
                 }
-
+            }else if(accumulation_policy == 2){
+                int diff = current_episode - last_training_episode;
+                pass = diff >= episodes_per_train || memory_index >= memory_size;
+                if(diff >= episodes_per_train){
+                    std::cerr << "Enough episodes (" << diff << " >= " << episodes_per_train << "), proceed to training." << std::endl;
+                }else if(memory_index >= memory_size){
+                    std::cerr << "Memory limit exceeded (" << memory_index << " >= " << memory_size << "), proceed to training." << std::endl;
+                }else{
+                    std::cerr << "Not enough episodes (" << diff << " < " << episodes_per_train << "), collecting more episodes." << std::endl;
+                }
+            }else if(accumulation_policy == 3){
+                int m_size = std::min(n_trains * memory_growth_rate, memory_size);
+                pass = memory_index >= m_size;
                 if(pass){
-                    train(m_state, m_value, m_variance, m_visit, memory_index);
-                    ++n_trains;
-                    memory_index = 0;
-                    last_training_episode = current_episode;
-                    std::cerr << "Training complete." << std::endl;
+                    std::cerr << "Enough training data (" << memory_index << " >= " << m_size << "), proceed to training." << std::endl;
+                }else{
+                    std::cerr << "Not enough training data (" << memory_index << " < " << m_size << "), collecting more data." << std::endl;
                 }
-
+ 
             }
 
-            reset_arrays();         
+            if(pass){
+                {
+                    py::gil_scoped_acquire acquire;
+                    if(afterstates)
+                        train(m_state, m_value, m_variance, m_visit, memory_index, m_a_value, m_a_variance, m_a_mask);
+                    else
+                        train(m_state, m_value, m_variance, m_visit, memory_index);
+                }
+                ++n_trains;
+                ++transposition.version;
+                memory_index = 0;
+                last_training_episode = current_episode;
+                std::cerr << "Training complete." << std::endl;
+            }
         }
 
         void weighted_trimming(double percentile){
@@ -744,6 +1565,7 @@ class OnlineMCTSAgent: public MCTSAgent {
                 for(int c=0;c<_state.shape(2);++c)
                     for(int r=0;r<_state.shape(3);++r)
                         _state(idx_fill, 0, c, r) = _state(i, 0, c, r);
+                move_afterstates(idx_fill, i);
                 ++idx_fill;
             }
         }
@@ -768,25 +1590,73 @@ class OnlineMCTSAgent: public MCTSAgent {
                     for(int c=0;c<_state.shape(2);++c)
                         for(int r=0;r<_state.shape(3);++r)
                             _state(idx_fill, 0, c, r) = _state(start, 0, c, r);
+                    move_afterstates(idx_fill, start);
                     ++idx_fill;
                 }
             }
             memory_index -= indices.size();
         }
 
-        void store_nodes(std::vector<int> &avail){
-            std::cerr << "Storing unused nodes..." << std::endl;
+        void move_afterstates(int dst, int src){
+            if(!afterstates) return;
+            for(auto m : {&m_a_value, &m_a_variance, &m_a_mask})
+                std::copy_n(m->data(src, 0), n_actions, m->mutable_data(dst, 0));
+        }
+
+        // one row per released obs: its board and stats, and the obs stats reached by each action.
+        // The pseudo-visit seeded by the evaluator itself is not a target, so an afterstate
+        // needs a visit of its own unless it ends the game.
+        void store_afterstates(const std::vector<int> &nodes, bool verbose=true){
+            if(verbose)
+                std::cerr << "Storing unused nodes..." << std::endl;
+
+            std::unordered_set<int> stored;
+            for(auto v : nodes){
+                if(memory_index >= memory_size) break;
+                int o = node_to_obs[v];
+                if(refs_obs[o] > 0 || visit_obs[o] < min_visit || end_obs[o]) continue;
+                if(!stored.insert(o).second) continue;
+
+                ++accumulated_nodes;
+                if(accumulation_policy == 0 && unif(mt) < memory_drop_prob) continue;
+
+                *m_visit.mutable_data(memory_index, 0) = visit_obs[o];
+                *m_value.mutable_data(memory_index, 0) = value_obs[o];
+                *m_variance.mutable_data(memory_index, 0) = variance_obs[o];
+                const char *state = obs_state(o);
+                std::copy(state, state + bStride, m_state.mutable_data(memory_index));
+
+                for(size_t a=0;a<n_actions;++a){
+                    float val = 0, var = 0, mask = 0;
+                    int c = child[v][a];
+                    if(c != 0){
+                        int co = node_to_obs[c];
+                        if(end_obs[co] || visit_obs[co] > 1){
+                            val = value_obs[co];
+                            var = variance_obs[co];
+                            mask = 1;
+                        }
+                    }
+                    *m_a_value.mutable_data(memory_index, a) = val;
+                    *m_a_variance.mutable_data(memory_index, a) = var;
+                    *m_a_mask.mutable_data(memory_index, a) = mask;
+                }
+                ++memory_index;
+            }
+        }
+
+        void store_nodes(std::vector<int> &avail, bool verbose=true){
+            if(verbose)
+                std::cerr << "Storing unused nodes..." << std::endl;
         
             std::vector<float> *__val, *__var;
             std::vector<int> *__vis;
-            std::vector<std::vector<char>> *__state;
-            std::vector<bool> *__end;
+            std::vector<char> *__end;
 
             if(projection){
                 __val = &value_obs;
                 __var = &variance_obs;
                 __vis = &visit_obs;
-                __state = &state_obs;
                 __end = &end_obs;
             }else{
                 __val = &value;
@@ -796,6 +1666,7 @@ class OnlineMCTSAgent: public MCTSAgent {
             }
 
             for(auto idx : avail){
+                if(memory_index >= memory_size) break;
                 if((*__vis)[idx] < min_visit || (*__end)[idx]) continue;
 
                 ++accumulated_nodes;
@@ -805,39 +1676,114 @@ class OnlineMCTSAgent: public MCTSAgent {
                 *m_value.mutable_data(memory_index, 0) = (*__val)[idx];
                 *m_variance.mutable_data(memory_index, 0) = (*__var)[idx];
                 if(projection){
-                    for(int c=0;c<m_state.shape(2);++c)
-                        for(int r=0;r<m_state.shape(3);++r)
-                            *m_state.mutable_data(memory_index, 0, c, r) = (*__state)[idx][m_state.shape(3) * c + r];
+                    const char *state = obs_state(idx);
+                    std::copy(state, state + bStride, m_state.mutable_data(memory_index));
                 }else{
-                    for(int c=0;c<m_state.shape(2);++c)
-                        for(int r=0;r<m_state.shape(3);++r)
-                            *m_state.mutable_data(memory_index, 0, c, r) = *games[idx].getState().data(c, r);
+                    std::vector<char> state = games[idx]._getState();
+                    std::copy(state.begin(), state.end(), m_state.mutable_data(memory_index));
                 }
-                if(++memory_index == memory_size) break;
+                ++memory_index;
             }
 
         }
 };
 
+// lets python subclasses of TreeAgent override the hooks the node pool calls
+class PyTreeAgent: public TreeAgent {
+    public:
+        using TreeAgent::TreeAgent;
+
+        void remove_nodes() override { PYBIND11_OVERRIDE(void, TreeAgent, remove_nodes, ); }
+        void collect_released() override { PYBIND11_OVERRIDE(void, TreeAgent, collect_released, ); }
+        void reset_arrays() override { PYBIND11_OVERRIDE(void, TreeAgent, reset_arrays, ); }
+        void end_episode() override { PYBIND11_OVERRIDE(void, TreeAgent, end_episode, ); }
+};
+
+// zero-copy numpy view of a node pool array, it does not keep the agent alive
+template<typename T, typename V>
+py::array_t<T> pool_view(V &v, std::vector<size_t> shape){
+    return py::array_t<T>(shape, reinterpret_cast<T*>(v.data()), py::capsule(&v, [](void*){}));
+}
+
 PYBIND11_MODULE(agent, m) {
+    m.def("seed", &seed);
+    py::register_exception<TraceOverflow>(m, "TraceOverflow", PyExc_ValueError);
     py::class_<Agent>(m, "Agent")
         .def(py::init<const bool &>());
-    py::class_<TreeAgent, Agent>(m, "TreeAgent")
-        //TreeAgent(int _sims, int _max_nodes, py::object _env, py::object _env_args, bool _projection, int _min_visits)
-        .def(py::init<const int &, const bool &, const int &>())
+    py::class_<TreeAgent, PyTreeAgent, Agent>(m, "TreeAgent")
+        .def(py::init<int, bool, bool, int>(),
+             py::arg("max_nodes") = 100000, py::arg("projection") = true, py::arg("benchmark") = false, py::arg("tt_size") = 0)
         .def("remove_nodes", &TreeAgent::remove_nodes)
+        .def("collect_released", &TreeAgent::collect_released)
+        .def("reset_arrays", &TreeAgent::reset_arrays)
+        .def("end_episode", &TreeAgent::end_episode)
         .def("new_node", &TreeAgent::new_node)
+        .def("get_game", &TreeAgent::get_game)
         .def("update_available", &TreeAgent::update_available)
         .def("update_root", &TreeAgent::update_root)
         .def("compute_stats", &TreeAgent::compute_stats)
-        .def("expand", &TreeAgent::expand);
+        .def("get_stats", &TreeAgent::get_stats)
+        .def("expand", &TreeAgent::expand)
+        .def("select_trace", &TreeAgent::select_trace)
+        .def("fill_traces", &TreeAgent::fill_traces)
+        .def("unique_children", &TreeAgent::unique_children)
+        .def_readwrite("current_episode", &TreeAgent::current_episode)
+        .def_readonly("root", &TreeAgent::root)
+        .def_readonly("max_nodes", &TreeAgent::max_nodes)
+        .def_readonly("projection", &TreeAgent::projection)
+        .def_readonly("occupied", &TreeAgent::occupied)
+        .def_readonly("released", &TreeAgent::released)
+        .def_readonly("occupied_obs", &TreeAgent::occupied_obs)
+        .def_readonly("released_obs", &TreeAgent::released_obs)
+        .def("pool_views", [](TreeAgent &a){
+             // node arrays, obs arrays and node_to_obs in the layouts of the numba and core kernels,
+             // valid for the lifetime of the agent
+             size_t n = a.max_nodes, n_obs = a.projection ? n : 0;
+             py::dict arrays, obs_arrays;
+             arrays["child"] = pool_view<int>(a.child, {n, n_actions});
+             arrays["visit"] = pool_view<int>(a.visit, {n});
+             arrays["value"] = pool_view<float>(a.value, {n});
+             arrays["variance"] = pool_view<float>(a.variance, {n});
+             arrays["episode"] = pool_view<int>(a.episode, {n});
+             arrays["score"] = pool_view<float>(a.score, {n});
+             arrays["end"] = pool_view<bool>(a.end, {n});
+             obs_arrays["state"] = pool_view<int8_t>(a.state_obs, {n_obs, size_t(20), size_t(10)});
+             obs_arrays["visit"] = pool_view<int>(a.visit_obs, {n_obs});
+             obs_arrays["value"] = pool_view<float>(a.value_obs, {n_obs});
+             obs_arrays["variance"] = pool_view<float>(a.variance_obs, {n_obs});
+             obs_arrays["end"] = pool_view<bool>(a.end_obs, {n_obs});
+             obs_arrays["key"] = pool_view<uint64_t>(a.key_obs, {n_obs});
+             return py::make_tuple(arrays, obs_arrays, pool_view<int>(a.node_to_obs, {n_obs})); })
+        .def_property("model_version",
+             [](const TreeAgent &a){ return a.transposition.version; },
+             [](TreeAgent &a, int v){ a.transposition.version = v; })
+        .def("transposition_stats", [](const TreeAgent &a){
+             return py::make_tuple(a.transposition.size(), a.transposition.hits, a.transposition.misses); })
+        .def_property_readonly("state_obs", [](py::object self){
+             // read-only view of the observation slab indexed by obs id, kept alive by the agent
+             TreeAgent &a = self.cast<TreeAgent&>();
+             size_t n = a.state_obs.size() / bStride;
+             py::array_t<char> view({n, size_t(1), size_t(20), size_t(10)}, a.state_obs.data(), self);
+             view.attr("setflags")(py::arg("write") = false);
+             return view; });
     py::class_<MCTSAgent, TreeAgent>(m, "MCTSAgent")
-        .def(py::init<const int &, const int &, const bool &, const double &, const bool &, py::function &, const int &, const bool &>())
-        .def("play", &MCTSAgent::play);
+        .def(py::init<const int &, const int &, const bool &, const double &, const bool &, py::object &, const int &, const bool &, const int &, const float &, const int &, const int &, const int &, const int &, const int &>(),
+             py::arg("sims") = 100, py::arg("max_nodes") = 100000, py::arg("projection") = true, py::arg("gamma") = 0.999,
+             py::arg("benchmark") = false, py::arg("evaluator") = py::none(), py::arg("evaluation_type") = 0, py::arg("LP") = true,
+             py::arg("batch_size") = 1, py::arg("virtual_loss") = 0., py::arg("threads") = 1, py::arg("tt_size") = 0,
+             py::arg("rollouts") = 1, py::arg("rollout_policy") = 0, py::arg("rollout_threads") = 1)
+        .def("play", &MCTSAgent::play)
+        .def("set_native_model", &MCTSAgent::set_native_model)
+        .def_readwrite("evaluator", &MCTSAgent::evaluator)
+        .def_readonly("evaluation_type", &MCTSAgent::evaluator_type)
+        .def_readonly("eval_input", &MCTSAgent::eval_input)
+        .def_readonly("eval_output", &MCTSAgent::eval_output);
     py::class_<OnlineMCTSAgent, MCTSAgent>(m, "OnlineMCTSAgent")
-        .def(py::init<int &, int &, bool &, int &, int &, int &, int &, int &, bool &, double &, bool &, py::function &, int &, py::function &, bool&>(),
+        .def(py::init<int &, int &, bool &, int &, int &, int &, int &, int &, bool &, double &, bool &, py::function &, int &, py::function &, bool &, int &, float &, int &, int &>(),
              py::arg("sims") = 100, py::arg("max_nodes") = 100000, py::arg("online") = true, py::arg("accumulation_policy") = 0,
              py::arg("memory_size") = 500000, py::arg("episodes_per_train") = 25, py::arg("memory_growth_rate") = 5000,
              py::arg("min_visit") = 25, py::arg("projection") = true, py::arg("gamma") = 0.999, py::arg("benchmark") = false,
-             py::arg("evaluator") = py::none(), py::arg("evaluation_type") = 0, py::arg("train") = py::none(), py::arg("LP") = true);
+             py::arg("evaluator") = py::none(), py::arg("evaluation_type") = 0, py::arg("train") = py::none(), py::arg("LP") = true,
+             py::arg("batch_size") = 1, py::arg("virtual_loss") = 0., py::arg("threads") = 1, py::arg("tt_size") = 0)
+        .def_readonly("online", &OnlineMCTSAgent::online);
 }
@@ -13,6 +13,10 @@ setup_pybind11(cfg)
 
 namespace py = pybind11;
 
+void seed(unsigned int s){
+    srand(s);
+}
+
 /*
     PYBIND11
 */
@@ -23,4 +27,8 @@ PYBIND11_MODULE(core, m){
     m.def("select_trace_obs", &select_trace_obs);
     m.def("backup_trace_obs", &backup_trace_obs);
     m.def("backup_trace_obs_LP", &backup_trace_obs_LP);
+    m.def("select_traces_obs", &select_traces_obs);
+    m.def("backup_traces_obs", &backup_traces_obs);
+    m.def("backup_traces_obs_LP", &backup_traces_obs_LP);
+    m.def("seed", &seed);
 }
@@ -9,6 +9,8 @@
 #include<cmath>
 #include<special.h>
 #include<iostream>
+#include<new>
+#include<stdexcept>
 #include<pyTetris.h>
 #include<pybind11/pybind11.h>
 #include<pybind11/numpy.h>
@@ -29,6 +31,25 @@ void print_container(T &c){
     std::cout << std::endl;
 }
 
+std::vector<bool> game_padding(){
+    alignas(Tetris) unsigned char a[sizeof(Tetris)], b[sizeof(Tetris)];
+    std::fill_n(a, sizeof(Tetris), 0x00);
+    std::fill_n(b, sizeof(Tetris), 0xff);
+
+    Tetris *g_a = new (a) Tetris();
+    Tetris *g_b = new (b) Tetris();
+    g_a->copy_from(*g_b);
+
+    std::vector<bool> padding(sizeof(Tetris));
+    for(size_t i=0; i < sizeof(Tetris); ++i)
+        padding[i] = a[i] != b[i];
+
+    g_a->~Tetris();
+    g_b->~Tetris();
+
+    return padding;
+}
+
 std::unordered_set<size_t> get_all_childs(size_t index, py::array_t<int, 1> child){
 
     std::deque<size_t> to_traverse({index});
@@ -62,8 +83,8 @@ int _check_low(const std::vector<int> &indices, const std::vector<int> &count, i
         return low[rand() % low.size()];
 }
 
-int check_low(const std::vector<int> &indices, const py::array_t<int, 1> &count, int n){
-    auto count_uc = count.unchecked<1>();
+template<typename Count>
+int check_low_uc(const std::vector<int> &indices, const Count &count_uc, int n){
     std::deque<int> low;
     for(int i : indices){
         if(count_uc(i) < n)
@@ -76,6 +97,10 @@ int check_low(const std::vector<int> &indices, const py::array_t<int, 1> &count,
         return low[rand() % low.size()];
 }
 
+int check_low(const std::vector<int> &indices, const py::array_t<int, 1> &count, int n){
+    return check_low_uc(indices, count.unchecked<1>(), n);
+}
+
 /*
     POLICY
 */
@@ -108,18 +133,15 @@ int policy_clt(
     PROJECTION CORES
 */
 
-void get_unique_child_obs(
-        size_t index, 
-        const py::array_t<int, 1> &child, 
-        const py::array_t<float, 1> &score, 
-        const py::array_t<int, 1> &n_to_o,
+template<typename Child, typename Score, typename NtoO>
+void unique_child_obs_uc(
+        size_t index,
+        const Child &child_uc,
+        const Score &score_uc,
+        const NtoO &n_to_o_uc,
         std::vector<int> &c_nodes,
         std::vector<int> &c_obs){
 
-    auto child_uc = child.unchecked<2>();
-    auto score_uc = score.unchecked<1>();
-    auto n_to_o_uc = n_to_o.unchecked<1>();
-
     c_nodes.clear();
     c_obs.clear();
 
@@ -140,7 +162,18 @@ void get_unique_child_obs(
                 c_nodes[idx] = c;
         }
     }
+}
+
+void get_unique_child_obs(
+        size_t index, 
+        const py::array_t<int, 1> &child, 
+        const py::array_t<float, 1> &score, 
+        const py::array_t<int, 1> &n_to_o,
+        std::vector<int> &c_nodes,
+        std::vector<int> &c_obs){
 
+    unique_child_obs_uc(
+        index, child.unchecked<2>(), score.unchecked<1>(), n_to_o.unchecked<1>(), c_nodes, c_obs);
 }
 
 py::tuple get_unique_child_obs_(
@@ -164,85 +197,102 @@ py::tuple get_unique_child_obs_(
     return py::make_tuple(c_nodes, c_obs);
 }
 
-py::array_t<int, 1> select_trace_obs(
-        size_t index, 
-        py::array_t<int, 1> &child,
-        py::array_t<int, 1> &visit,
-        py::array_t<float, 1> &value,
-        py::array_t<float, 1> &variance,
-        py::array_t<float, 1> &score,
-        py::array_t<int, 1> &n_to_o,
-        size_t low){
-
-    auto visit_uc = visit.unchecked<1>();
-    auto value_uc = value.unchecked<1>();
-    auto variance_uc = variance.unchecked<1>();
-    auto score_uc = score.unchecked<1>();
+// scratch space reused across selections so batched calls do not allocate per trace
+struct SelectBuffers{
+    std::vector<int> trace, visit, c_nodes, c_obs;
+    std::vector<float> value, variance;
+
+    SelectBuffers(){
+        visit.reserve(n_actions);
+        value.reserve(n_actions);
+        variance.reserve(n_actions);
+        c_nodes.reserve(n_actions);
+        c_obs.reserve(n_actions);
+    }
+};
 
-    std::vector<int> trace;
+template<typename Child, typename Visit, typename Value, typename Variance, typename Score, typename NtoO>
+void select_trace_obs_uc(
+        size_t index,
+        const Child &child_uc,
+        const Visit &visit_uc,
+        const Value &value_uc,
+        const Variance &variance_uc,
+        const Score &score_uc,
+        const NtoO &n_to_o_uc,
+        size_t low,
+        SelectBuffers &buf){
 
-    std::vector<int> _visit;
-    std::vector<float> _value, _variance;
+    auto &trace = buf.trace;
+    auto &c_nodes = buf.c_nodes;
+    auto &c_obs = buf.c_obs;
 
-    _visit.reserve(n_actions);
-    _value.reserve(n_actions);
-    _variance.reserve(n_actions);
-
-    std::vector<int> c_nodes, c_obs;
-    c_nodes.reserve(n_actions);
-    c_obs.reserve(n_actions);
+    trace.clear();
 
     while(true){
 
         trace.push_back(index);
 
-        get_unique_child_obs(index, child, score, n_to_o, c_nodes, c_obs);
+        unique_child_obs_uc(index, child_uc, score_uc, n_to_o_uc, c_nodes, c_obs);
         if(c_nodes.empty())
             break;
-        int o = check_low(c_obs, visit, low);
+        int o = check_low_uc(c_obs, visit_uc, low);
 
         size_t _s = c_nodes.size();
         if(o == 0){
-            _visit.resize(_s);
-            _value.resize(_s);
-            _variance.resize(_s);
+            buf.visit.resize(_s);
+            buf.value.resize(_s);
+            buf.variance.resize(_s);
             for(size_t i=0; i < _s; ++i){
                 int _o = c_obs[i];
                 int _c = c_nodes[i];
-                _visit[i] = visit_uc(_o);
-                _value[i] = value_uc(_o) + score_uc(_c) - score_uc(index);
-                _variance[i] = variance_uc(_o);
+                buf.visit[i] = visit_uc(_o);
+                buf.value[i] = value_uc(_o) + score_uc(_c) - score_uc(index);
+                buf.variance[i] = variance_uc(_o);
             }
-            index = policy_clt(c_nodes, _visit, _value, _variance);
+            index = policy_clt(c_nodes, buf.visit, buf.value, buf.variance);
         }else{
             auto o_it = std::find(c_obs.begin(), c_obs.end(), o);
             index = c_nodes[std::distance(c_obs.begin(), o_it)];
         }
         
     }
-    return py::array_t<int, 1>(trace.size(), &trace[0]);
 }
 
-void backup_trace_obs(
-        py::array_t<int, 1> &trace,
+py::array_t<int, 1> select_trace_obs(
+        size_t index, 
+        py::array_t<int, 1> &child,
         py::array_t<int, 1> &visit,
         py::array_t<float, 1> &value,
         py::array_t<float, 1> &variance,
-        py::array_t<int, 1> &n_to_o,
         py::array_t<float, 1> &score,
+        py::array_t<int, 1> &n_to_o,
+        size_t low){
+
+    SelectBuffers buf;
+
+    select_trace_obs_uc(
+        index, child.unchecked<2>(), visit.unchecked<1>(), value.unchecked<1>(),
+        variance.unchecked<1>(), score.unchecked<1>(), n_to_o.unchecked<1>(), low, buf);
+
+    return py::array_t<int, 1>(buf.trace.size(), &buf.trace[0]);
+}
+
+template<typename Visit, typename Float, typename NtoO, typename Score>
+void backup_trace_obs_uc(
+        const int *trace,
+        size_t length,
+        Visit &visit_uc,
+        Float &value_uc,
+        Float &variance_uc,
+        const NtoO &n_to_o_uc,
+        const Score &score_uc,
         double _value,
         double _variance,
         double gamma){
 
-    auto trace_uc = trace.unchecked<1>();
-    auto visit_uc = visit.mutable_unchecked<1>();
-    auto value_uc = value.mutable_unchecked<1>();
-    auto variance_uc = variance.mutable_unchecked<1>();
-    auto score_uc = score.unchecked<1>();
-    auto n_to_o_uc = n_to_o.unchecked<1>();
-
-    for(int i=trace.size() - 1; i >= 0; --i){
-        int idx = trace_uc(i);
+    for(int i=length - 1; i >= 0; --i){
+        int idx = trace[i];
         _value -= score_uc(idx);
         int o = n_to_o_uc(idx);
         if(visit_uc(o) == 0){
@@ -259,26 +309,21 @@ void backup_trace_obs(
     }
 }
 
-void backup_trace_mixture_obs(
-        py::array_t<int, 1> &trace,
-        py::array_t<int, 1> &visit,
-        py::array_t<float, 1> &value,
-        py::array_t<float, 1> &variance,
-        py::array_t<int, 1> &n_to_o,
-        py::array_t<float, 1> &score,
+template<typename Visit, typename Float, typename NtoO, typename Score>
+void backup_trace_mixture_obs_uc(
+        const int *trace,
+        size_t length,
+        Visit &visit_uc,
+        Float &value_uc,
+        Float &variance_uc,
+        const NtoO &n_to_o_uc,
+        const Score &score_uc,
         double _value,
         double _variance,
         double gamma){
 
-    auto trace_uc = trace.unchecked<1>();
-    auto visit_uc = visit.mutable_unchecked<1>();
-    auto value_uc = value.mutable_unchecked<1>();
-    auto variance_uc = variance.mutable_unchecked<1>();
-    auto score_uc = score.unchecked<1>();
-    auto n_to_o_uc = n_to_o.unchecked<1>();
-
-    for(int i=trace.size() - 1; i >= 0; --i){
-        int idx = trace_uc(i);
+    for(int i=length - 1; i >= 0; --i){
+        int idx = trace[i];
         _value -= score_uc(idx);
         int o = n_to_o_uc(idx);
 
@@ -300,45 +345,78 @@ void backup_trace_mixture_obs(
     }
 }
 
-void backup_trace_obs_LP(
+void backup_trace_obs(
         py::array_t<int, 1> &trace,
         py::array_t<int, 1> &visit,
         py::array_t<float, 1> &value,
         py::array_t<float, 1> &variance,
         py::array_t<int, 1> &n_to_o,
         py::array_t<float, 1> &score,
-        py::array_t<bool, 1> &end,
-        std::vector<int> &_child,
-        std::vector<int> &_obs,
-        py::array_t<float, 1> &_value,
-        py::array_t<float, 1> &_variance,
-        double gamma,
-        bool mixture,
-        bool averaged){
+        double _value,
+        double _variance,
+        double gamma){
 
-    auto trace_uc = trace.unchecked<1>();
     auto visit_uc = visit.mutable_unchecked<1>();
     auto value_uc = value.mutable_unchecked<1>();
     auto variance_uc = variance.mutable_unchecked<1>();
-    auto score_uc = score.unchecked<1>();
-    auto end_uc = end.unchecked<1>();
-    auto _value_uc = _value.unchecked<1>();
-    auto _variance_uc = _variance.unchecked<1>();
 
-    std::function<void(
-        py::array_t<int, 1>&, py::array_t<int, 1>&, py::array_t<float, 1>&,
-        py::array_t<float, 1>&, py::array_t<int, 1>&, py::array_t<float, 1>&, 
-        double, double, double)> backup;
+    backup_trace_obs_uc(
+        trace.data(), trace.size(), visit_uc, value_uc, variance_uc,
+        n_to_o.unchecked<1>(), score.unchecked<1>(), _value, _variance, gamma);
+}
 
-    if(mixture)
-        backup = backup_trace_mixture_obs;
-    else
-        backup = backup_trace_obs;
+void backup_trace_mixture_obs(
+        py::array_t<int, 1> &trace,
+        py::array_t<int, 1> &visit,
+        py::array_t<float, 1> &value,
+        py::array_t<float, 1> &variance,
+        py::array_t<int, 1> &n_to_o,
+        py::array_t<float, 1> &score,
+        double _value,
+        double _variance,
+        double gamma){
+
+    auto visit_uc = visit.mutable_unchecked<1>();
+    auto value_uc = value.mutable_unchecked<1>();
+    auto variance_uc = variance.mutable_unchecked<1>();
+
+    backup_trace_mixture_obs_uc(
+        trace.data(), trace.size(), visit_uc, value_uc, variance_uc,
+        n_to_o.unchecked<1>(), score.unchecked<1>(), _value, _variance, gamma);
+}
 
-    if(_child.size() > 0){
+template<typename Visit, typename Float, typename NtoO, typename Score, typename End>
+void backup_trace_obs_LP_uc(
+        const int *trace,
+        size_t length,
+        Visit &visit_uc,
+        Float &value_uc,
+        Float &variance_uc,
+        const NtoO &n_to_o_uc,
+        const Score &score_uc,
+        const End &end_uc,
+        const int *_child,
+        const int *_obs,
+        size_t n_child,
+        const float *_value,
+        const float *_variance,
+        double gamma,
+        bool mixture,
+        bool averaged){
+
+    auto backup = [&](double v, double var){
+        if(mixture)
+            backup_trace_mixture_obs_uc(
+                trace, length, visit_uc, value_uc, variance_uc, n_to_o_uc, score_uc, v, var, gamma);
+        else
+            backup_trace_obs_uc(
+                trace, length, visit_uc, value_uc, variance_uc, n_to_o_uc, score_uc, v, var, gamma);
+    };
+
+    if(n_child > 0){
         double v_tmp, var_tmp;
         v_tmp = var_tmp = 0;
-        for(size_t i=0; i < _child.size(); ++i){
+        for(size_t i=0; i < n_child; ++i){
             int __c = _child[i];
             int __o = _obs[i];
             if(visit_uc(__o) == 0){
@@ -347,37 +425,206 @@ void backup_trace_obs_LP(
                     value_uc(__o) = 0;
                     variance_uc(__o) = 0;
                 }else{
-                    value_uc(__o) = _value_uc(i);
-                    variance_uc(__o) = _variance_uc(i);
+                    value_uc(__o) = _value[i];
+                    variance_uc(__o) = _variance[i];
                 }
             }
             if(averaged){
                 v_tmp += score_uc(__c) + gamma * value_uc(__o);
                 var_tmp += variance_uc(__o);
             }else{
-                backup(trace, visit, value, variance, n_to_o, score,
-                       value_uc(__o) + gamma * score_uc(__c),
-                       gamma * gamma * variance_uc(__o), gamma);
+                backup(value_uc(__o) + gamma * score_uc(__c), gamma * gamma * variance_uc(__o));
             }
         }
         if(averaged){
-            v_tmp /= _child.size();
-            var_tmp *= (gamma * gamma / _child.size());
-            backup(trace, visit, value, variance, n_to_o, score, v_tmp, var_tmp, gamma);
+            v_tmp /= n_child;
+            var_tmp *= (gamma * gamma / n_child);
+            backup(v_tmp, var_tmp);
         }
     }else{
-        backup(trace, visit, value, variance, n_to_o, score,
-               score_uc(trace_uc(trace.shape(0) - 1)), 0, gamma);
+        backup(score_uc(trace[length - 1]), 0);
     }
+}
+
+void backup_trace_obs_LP(
+        py::array_t<int, 1> &trace,
+        py::array_t<int, 1> &visit,
+        py::array_t<float, 1> &value,
+        py::array_t<float, 1> &variance,
+        py::array_t<int, 1> &n_to_o,
+        py::array_t<float, 1> &score,
+        py::array_t<bool, 1> &end,
+        std::vector<int> &_child,
+        std::vector<int> &_obs,
+        py::array_t<float, 1> &_value,
+        py::array_t<float, 1> &_variance,
+        double gamma,
+        bool mixture,
+        bool averaged){
+
+    auto visit_uc = visit.mutable_unchecked<1>();
+    auto value_uc = value.mutable_unchecked<1>();
+    auto variance_uc = variance.mutable_unchecked<1>();
+
+    backup_trace_obs_LP_uc(
+        trace.data(), trace.size(), visit_uc, value_uc, variance_uc,
+        n_to_o.unchecked<1>(), score.unchecked<1>(), end.unchecked<1>(),
+        _child.data(), _obs.data(), _child.size(), _value.data(), _variance.data(),
+        gamma, mixture, averaged);
+}
+
+/*
+    BATCHED PROJECTION CORES
 
-    //if(mixture)
-    //    backup_trace_mixture_obs(
-    //        trace, visit, value, variance,
-    //        n_to_o, score, val_mean, var_mean, gamma);
-    //else
-    //    backup_trace_obs(
-    //        trace, visit, value, variance,
-    //        n_to_o, score, val_mean, var_mean, gamma);
+    Run a whole batch of selections or backups per call on preallocated
+    buffers, without holding the GIL. traces is an (M, depth) int32 buffer
+    with one trace per row, lengths holds the used length of each row.
+*/
+
+// a trace did not fit the depth of the traces buffer, the caller can grow it and retry
+struct TraceOverflow : std::length_error{
+    using std::length_error::length_error;
+};
+
+void check_trace_buffers(const py::array_t<int, 1> &traces, const py::array_t<int, 1> &lengths){
+    if(traces.ndim() != 2 || traces.shape(0) < lengths.shape(0))
+        throw std::invalid_argument("traces must be a 2d buffer with a row per entry of lengths");
+}
+
+void select_traces_obs(
+        size_t index, 
+        py::array_t<int, 1> &child,
+        py::array_t<int, 1> &visit,
+        py::array_t<float, 1> &value,
+        py::array_t<float, 1> &variance,
+        py::array_t<float, 1> &score,
+        py::array_t<int, 1> &n_to_o,
+        size_t low,
+        double virtual_loss,
+        py::array_t<int, 1> &traces,
+        py::array_t<int, 1> &lengths){
+
+    check_trace_buffers(traces, lengths);
+
+    auto child_uc = child.unchecked<2>();
+    auto visit_uc = visit.mutable_unchecked<1>();
+    auto value_uc = value.mutable_unchecked<1>();
+    auto variance_uc = variance.unchecked<1>();
+    auto score_uc = score.unchecked<1>();
+    auto n_to_o_uc = n_to_o.unchecked<1>();
+    auto traces_uc = traces.mutable_unchecked<2>();
+    auto lengths_uc = lengths.mutable_unchecked<1>();
+
+    size_t m = lengths.shape(0);
+    size_t depth = traces.shape(1);
+
+    auto loss = [&](size_t k, int n){
+        for(int i=0; i < lengths_uc(k); ++i){
+            int o = n_to_o_uc(traces_uc(k, i));
+            visit_uc(o) += n;
+            value_uc(o) -= n * virtual_loss;
+        }
+    };
+
+    size_t selected = 0;
+    {
+        py::gil_scoped_release release;
+
+        SelectBuffers buf;
+        for(; selected < m; ++selected){
+            select_trace_obs_uc(
+                index, child_uc, visit_uc, value_uc, variance_uc, score_uc, n_to_o_uc, low, buf);
+            if(buf.trace.size() > depth)
+                break;
+            std::copy(buf.trace.begin(), buf.trace.end(), traces_uc.mutable_data(selected, 0));
+            lengths_uc(selected) = buf.trace.size();
+            loss(selected, 1);
+        }
+
+        for(size_t k=0; k < selected; ++k)
+            loss(k, -1);
+    }
+
+    if(selected < m)
+        throw TraceOverflow("trace deeper than the traces buffer");
+}
+
+void backup_traces_obs(
+        py::array_t<int, 1> &traces,
+        py::array_t<int, 1> &lengths,
+        py::array_t<int, 1> &visit,
+        py::array_t<float, 1> &value,
+        py::array_t<float, 1> &variance,
+        py::array_t<int, 1> &n_to_o,
+        py::array_t<float, 1> &score,
+        py::array_t<float, 1> &_value,
+        py::array_t<float, 1> &_variance,
+        double gamma){
+
+    check_trace_buffers(traces, lengths);
+
+    auto traces_uc = traces.unchecked<2>();
+    auto lengths_uc = lengths.unchecked<1>();
+    auto visit_uc = visit.mutable_unchecked<1>();
+    auto value_uc = value.mutable_unchecked<1>();
+    auto variance_uc = variance.mutable_unchecked<1>();
+    auto n_to_o_uc = n_to_o.unchecked<1>();
+    auto score_uc = score.unchecked<1>();
+    auto _value_uc = _value.unchecked<1>();
+    auto _variance_uc = _variance.unchecked<1>();
+
+    py::gil_scoped_release release;
+
+    for(ssize_t k=0; k < lengths.shape(0); ++k)
+        backup_trace_obs_uc(
+            traces_uc.data(k, 0), lengths_uc(k), visit_uc, value_uc, variance_uc,
+            n_to_o_uc, score_uc, _value_uc(k), _variance_uc(k), gamma);
+}
+
+// children of trace k are the entries offsets[k]..offsets[k + 1] of the flat child arrays
+void backup_traces_obs_LP(
+        py::array_t<int, 1> &traces,
+        py::array_t<int, 1> &lengths,
+        py::array_t<int, 1> &visit,
+        py::array_t<float, 1> &value,
+        py::array_t<float, 1> &variance,
+        py::array_t<int, 1> &n_to_o,
+        py::array_t<float, 1> &score,
+        py::array_t<bool, 1> &end,
+        py::array_t<int, 1> &offsets,
+        py::array_t<int, 1> &_child,
+        py::array_t<int, 1> &_obs,
+        py::array_t<float, 1> &_value,
+        py::array_t<float, 1> &_variance,
+        double gamma,
+        bool mixture,
+        bool averaged){
+
+    check_trace_buffers(traces, lengths);
+    if(offsets.shape(0) != lengths.shape(0) + 1)
+        throw std::invalid_argument("offsets must have one more entry than lengths");
+
+    auto traces_uc = traces.unchecked<2>();
+    auto lengths_uc = lengths.unchecked<1>();
+    auto visit_uc = visit.mutable_unchecked<1>();
+    auto value_uc = value.mutable_unchecked<1>();
+    auto variance_uc = variance.mutable_unchecked<1>();
+    auto n_to_o_uc = n_to_o.unchecked<1>();
+    auto score_uc = score.unchecked<1>();
+    auto end_uc = end.unchecked<1>();
+    auto offsets_uc = offsets.unchecked<1>();
+
+    py::gil_scoped_release release;
+
+    for(ssize_t k=0; k < lengths.shape(0); ++k){
+        int first = offsets_uc(k);
+        backup_trace_obs_LP_uc(
+            traces_uc.data(k, 0), lengths_uc(k), visit_uc, value_uc, variance_uc,
+            n_to_o_uc, score_uc, end_uc,
+            _child.data() + first, _obs.data() + first, offsets_uc(k + 1) - first,
+            _value.data() + first, _variance.data() + first,
+            gamma, mixture, averaged);
+    }
 }
 
 /*
@@ -0,0 +1,87 @@
+#ifndef INDEX_TABLE_H
+#define INDEX_TABLE_H
+#include<algorithm>
+#include<cstdint>
+#include<vector>
+
+// linear probing hash -> index table, value 0 marks an empty slot
+class IndexTable{
+    public:
+        struct Slot{
+            uint64_t key;
+            int value;
+        };
+
+        std::vector<Slot> slots;
+        size_t mask, count;
+
+        IndexTable(size_t n = 0){
+            reserve(n);
+        }
+
+        void reserve(size_t n){
+            size_t capacity = 16;
+            while(capacity < 2 * n)
+                capacity <<= 1;
+            slots.assign(capacity, Slot{0, 0});
+            mask = capacity - 1;
+            count = 0;
+        }
+
+        size_t size() const {
+            return count;
+        }
+
+        size_t capacity() const {
+            return slots.size();
+        }
+
+        template<class Match>
+        int find(uint64_t key, Match match) const {
+            for(size_t i = key & mask; slots[i].value != 0; i = (i + 1) & mask){
+                if(slots[i].key == key && match(slots[i].value))
+                    return slots[i].value;
+            }
+            return 0;
+        }
+
+        void insert(uint64_t key, int value){
+            size_t i = key & mask;
+            while(slots[i].value != 0)
+                i = (i + 1) & mask;
+            slots[i] = Slot{key, value};
+            ++count;
+        }
+
+        void erase(uint64_t key, int value){
+            size_t i = key & mask;
+            while(slots[i].value != value){
+                if(slots[i].value == 0)
+                    return;
+                i = (i + 1) & mask;
+            }
+            --count;
+
+            // backward shift deletion
+            size_t j = i;
+            while(true){
+                slots[i].value = 0;
+                size_t k;
+                do{
+                    j = (j + 1) & mask;
+                    if(slots[j].value == 0)
+                        return;
+                    k = slots[j].key & mask;
+                }while(i <= j ? (i < k && k <= j) : (i < k || k <= j));
+                slots[i] = slots[j];
+                i = j;
+            }
+        }
+
+        void clear(){
+            std::fill(slots.begin(), slots.end(), Slot{0, 0});
+            count = 0;
+        }
+};
+
+#endif
@@ -0,0 +1,36 @@
+/*
+<%
+from sysconfig import get_path
+cfg['include_dirs'] = [get_path('include') + '/pyTetris/']
+cfg['compiler_args'] = ['-O3', '-fvisibility=hidden', '-std=c++14', '-pthread']
+cfg['linker_args'] = ['-pthread']
+setup_pybind11(cfg)
+%>
+*/
+#include<rollout.h>
+#include<pybind11/pybind11.h>
+#include<pybind11/numpy.h>
+#include<pybind11/stl.h>
+#define SEED 123
+
+namespace py = pybind11;
+
+std::array<float, 2> run(RolloutEngine &engine, py::buffer &game, int n){
+    py::buffer_info info = game.request();
+    Tetris *g = (Tetris*) (info.ptr);
+
+    py::gil_scoped_release release;
+    return engine.run(*g, n);
+}
+
+/*
+    PYBIND11
+*/
+
+PYBIND11_MODULE(rollout, m){
+    py::class_<RolloutEngine>(m, "RolloutEngine")
+        .def(py::init<int, int, float, uint64_t>(),
+             py::arg("threads") = 1, py::arg("policy") = 0, py::arg("prior_variance") = 1e5, py::arg("seed") = SEED)
+        .def("run", &run, py::arg("game"), py::arg("n") = 1)
+        .def("seed", &RolloutEngine::seed);
+}
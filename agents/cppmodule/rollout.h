@@ -0,0 +1,209 @@
+#ifndef ROLLOUT_H
+#define ROLLOUT_H
+#include<array>
+#include<atomic>
+#include<condition_variable>
+#include<cstdint>
+#include<limits>
+#include<mutex>
+#include<thread>
+#include<vector>
+#include<pyTetris.h>
+#include<core.h>
+
+// xorshift128+, cheap enough to draw one number per playout step
+class FastRandom{
+    public:
+        uint64_t s[2];
+
+        FastRandom(uint64_t seed=0){
+            reseed(seed);
+        }
+
+        void reseed(uint64_t seed){
+            // splitmix64 to spread the seed over both words
+            for(auto &w : s){
+                uint64_t z = (seed += 0x9e3779b97f4a7c15ULL);
+                z = (z ^ (z >> 30)) * 0xbf58476d1ce4e5b9ULL;
+                z = (z ^ (z >> 27)) * 0x94d049bb133111ebULL;
+                w = z ^ (z >> 31);
+            }
+        }
+
+        uint64_t next(){
+            uint64_t s1 = s[0];
+            const uint64_t s0 = s[1];
+            s[0] = s0;
+            s1 ^= s1 << 23;
+            s[1] = s1 ^ s0 ^ (s1 >> 17) ^ (s0 >> 26);
+            return s[1] + s0;
+        }
+
+        int below(int n){
+            return int(((next() >> 32) * uint64_t(n)) >> 32);
+        }
+};
+
+enum RolloutPolicy{ RANDOM_ROLLOUT = 0, GREEDY_ROLLOUT = 1 };
+
+// runs playouts to the end of the game from a leaf, spread over a pool of
+// threads, and reports the mean and variance of the final scores
+class RolloutEngine{
+    public:
+        int threads, policy;
+        float prior_variance;
+
+        RolloutEngine(int _threads=1, int _policy=RANDOM_ROLLOUT, float _prior_variance=1e5, uint64_t seed=0){
+            threads = std::max(_threads, 1);
+            policy = _policy;
+            prior_variance = _prior_variance;
+
+            slots.resize(threads);
+            for(int t=0;t<threads;++t)
+                slots[t].rng.reseed(seed + t);
+
+            for(int t=1;t<threads;++t)
+                workers.emplace_back(&RolloutEngine::worker, this, t);
+        }
+
+        RolloutEngine(const RolloutEngine&) = delete;
+        RolloutEngine& operator=(const RolloutEngine&) = delete;
+
+        ~RolloutEngine(){
+            {
+                std::lock_guard<std::mutex> lock(mutex);
+                stop = true;
+            }
+            start_cv.notify_all();
+            for(auto &w : workers)
+                w.join();
+        }
+
+        void seed(uint64_t s){
+            for(int t=0;t<threads;++t)
+                slots[t].rng.reseed(s + t);
+        }
+
+        // mean and variance of n playout scores, a single playout gets prior_variance
+        std::array<float, 2> run(const Tetris &leaf, int n){
+            n = std::max(n, 1);
+
+            job = &leaf;
+            job_size = n;
+            next_job = 0;
+
+            if(threads > 1 && n > 1){
+                {
+                    std::lock_guard<std::mutex> lock(mutex);
+                    running = threads - 1;
+                    ++generation;
+                }
+                start_cv.notify_all();
+
+                work(0);
+
+                std::unique_lock<std::mutex> lock(mutex);
+                done_cv.wait(lock, [&]{ return running == 0; });
+            }else{
+                work(0);
+            }
+
+            double sum = 0, sum_sq = 0;
+            for(int t=0;t<threads;++t){
+                sum += slots[t].sum;
+                sum_sq += slots[t].sum_sq;
+                slots[t].sum = slots[t].sum_sq = 0;
+            }
+
+            double mean = sum / n;
+            double var = n > 1 ? std::max((sum_sq - n * mean * mean) / (n - 1), 0.) : prior_variance;
+
+            return {float(mean), float(var)};
+        }
+
+    private:
+        struct Slot{
+            FastRandom rng;
+            Tetris game, probe;
+            double sum = 0, sum_sq = 0;
+        };
+
+        std::vector<Slot> slots;
+        std::vector<std::thread> workers;
+
+        std::mutex mutex;
+        std::condition_variable start_cv, done_cv;
+        uint64_t generation = 0;
+        int running = 0;
+        bool stop = false;
+
+        const Tetris *job = nullptr;
+        int job_size = 0;
+        std::atomic<int> next_job{0};
+
+        void worker(int t){
+            uint64_t seen = 0;
+            while(true){
+                {
+                    std::unique_lock<std::mutex> lock(mutex);
+                    start_cv.wait(lock, [&]{ return stop || generation != seen; });
+                    if(stop) return;
+                    seen = generation;
+                }
+
+                work(t);
+
+                {
+                    std::lock_guard<std::mutex> lock(mutex);
+                    --running;
+                }
+                done_cv.notify_one();
+            }
+        }
+
+        void work(int t){
+            Slot &slot = slots[t];
+            while(next_job.fetch_add(1) < job_size){
+                double s = playout(slot);
+                slot.sum += s;
+                slot.sum_sq += s * s;
+            }
+        }
+
+        double playout(Slot &slot){
+            Tetris &g = slot.game;
+            g.copy_from(*job);
+
+            if(policy == GREEDY_ROLLOUT){
+                while(!g.end)
+                    g.play(greedy_action(slot));
+            }else{
+                while(!g.end)
+                    g.play(slot.rng.below(n_actions));
+            }
+
+            return g.score;
+        }
+
+        // best immediate score among the moves that do not end the game, ties broken at random
+        int greedy_action(Slot &slot){
+            float best = -std::numeric_limits<float>::infinity();
+            int action = slot.rng.below(n_actions), ties = 0;
+            for(size_t a=0;a<n_actions;++a){
+                slot.probe.copy_from(slot.game);
+                slot.probe.play(a);
+                if(slot.probe.end)
+                    continue;
+                if(slot.probe.score > best){
+                    best = slot.probe.score;
+                    action = a;
+                    ties = 1;
+                }else if(slot.probe.score == best && slot.rng.below(++ties) == 0){
+                    action = a;
+                }
+            }
+            return action;
+        }
+};
+
+#endif
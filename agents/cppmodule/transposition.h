@@ -0,0 +1,135 @@
+#ifndef TRANSPOSITION_H
+#define TRANSPOSITION_H
+#include<algorithm>
+#include<cstdint>
+#include<vector>
+#include<index_table.h>
+
+// bounded LRU table of observation stats that outlives the search tree,
+// entries tagged with an older model version are treated as misses
+class TranspositionTable{
+    public:
+        int capacity;
+        size_t stride;
+        int version;
+        size_t hits, misses;
+
+        std::vector<uint64_t> key;
+        std::vector<char> state;
+        std::vector<int> visit, tag, prev, next, free_slots;
+        std::vector<float> value, variance;
+        IndexTable index;
+
+        TranspositionTable(int _capacity, size_t _stride) : index(std::max(_capacity, 0)) {
+            capacity = std::max(_capacity, 0);
+            stride = _stride;
+            version = 0;
+            hits = misses = 0;
+
+            key.resize(capacity + 1, 0);
+            state.resize((capacity + 1) * stride, 0);
+            visit.resize(capacity + 1, 0);
+            tag.resize(capacity + 1, 0);
+            value.resize(capacity + 1, 0);
+            variance.resize(capacity + 1, 0);
+
+            // slot 0 is the list sentinel, next[0] is the most recently used entry
+            prev.resize(capacity + 1, 0);
+            next.resize(capacity + 1, 0);
+
+            free_slots.reserve(capacity);
+            for(int i=capacity;i>0;--i)
+                free_slots.push_back(i);
+        }
+
+        size_t size() const {
+            return index.size();
+        }
+
+        bool lookup(uint64_t k, const char *s, int &_visit, float &_value, float &_variance){
+            int slot = find(k, s);
+            if(slot == 0){
+                ++misses;
+                return false;
+            }
+            ++hits;
+            touch(slot);
+            _visit = visit[slot];
+            _value = value[slot];
+            _variance = variance[slot];
+            return true;
+        }
+
+        void store(uint64_t k, const char *s, int _visit, float _value, float _variance){
+            if(capacity == 0)
+                return;
+
+            int slot = find(k, s);
+            if(slot == 0){
+                if(free_slots.empty())
+                    drop(prev[0]);
+                slot = free_slots.back();
+                free_slots.pop_back();
+                key[slot] = k;
+                std::copy(s, s + stride, &state[slot * stride]);
+                tag[slot] = version;
+                visit[slot] = 0;
+                index.insert(k, slot);
+            }else{
+                unlink(slot);
+            }
+
+            if(_visit >= visit[slot]){
+                visit[slot] = _visit;
+                value[slot] = _value;
+                variance[slot] = _variance;
+            }
+            link(slot);
+        }
+
+        void clear(){
+            index.clear();
+            free_slots.clear();
+            for(int i=capacity;i>0;--i)
+                free_slots.push_back(i);
+            prev[0] = next[0] = 0;
+        }
+
+    private:
+        int find(uint64_t k, const char *s){
+            if(capacity == 0)
+                return 0;
+
+            int slot = index.find(k, [&](int v){ return std::equal(s, s + stride, &state[v * stride]); });
+            if(slot != 0 && tag[slot] != version){
+                drop(slot);
+                return 0;
+            }
+            return slot;
+        }
+
+        void drop(int slot){
+            index.erase(key[slot], slot);
+            unlink(slot);
+            free_slots.push_back(slot);
+        }
+
+        void link(int slot){
+            prev[slot] = 0;
+            next[slot] = next[0];
+            prev[next[0]] = slot;
+            next[0] = slot;
+        }
+
+        void unlink(int slot){
+            next[prev[slot]] = next[slot];
+            prev[next[slot]] = prev[slot];
+        }
+
+        void touch(int slot){
+            unlink(slot);
+            link(slot);
+        }
+};
+
+#endif
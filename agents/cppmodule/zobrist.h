@@ -0,0 +1,43 @@
+#ifndef ZOBRIST_H
+#define ZOBRIST_H
+#include<array>
+#include<cstdint>
+#include<random>
+#include<vector>
+
+class Zobrist{
+    public:
+        std::vector<std::array<uint64_t, 256>> table;
+
+        Zobrist(size_t n, uint64_t seed, const std::vector<bool> &ignore = {}){
+            std::mt19937_64 gen(seed);
+            table.resize(n);
+            for(size_t i=0;i<n;++i){
+                table[i][0] = 0;
+                for(size_t b=1;b<256;++b)
+                    table[i][b] = gen();
+                if(i < ignore.size() && ignore[i])
+                    table[i].fill(0);
+            }
+        }
+
+        uint64_t hash(const void *data, size_t n) const {
+            const unsigned char *d = static_cast<const unsigned char*>(data);
+            uint64_t key = 0;
+            for(size_t i=0;i<n;++i)
+                key ^= table[i][d[i]];
+            return key;
+        }
+
+        uint64_t update(uint64_t key, const void *old_data, const void *new_data, size_t n) const {
+            const unsigned char *o = static_cast<const unsigned char*>(old_data);
+            const unsigned char *d = static_cast<const unsigned char*>(new_data);
+            for(size_t i=0;i<n;++i){
+                if(o[i] != d[i])
+                    key ^= table[i][o[i]] ^ table[i][d[i]];
+            }
+            return key;
+        }
+};
+
+#endif
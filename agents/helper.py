@@ -2,3 +2,4 @@ import cppimport
 
 cppimport.imp('agents.cppmodule.agent')
 cppimport.imp('agents.cppmodule.core')
+cppimport.imp('agents.cppmodule.rollout')
@@ -0,0 +1,114 @@
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+
+class LockstepBatcher:
+
+    def __init__(self, inference):
+
+        self.inference = inference
+
+        self.cv = threading.Condition()
+        self.active = 0
+        self.requests = []
+
+        self.n_calls = 0
+        self.n_rows = 0
+
+    def __call__(self, batch):
+
+        request = {'batch': np.asarray(batch)}
+
+        with self.cv:
+            self.requests.append(request)
+            if len(self.requests) >= self.active:
+                self.flush()
+            while 'result' not in request:
+                self.cv.wait()
+
+        if isinstance(request['result'], Exception):
+            raise request['result']
+
+        return request['result']
+
+    def flush(self):
+        """
+        evaluate every pending request in a single call, caller holds the lock
+        """
+        requests, self.requests = self.requests, []
+
+        try:
+            output = self.inference(np.concatenate([r['batch'] for r in requests]))
+
+            self.n_calls += 1
+            offset = 0
+            for r in requests:
+                n = len(r['batch'])
+                r['result'] = [o[offset:offset+n] for o in output]
+                offset += n
+                self.n_rows += n
+        except Exception as e:
+            for r in requests:
+                r['result'] = e
+
+        self.cv.notify_all()
+
+    def run(self, fn):
+
+        try:
+            return fn()
+        finally:
+            with self.cv:
+                self.active -= 1
+                if self.requests and len(self.requests) >= self.active:
+                    self.flush()
+
+    def map(self, executor, fns):
+
+        with self.cv:
+            self.active = len(fns)
+
+        return list(executor.map(self.run, fns))
+
+
+class Lockstep:
+
+    def __init__(self, agents):
+
+        self.agents = agents
+
+        first = agents[0]
+        # every game evaluates through the first agent's model, models trained by the others would never be used
+        if any(getattr(a, 'online', False) for a in agents):
+            raise ValueError('Lock-step games share one model, online training is not supported')
+        if getattr(first, 'evaluation_type', 0) != 0 or not (hasattr(first, 'evaluator') or hasattr(first, 'inference')):
+            raise ValueError('Lock-step play needs agents evaluating boards through a neural network')
+
+        if hasattr(first, 'evaluator'):
+            self.batcher = LockstepBatcher(first.evaluator)
+        else:
+            self.batcher = LockstepBatcher(first.inference)
+
+        for a in agents:
+            if hasattr(a, 'evaluator'):
+                a.evaluator = self.batcher
+            else:
+                a.inference = self.batcher
+
+        self.executor = ThreadPoolExecutor(len(agents))
+
+    def play(self, indices):
+
+        return self.batcher.map(self.executor, [self.agents[i].play for i in indices])
+
+    def close(self):
+
+        self.executor.shutdown()
+
+        for a in self.agents:
+            a.close()
+
+        if self.batcher.n_calls:
+            print('Lock-step inference calls: {}    mean batch size: {:.1f}'.format(
+                self.batcher.n_calls, self.batcher.n_rows / self.batcher.n_calls), flush=True)
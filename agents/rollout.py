@@ -0,0 +1,82 @@
+import numpy as np
+
+
+def sample_actions(policy):
+    """
+    one action per row of a batch of policies
+    """
+    cdf = policy.cumsum(axis=1)
+    rnd = np.random.rand(len(policy), 1) * cdf[:, -1:]
+
+    return np.minimum((cdf < rnd).sum(axis=1), policy.shape[1] - 1)
+
+
+class DepthRollout:
+
+    def __init__(self, env, env_args, inference, depth=30, gamma=1., bootstrap=True):
+
+        self.env = env
+        self.env_args = env_args
+        self.inference = inference
+
+        self.depth = depth
+        self.gamma = gamma
+        self.bootstrap = bootstrap
+
+        self.pool = []
+
+        self.n_calls = 0
+        self.n_rows = 0
+
+    def evaluate(self, games):
+
+        states = np.stack([np.asarray(g.getState()) for g in games])
+        v, p = self.inference(states[:, None, :, :])
+
+        self.n_calls += 1
+        self.n_rows += len(games)
+
+        return v[:, 0], p
+
+    def run(self, games):
+        """
+        play all games forward in lock-step following the policy head, one
+        batched forward pass per depth step, and return their discounted
+        values (leaf score included). Each game is copied before the next
+        one is drawn, so a generator over a shared game object works.
+        """
+        n = 0
+        for g in games:
+            if n == len(self.pool):
+                self.pool.append(self.env(*self.env_args))
+            self.pool[n].copy_from(g)
+            n += 1
+        pool = self.pool[:n]
+
+        scores = np.array([g.score for g in pool], dtype=np.float64)
+        values = scores.copy()
+        discount = np.ones(n)
+        alive = np.array([not g.end for g in pool], dtype=bool)
+
+        for _ in range(self.depth):
+            idx = np.flatnonzero(alive)
+            if len(idx) == 0:
+                break
+
+            _, p = self.evaluate([pool[i] for i in idx])
+            for i, a in zip(idx, sample_actions(p)):
+                pool[i].play(a)
+
+            after = np.array([pool[i].score for i in idx], dtype=np.float64)
+            values[idx] += discount[idx] * (after - scores[idx])
+            scores[idx] = after
+            discount[idx] *= self.gamma
+            alive[idx] = [not pool[i].end for i in idx]
+
+        if self.bootstrap:
+            idx = np.flatnonzero(alive)
+            if len(idx):
+                v, _ = self.evaluate([pool[i] for i in idx])
+                values[idx] += discount[idx] * v
+
+        return values
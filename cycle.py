@@ -0,0 +1,375 @@
+import os
+import sys
+import glob
+import time
+import shutil
+import secrets
+import argparse
+import subprocess
+import numpy as np
+import multiprocessing as mp
+from collections import defaultdict, deque
+from multiprocessing.connection import wait
+from importlib import import_module
+from sys import stderr
+
+perr = dict(file=stderr, flush=True)
+
+"""
+ARGUMENTS
+"""
+parser = argparse.ArgumentParser()
+parser.add_argument('--agent_type', default='ValueSim', type=str, help='Which agent to use')
+parser.add_argument('--benchmark_games', default=1, type=int, help='Number of benchmark games per cycle')
+parser.add_argument('--benchmark_procs', default=1, type=int, help='Number of root-parallel processes for benchmark games')
+parser.add_argument('--benchmark_sims', default=1000, type=int, help='Number of MCTS sims for benchmark games')
+parser.add_argument('--clear', default=False, help='Clear previous data, logs and models', action='store_true')
+parser.add_argument('--cycles', default=200, type=int, help='Last cycle (exclusive)')
+parser.add_argument('--games_per_task', default=1, type=int, help='Number of games handed to a worker at a time')
+parser.add_argument('--max_restarts', default=3, type=int, help='Crashed workers restarted before the cycle is aborted')
+parser.add_argument('--mcts_sims', default=500, type=int, help='Number of MCTS sims')
+parser.add_argument('--ngames', default=50, type=int, help='Number of self-play games per worker per cycle')
+parser.add_argument('--resume', default=False, help='Continue from the last saved cycle', action='store_true')
+parser.add_argument('--shared_inference', default=False, help='Serve the model from a single inference server', action='store_true')
+parser.add_argument('--skip_training', default=False, help='Skip training (self-play only)', action='store_true')
+parser.add_argument('--workers', default=1, type=int, help='Number of self-play worker processes')
+args = parser.parse_args()
+
+train_args = [
+    '--td',
+    '--weighted',
+    '--weighted_mode', '1',
+    '--save_loss',
+    '--batch_size', '32',
+    '--early_stopping',
+    '--validation',
+    '--val_episodes', '5',
+    '--val_mode', '1',
+    '--last_nfiles', '1']
+
+inference_address = './tmp/inference.sock'
+
+"""
+WORKERS
+"""
+
+
+def play_episode(agent, game, saver, episode):
+
+    game.reset()
+    agent.update_root(game)
+
+    moves = 0
+    while not game.end:
+        action = agent.play()
+
+        if saver:
+            saver.add(episode, action, agent, game)
+
+        game.play(action)
+        agent.update_root(game)
+        moves += 1
+
+    return game.score, game.line_clears, moves
+
+
+def worker(wid, conn, agent_args):
+
+    from pyTetris import Tetris
+    from util.Data import DataSaver
+    from agents.agent import TreeAgent
+
+    env_args = ((20, 10), 1, 0, 0)
+
+    agents, savers = {}, {}
+    game = Tetris(*env_args)
+
+    while True:
+        msg = conn.recv()
+
+        if msg[0] == 'play':
+            _, cycle, kind, episodes = msg
+
+            if kind not in agents:
+                a_args = dict(agent_args[kind], env=Tetris, env_args=env_args)
+                save_dir = a_args.pop('save_dir').format(wid + 1)
+                save_tree = a_args.pop('save_tree')
+                processes = a_args.pop('root_parallel')
+                os.makedirs(save_dir, exist_ok=True)
+                if processes > 1:
+                    from agents.RootParallel import RootParallel
+                    agents[kind] = RootParallel(args.agent_type, processes=processes, **a_args)
+                else:
+                    Agent = getattr(import_module('agents.' + args.agent_type), args.agent_type)
+                    # training reads the saved tree nodes, the same tree* files cycle.sh trains on
+                    if save_tree and issubclass(Agent, TreeAgent):
+                        a_args['node_saver'] = DataSaver(save_dir, 'tree', cycle)
+                    agents[kind] = Agent(**a_args)
+
+                savers[kind] = DataSaver(save_dir, 'data', cycle)
+
+            t_start = time.time()
+            results = [play_episode(agents[kind], game, savers[kind], ep) for ep in episodes]
+            conn.send((kind, results, time.time() - t_start))
+
+        elif msg[0] == 'end_cycle':
+            for a in agents.values():
+                a.close()
+            for s in savers.values():
+                s.close()
+            agents.clear()
+            savers.clear()
+            conn.send(None)
+
+        elif msg[0] == 'close':
+            break
+
+    conn.close()
+
+
+class WorkerFailed(RuntimeError):
+    pass
+
+
+class WorkerPool:
+
+    def __init__(self, n_workers, agent_args, max_restarts=3):
+
+        self.ctx = mp.get_context('fork')
+        self.agent_args = agent_args
+        self.max_restarts = max_restarts
+        self.restarts = 0
+
+        self.conns = [None] * n_workers
+        self.workers = [None] * n_workers
+        for wid in range(n_workers):
+            self.start(wid)
+
+    def start(self, wid):
+
+        parent_conn, child_conn = self.ctx.Pipe()
+        w = self.ctx.Process(target=worker, args=(wid, child_conn, self.agent_args))
+        w.start()
+        child_conn.close()
+        self.conns[wid] = parent_conn
+        self.workers[wid] = w
+
+    def restart(self, wid):
+        """
+        report a dead worker and replace it, or give up once max_restarts is spent
+        """
+        w = self.workers[wid]
+        w.join(timeout=1)
+        self.conns[wid].close()
+        print('Worker {} died (exit code {})'.format(wid + 1, w.exitcode), **perr)
+
+        if self.restarts >= self.max_restarts:
+            raise WorkerFailed('Worker {} died and the {} restarts are used up'.format(wid + 1, self.max_restarts))
+        self.restarts += 1
+
+        print('Restarting worker {} ({}/{})'.format(wid + 1, self.restarts, self.max_restarts), **perr)
+        self.start(wid)
+
+    def run(self, cycle, tasks):
+        """
+        hand out (kind, episodes) tasks to whichever worker is free,
+        the task of a worker that dies goes back in the queue
+        """
+        tasks = deque(tasks)
+
+        stats = defaultdict(lambda: defaultdict(float))
+        scores = defaultdict(list)
+
+        running = {}
+        idle = list(range(len(self.conns)))
+        while tasks or running:
+            while tasks and idle:
+                wid = idle.pop()
+                task = tasks.popleft()
+                try:
+                    self.conns[wid].send(('play', cycle, *task))
+                except OSError:
+                    tasks.appendleft(task)
+                    self.restart(wid)
+                    idle.append(wid)
+                    continue
+                running[wid] = task
+
+            wids = {self.conns[wid]: wid for wid in running}
+            for conn in wait(list(wids)):
+                wid = wids[conn]
+                try:
+                    kind, results, elapsed = conn.recv()
+                except (EOFError, OSError):
+                    tasks.appendleft(running.pop(wid))
+                    self.restart(wid)
+                    idle.append(wid)
+                    continue
+
+                del running[wid]
+                idle.append(wid)
+
+                s = stats[wid]
+                s['games'] += len(results)
+                s['moves'] += sum(r[2] for r in results)
+                s['time'] += elapsed
+                scores[kind].extend(r[:2] for r in results)
+
+        for wid in range(len(self.conns)):
+            try:
+                self.conns[wid].send(('end_cycle',))
+                self.conns[wid].recv()
+            except (EOFError, OSError):
+                self.restart(wid)
+
+        return stats, scores
+
+    def close(self):
+
+        for conn, w in zip(self.conns, self.workers):
+            try:
+                conn.send(('close',))
+            except OSError:
+                pass
+        for w in self.workers:
+            w.join(timeout=10)
+            if w.is_alive():
+                w.terminate()
+
+
+def start_inference_server(timeout=120):
+
+    from model.server import InferenceServer, InferenceClient
+
+    # a socket left by a killed run would pass for a listening server
+    if os.path.exists(inference_address):
+        os.remove(inference_address)
+
+    def serve():
+        InferenceServer(inference_address).serve_forever()
+
+    server = mp.get_context('fork').Process(target=serve, daemon=True)
+    server.start()
+
+    deadline = time.time() + timeout
+    while True:
+        if not server.is_alive():
+            sys.exit('Inference server exited with code {} during startup'.format(server.exitcode))
+        try:
+            InferenceClient(inference_address, max_rows=1).close()
+            return server
+        except (OSError, EOFError):
+            pass
+        if time.time() > deadline:
+            server.terminate()
+            sys.exit('Inference server did not accept connections within {}s'.format(timeout))
+        time.sleep(0.1)
+
+
+def train(data_paths):
+
+    with open('logs/log_train', 'a') as log, open('logs/log_err', 'a') as err:
+        r = subprocess.run([sys.executable, 'train.py', *train_args, '--data_paths', *data_paths],
+                           stdout=log, stderr=err)
+
+    if r.returncode:
+        print('Training exited with code {}, see logs/log_err'.format(r.returncode), **perr)
+
+
+def print_cycle(cycle, stats, scores, elapsed):
+
+    print('Cycle {} finished in {:.1f}s'.format(cycle, elapsed), flush=True)
+
+    for kind, s in scores.items():
+        s = np.array(s)
+        print('    {:>10}: games {:>4}  score {:10.1f} ± {:8.1f}  lines {:8.1f} ± {:6.1f}'.format(
+            kind, len(s), s[:, 0].mean(), s[:, 0].std(), s[:, 1].mean(), s[:, 1].std()), flush=True)
+
+    for wid in sorted(stats):
+        s = stats[wid]
+        print('    worker {:>3}: games {:>4}  {:6.3f} games/s  {:8.2f} moves/s'.format(
+            wid + 1, int(s['games']), s['games'] / s['time'], s['moves'] / s['time']), flush=True)
+
+
+"""
+SOME INITS
+"""
+if args.clear:
+    print('Clearing previous data', **perr)
+    for path in glob.glob('logs/*') + glob.glob('data/*'):
+        shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+    for path in ('saved_model', 'pytorch_model'):
+        shutil.rmtree(path, ignore_errors=True)
+
+os.makedirs('logs', exist_ok=True)
+os.makedirs('data/benchmark', exist_ok=True)
+os.makedirs('tmp', exist_ok=True)
+
+curr_cycle = 1
+if args.resume:
+    files = glob.glob('data/self1/data*')
+    if files:
+        curr_cycle = max(int(f.rsplit('data', 1)[1]) for f in files) + 1
+
+# pay for torch, numba and the cppimport build once, the workers are forked warm
+import agents.helper
+import_module('agents.' + args.agent_type)
+
+agent_common = dict(
+        batch_size=1,
+        benchmark=False,
+        online=False,
+        virtual_loss=0.,
+        threads=1)
+
+if args.shared_inference:
+    from model.server import authkey_env
+    # forked workers and the server inherit the key, nothing listens with a guessable one
+    os.environ.setdefault(authkey_env, secrets.token_hex(16))
+    server = start_inference_server()
+    agent_common['inference_server'] = inference_address
+
+agent_args = {
+        'self': dict(agent_common, sims=args.mcts_sims, root_parallel=1, save_dir='data/self{}/', save_tree=True),
+        'benchmark': dict(agent_common, sims=args.benchmark_sims, root_parallel=args.benchmark_procs,
+                          save_dir='data/benchmark/', save_tree=False),
+        }
+
+from agents.agent import TreeAgent
+if not issubclass(getattr(import_module('agents.' + args.agent_type), args.agent_type), TreeAgent):
+    print('{} does not save tree nodes, training only finds tree files of earlier runs'.format(args.agent_type), **perr)
+
+pool = WorkerPool(args.workers, agent_args, args.max_restarts)
+
+data_paths = ['data/self{}/tree*'.format(i + 1) for i in range(args.workers)]
+
+"""
+MAIN LOOP
+"""
+try:
+    for cycle in range(curr_cycle, args.cycles):
+        print('Cycle {}'.format(cycle), flush=True)
+
+        if not args.skip_training:
+            files = [f for p in data_paths for f in glob.glob(p)]
+            if files:
+                train(files)
+            if files and args.shared_inference:
+                from model.server import InferenceClient
+                client = InferenceClient(inference_address)
+                client.reload()
+                client.close()
+
+        n_self = args.ngames * args.workers
+        step = args.games_per_task
+        tasks = [('benchmark', list(range(args.benchmark_games)))] if args.benchmark_games else []
+        tasks += [('self', list(range(ep, min(ep + step, n_self)))) for ep in range(0, n_self, step)]
+
+        t_start = time.time()
+        stats, scores = pool.run(cycle, tasks)
+        print_cycle(cycle, stats, scores, time.time() - t_start)
+except WorkerFailed as e:
+    print('{}, shutting down'.format(e), **perr)
+    sys.exit(1)
+finally:
+    pool.close()
@@ -18,6 +18,7 @@ ngames=50
 agent_type=ValueSim
 n_sims=500
 n_sims_bench=1000
+n_bench_procs=1
 
 while getopts ":cr" opt;do
     case $opt in
@@ -69,7 +70,7 @@ for ((x=$curr_cycle; x<200; x++)){
     for ((i=1; i<=$n_worker; i++)){
         python play.py --agent_type $agent_type --cycle $x --ngames $ngames --mcts_sims $n_sims --save --save_dir data/self$i/ >> logs/log_$i 2>> logs/log_err &
     }
-    python play.py --agent_type $agent_type --cycle $x --ngames 1 --mcts_sims $n_sims_bench --save --save_dir data/benchmark/ >> logs/log_benchmark 2>> logs/log_err
+    python play.py --agent_type $agent_type --cycle $x --ngames 1 --mcts_sims $n_sims_bench --root_parallel $n_bench_procs --save --save_dir data/benchmark/ >> logs/log_benchmark 2>> logs/log_err
     wait
 }
 
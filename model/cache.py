@@ -0,0 +1,69 @@
+import numpy as np
+from collections import OrderedDict
+
+entry_overhead = 256
+
+
+class EvalCache:
+
+    def __init__(self, model, max_mb=64):
+
+        self.model = model
+        self.max_bytes = int(max_mb * 2 ** 20)
+        self.max_entries = 0
+
+        self.entries = OrderedDict()
+        self.version = getattr(model, 'version', 0)
+
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+
+        self.entries.clear()
+
+    def __call__(self, batch):
+
+        version = getattr(self.model, 'version', 0)
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+
+        batch = np.ascontiguousarray(batch)
+        n = len(batch)
+
+        if not self.max_entries:
+            self.max_entries = max(self.max_bytes // (batch[0].nbytes + entry_overhead), 1)
+
+        entries = self.entries
+        keys = [b.tobytes() for b in batch]
+        rows = [None] * n
+
+        missing = OrderedDict()
+        for i, k in enumerate(keys):
+            e = entries.get(k)
+            if e is None:
+                missing.setdefault(k, i)
+            else:
+                entries.move_to_end(k)
+                rows[i] = e
+
+        self.hits += n - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            output = self.model.inference(batch[list(missing.values())])
+
+            position = {}
+            for j, k in enumerate(missing):
+                position[k] = j
+                entries[k] = tuple(o[j].copy() for o in output)
+
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+            for i, k in enumerate(keys):
+                if rows[i] is None:
+                    rows[i] = tuple(o[position[k]] for o in output)
+
+        return [np.stack([r[c] for r in rows]) for c in range(len(rows[0]))]
@@ -0,0 +1,89 @@
+/*
+
+*/
+#include<cstdint>
+#include<stdexcept>
+#include<vector>
+#include<pybind11/pybind11.h>
+#include<pybind11/numpy.h>
+#include<pybind11/stl.h>
+#include<vv_cpu.h>
+
+namespace py = pybind11;
+typedef py::array_t<float, py::array::c_style | py::array::forcecast> farray;
+
+class NetVV{
+    public:
+        vv::Net net;
+
+        NetVV(const std::vector<farray> &params){
+            std::vector<std::vector<float>> data;
+            std::vector<std::vector<long>> shapes;
+            for(auto &p : params){
+                data.emplace_back(p.data(), p.data() + p.size());
+                shapes.emplace_back(p.shape(), p.shape() + p.ndim());
+            }
+            net.load(data, shapes);
+        }
+
+        template<typename T>
+        py::array_t<float> forward(py::array_t<T, py::array::c_style> boards){
+            if(boards.size() % vv::board_size != 0)
+                throw std::invalid_argument("boards must hold whole 20x10 boards");
+            size_t n = boards.size() / vv::board_size;
+
+            py::array_t<float> result({n, size_t(2)});
+            const T *in = boards.data();
+            float *out = result.mutable_data();
+            {
+                py::gil_scoped_release release;
+                vv::Net::Scratch s(net.n_fc);
+                net.forward(in, n, out, s);
+            }
+            return result;
+        }
+
+        // boards (n x 20 x 10) into a preallocated float (n x 2) array
+        void forward_into(py::array_t<int8_t, py::array::c_style> boards, py::array_t<float, py::array::c_style> out){
+            size_t n = boards.size() / vv::board_size;
+            if(boards.size() % vv::board_size != 0 || out.ndim() != 2 || size_t(out.shape(0)) != n || out.shape(1) != 2)
+                throw std::invalid_argument("out must be (n, 2) for n 20x10 boards");
+
+            const int8_t *in = boards.data();
+            float *result = out.mutable_data();
+            {
+                py::gil_scoped_release release;
+                vv::Net::Scratch s(net.n_fc);
+                net.forward(in, n, result, s);
+            }
+        }
+
+        py::array_t<float> forward_packed(py::array_t<uint8_t, py::array::c_style> packed){
+            if(packed.ndim() != 2 || packed.shape(1) != vv::packed_size)
+                throw std::invalid_argument("packed boards must be (n, 25) uint8");
+            size_t n = packed.shape(0);
+
+            py::array_t<float> result({n, size_t(2)});
+            const uint8_t *in = packed.data();
+            float *out = result.mutable_data();
+            {
+                py::gil_scoped_release release;
+                vv::Net::Scratch s(net.n_fc);
+                net.forward_packed(in, n, out, s);
+            }
+            return result;
+        }
+};
+
+/*
+    PYBIND11
+*/
+
+PYBIND11_MODULE(vv_cpu, m){
+    py::class_<NetVV>(m, "NetVV")
+        .def(py::init<const std::vector<farray> &>())
+        .def("forward", &NetVV::forward<int8_t>)
+        .def("forward", &NetVV::forward<float>)
+        .def("forward_into", &NetVV::forward_into, py::arg("boards"), py::arg("out").noconvert())
+        .def("forward_packed", &NetVV::forward_packed);
+}
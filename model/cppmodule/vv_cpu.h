@@ -0,0 +1,185 @@
+#ifndef VV_CPU_H
+#define VV_CPU_H
+#include<algorithm>
+#include<cmath>
+#include<cstdint>
+#include<cstring>
+#include<stdexcept>
+#include<vector>
+
+// Model_VV forward pass without torch, weights in the layouts Model_VV_CPU.load produces
+namespace vv{
+
+const int rows = 20, cols = 10, board_size = rows * cols;
+const int packed_size = (board_size + 7) / 8;
+const int kernel = 3, filters = 32;
+const int h1 = rows - kernel + 1, w1 = cols - kernel + 1;
+const int h2 = h1 - kernel + 1, w2 = w1 - kernel + 1;
+const int h3 = h2 - kernel + 1, w3 = w2 - kernel + 1;
+const int n_params = 12;
+
+typedef float v8 __attribute__((vector_size(32)));
+const int nv = filters / 8;
+
+/*
+    3x3 valid convolution over HWC activations fused with bias and ReLU. XB
+    output columns are computed together so their accumulators stay in
+    registers while each weight vector is loaded once.
+*/
+template<int XB, typename T>
+inline void conv_block(const T *__restrict x, int w, int ci, const float *__restrict weight, const float *__restrict bias, float *__restrict out, int y, int ox){
+    v8 acc[XB][nv];
+    for(int i=0;i<XB;++i)
+        std::memcpy(acc[i], bias, sizeof(acc[i]));
+
+    for(int ky=0;ky<kernel;++ky){
+        for(int kx=0;kx<kernel;++kx){
+            const T *xr = x + ((y + ky) * w + ox + kx) * ci;
+            const float *wr = weight + (ky * kernel + kx) * ci * filters;
+            for(int c=0;c<ci;++c){
+                v8 wv[nv];
+                std::memcpy(wv, wr + c * filters, sizeof(wv));
+                for(int i=0;i<XB;++i){
+                    float v = xr[i * ci + c];
+                    for(int o=0;o<nv;++o)
+                        acc[i][o] += v * wv[o];
+                }
+            }
+        }
+    }
+
+    const v8 zero = {};
+    int ow = w - kernel + 1;
+    for(int i=0;i<XB;++i){
+        for(int o=0;o<nv;++o){
+            v8 r = acc[i][o] > zero ? acc[i][o] : zero;
+            std::memcpy(out + (y * ow + ox + i) * filters + o * 8, &r, sizeof(r));
+        }
+    }
+}
+
+template<typename T>
+void conv_relu(const T *x, int h, int w, int ci, const float *weight, const float *bias, float *out){
+    int oh = h - kernel + 1, ow = w - kernel + 1;
+    for(int y=0;y<oh;++y){
+        int ox = 0;
+        for(;ox + 4 <= ow;ox += 4)
+            conv_block<4>(x, w, ci, weight, bias, out, y, ox);
+        for(;ox + 2 <= ow;ox += 2)
+            conv_block<2>(x, w, ci, weight, bias, out, y, ox);
+        for(;ox < ow;++ox)
+            conv_block<1>(x, w, ci, weight, bias, out, y, ox);
+    }
+}
+
+class Net{
+    public:
+        int n_fc = 0;
+
+        // activations of one board, one per evaluating thread
+        struct Scratch{
+            std::vector<float> a1, a2, a3, h;
+            Scratch(int n_fc=0) : a1(h1 * w1 * filters), a2(h2 * w2 * filters), a3(h3 * w3 * filters), h(n_fc) {}
+        };
+
+        bool loaded() const {
+            return n_fc > 0;
+        }
+
+        // w1, b1, w2, b2, w3, b3, fc_w, fc_b, out_w, out_b, scale, offset
+        void load(const std::vector<std::vector<float>> &params, const std::vector<std::vector<long>> &shapes){
+            if(params.size() != n_params || shapes.size() != n_params)
+                throw std::invalid_argument("expected 12 weight arrays");
+
+            int _n_fc = shapes[7].size() == 1 ? shapes[7][0] : 0;
+            if(_n_fc <= 0 || _n_fc % 8 != 0)
+                throw std::invalid_argument("fc width must be a positive multiple of 8");
+
+            const std::vector<std::vector<long>> expected = {
+                {kernel, kernel, 1, filters}, {filters},
+                {kernel, kernel, filters, filters}, {filters},
+                {kernel, kernel, filters, filters}, {filters},
+                {h3, w3, filters, _n_fc}, {_n_fc},
+                {2, _n_fc}, {2}, {2}, {2}};
+            for(int i=0;i<n_params;++i){
+                long size = 1;
+                for(auto d : shapes[i])
+                    size *= d;
+                if(shapes[i] != expected[i] || long(params[i].size()) != size)
+                    throw std::invalid_argument("unexpected weight shape, the native net expects the Model_VV architecture");
+            }
+
+            for(int i=0;i<3;++i){
+                conv_w[i] = params[2 * i];
+                conv_b[i] = params[2 * i + 1];
+            }
+            fc_w = params[6];
+            fc_b = params[7];
+            out_w = params[8];
+            out_b = params[9];
+            scale = params[10];
+            offset = params[11];
+            n_fc = _n_fc;
+        }
+
+        // value and variance of n boards into out (n x 2)
+        template<typename T>
+        void forward(const T *boards, size_t n, float *out, Scratch &s) const {
+            if(!loaded())
+                throw std::logic_error("native net has no weights loaded");
+            if(int(s.h.size()) != n_fc)
+                s = Scratch(n_fc);
+            for(size_t i=0;i<n;++i)
+                forward_one(boards + i * board_size, s, out + 2 * i);
+        }
+
+        void forward_packed(const uint8_t *packed, size_t n, float *out, Scratch &s) const {
+            uint8_t board[board_size];
+            for(size_t i=0;i<n;++i){
+                const uint8_t *p = packed + i * packed_size;
+                for(int j=0;j<board_size;++j)
+                    board[j] = (p[j >> 3] >> (7 - (j & 7))) & 1;
+                forward(board, 1, out + 2 * i, s);
+            }
+        }
+
+    private:
+        std::vector<float> conv_w[3], conv_b[3], fc_w, fc_b, out_w, out_b, scale, offset;
+
+        template<typename T>
+        void forward_one(const T *board, Scratch &s, float *result) const {
+            conv_relu(board, rows, cols, 1, conv_w[0].data(), conv_b[0].data(), s.a1.data());
+            conv_relu(s.a1.data(), h1, w1, filters, conv_w[1].data(), conv_b[1].data(), s.a2.data());
+            conv_relu(s.a2.data(), h2, w2, filters, conv_w[2].data(), conv_b[2].data(), s.a3.data());
+
+            // post-ReLU activations are sparse, zero inputs skip a whole weight row
+            int nh = n_fc / 8;
+            std::copy(fc_b.begin(), fc_b.end(), s.h.begin());
+            for(size_t i=0;i<s.a3.size();++i){
+                float v = s.a3[i];
+                if(v == 0)
+                    continue;
+                const float *wr = &fc_w[i * n_fc];
+                for(int j=0;j<nh;++j){
+                    v8 wv, hv;
+                    std::memcpy(&wv, wr + 8 * j, sizeof(wv));
+                    std::memcpy(&hv, &s.h[8 * j], sizeof(hv));
+                    hv += v * wv;
+                    std::memcpy(&s.h[8 * j], &hv, sizeof(hv));
+                }
+            }
+
+            const float *h = s.h.data();
+            for(int k=0;k<2;++k){
+                float z = out_b[k];
+                const float *wr = &out_w[k * n_fc];
+                for(int j=0;j<n_fc;++j)
+                    z += std::max(h[j], 0.f) * wr[j];
+                result[k] = scale[k] / (1 + std::exp(-z)) + offset[k];
+            }
+        }
+};
+
+}
+
+#endif
@@ -41,6 +41,8 @@ class Model:
 
         self.use_cuda = use_cuda
 
+        self.version = 0
+
         if torch.cuda.is_available() and self.use_cuda:
             self.device = torch.device('cuda')
         else:
@@ -50,14 +52,14 @@ class Model:
 
         self.training(training)
 
-    def compute_loss(self, batch, weighted, chunksize=1024):
+    def compute_loss(self, batch, weighted, chunksize=1024, **kwargs):
 
         _tmp = defaultdict(list)
         d_size = 0.
         with torch.no_grad():
             for c in range(0, len(batch[0]), chunksize):
                 b = [d[c:c+chunksize] for d in batch]
-                loss = self._loss(b, weighted=weighted)
+                loss = self._loss(b, weighted=weighted, **kwargs)
                 if weighted:
                     _tmp['bsize'].append(np.sum(b[-1]))
                 else:
@@ -112,6 +114,7 @@ class Model:
             U.clip_grad_norm_(self.model.parameters(), grad_clip)
 
         self.optimizer.step()
+        self.version += 1
 
         result = {k: v.item() for k, v in loss.items()}
         result['grad_norm'] = g_norm
@@ -168,6 +171,7 @@ class Model:
             self.optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
             #self.fisher = checkpoint['fisher']
             self.p0 = [p.clone() for p in self.model.parameters()]
+            self.version += 1
             if self.scheduler:
                 self.scheduler.load_state_dict(checkpoint['scheduler_state_dict'])
         else:
@@ -0,0 +1,114 @@
+import torch
+import torch.nn as nn
+from collections import defaultdict, OrderedDict
+from model.model import convOutShape, Model, EXP_PATH, n_actions
+from model.model_vv import GaussianLL, variance_bound
+from model.yogi import Yogi
+
+
+class Net(nn.Module):
+
+    def __init__(self, input_shape=(20, 10), eps=variance_bound):
+        super().__init__()
+
+        kernel_size = 3
+        stride = 1
+        filters = 32
+        bias = True
+
+        self.activation = nn.ReLU(inplace=True)
+
+        _shape = convOutShape(input_shape, kernel_size, stride)
+        _shape = convOutShape(_shape, kernel_size, stride)
+        _shape = convOutShape(_shape, kernel_size, stride)
+        flat_in = _shape[0] * _shape[1] * filters
+
+        n_fc = 256
+        # the board itself followed by the afterstate of every action
+        n_out = 1 + n_actions
+        self.head = nn.Sequential(OrderedDict([
+                ('conv1', nn.Conv2d(1, filters, kernel_size, stride, bias=bias)),
+                ('act1', self.activation),
+                ('conv2', nn.Conv2d(filters, filters, kernel_size, stride, bias=bias)),
+                ('act2', self.activation),
+                ('conv3', nn.Conv2d(filters, filters, kernel_size, stride, bias=bias)),
+                ('act3', self.activation),
+                ('flatten', nn.Flatten()),
+                ('fc1', nn.Linear(flat_in, n_fc)),
+                ('fc_act1', self.activation),
+                ('fc_out', nn.Linear(n_fc, 2 * n_out)),
+                ('act_out', nn.Sigmoid()),
+            ]))
+
+        self.out_ubound = nn.Parameter(torch.tensor([1e2] * n_out + [1e3] * n_out), requires_grad=False)
+        self.out_lbound = nn.Parameter(torch.tensor([0.] * n_out + [eps] * n_out), requires_grad=False)
+
+    def forward(self, x):
+        """
+        values then variances, column 0 of each half is the input board
+        """
+        x = self.head(x)
+        x = x * self.out_ubound + self.out_lbound
+        return x
+
+
+class Model_AV(Model):
+    def __init__(self, weighted=False, **kwarg):
+        super().__init__(**kwarg)
+
+        self.weighted = weighted
+
+        self.l_func = GaussianLL()
+
+    def _init_model(self):
+
+        self.model = Net()
+        if self.use_cuda and torch.cuda.is_available():
+            self.model = self.model.cuda()
+        self.model = torch.jit.script(self.model)
+
+        self.optimizer = Yogi(self.model.parameters(), lr=1e-3, eps=1e-3, weight_decay=1e-3)
+
+        self.scheduler = None
+
+    def _loss(self, batch, variance_clip=variance_bound, weighted=False):
+        """
+        batch: states, value, variance, action value, action variance, action mask, weight.
+        Only the afterstates flagged in the mask have targets.
+        """
+        batch_tensor = [torch.as_tensor(b, dtype=torch.float, device=self.device) for b in batch]
+
+        state, value, variance, a_value, a_variance, a_mask, weight = batch_tensor
+
+        value = torch.cat([value, a_value], dim=1)
+        variance = torch.cat([variance, a_variance], dim=1).clamp_(min=variance_clip)
+        mask = torch.cat([torch.ones_like(weight), a_mask], dim=1)
+
+        _v, _var = self.model(state).split(1 + n_actions, dim=1)
+
+        loss = (mask * self.l_func(_var, _v, variance, value)).sum(dim=1, keepdim=True) / mask.sum(dim=1, keepdim=True)
+        if weighted:
+            loss = weight * loss
+
+        std, mean = torch.std_mean(loss, unbiased=False)
+        return defaultdict(float, loss=mean, loss_std=std)
+
+    def save(self, filename=EXP_PATH + 'av_checkpoint', verbose=True):
+
+        super().save(filename, verbose)
+
+    def load(self, filename=EXP_PATH + 'av_checkpoint'):
+
+        super().load(filename)
+
+    def inference(self, batch):
+        """
+        [value, variance] of the boards, (n, 1) each, then [value, variance]
+        of their afterstates, (n, n_actions) each
+        """
+        b = torch.as_tensor(batch, dtype=torch.float, device=self.device)
+
+        with torch.no_grad():
+            _v, _var = self.model(b).cpu().split(1 + n_actions, dim=1)
+
+        return [_v[:, :1].numpy(), _var[:, :1].numpy(), _v[:, 1:].numpy(), _var[:, 1:].numpy()]
@@ -1,14 +1,39 @@
+import os
 import torch
 import torch.optim as optim
 import torch.nn as nn
 import torch.nn.functional as F
 import numpy as np
 from collections import defaultdict, OrderedDict
-from model.model import convOutShape, Model
+from model.model import convOutShape, Model, EXP_PATH, perr
 from model.yogi import Yogi
 
 variance_bound = 1e-1
 
+backends = ('torch', 'frozen', 'int8_dynamic', 'int8')
+
+
+def backend_support(backend):
+    """
+    None if the installed torch can build the backend, otherwise the reason it cannot
+    """
+    missing = []
+    if backend == 'frozen':
+        missing = [f for f in ('freeze', 'optimize_for_inference') if not hasattr(torch.jit, f)]
+        missing = ['torch.jit.' + f for f in missing]
+    elif backend.startswith('int8'):
+        if 'fbgemm' not in getattr(torch.backends.quantized, 'supported_engines', ()):
+            missing = ['the fbgemm quantized engine']
+
+    if missing:
+        return 'backend {} needs {}, not available in torch {}'.format(backend, ' and '.join(missing), torch.__version__)
+    return None
+
+
+def available_backends():
+
+    return tuple(b for b in backends if backend_support(b) is None)
+
 
 class Net(nn.Module):
 
@@ -52,24 +77,88 @@ class Net(nn.Module):
         return x
 
 
-class Ensemble(nn.Module):
+class QuantizedNet(nn.Module):
+
+    def __init__(self, net):
+        super().__init__()
+
+        self.quant = torch.quantization.QuantStub()
+        # Net shares one ReLU between its activations and named_children() lists a shared module only once,
+        # so every position gets its own ReLU. the sigmoid and output bounds stay in float after dequantization
+        layers = [(name, nn.ReLU() if isinstance(m, nn.ReLU) else m) for name, m in net.head._modules.items()]
+        self.head = nn.Sequential(OrderedDict(layers[:-1]))
+        self.dequant = torch.quantization.DeQuantStub()
 
-    def __init__(self, n_models=5):
+        self.out_ubound = net.out_ubound
+        self.out_lbound = net.out_lbound
 
+    def fuse(self):
+
+        fused = [['conv1', 'act1'], ['conv2', 'act2'], ['conv3', 'act3'], ['fc1', 'fc_act1']]
+        torch.quantization.fuse_modules(self.head, fused, inplace=True)
+
+    def forward(self, x):
+
+        x = self.dequant(self.head(self.quant(x)))
+        x = torch.sigmoid(x) * self.out_ubound + self.out_lbound
+        return x
+
+
+class Ensemble(nn.Module):
+
+    def __init__(self, n_models=5, input_shape=(20, 10), eps=variance_bound):
         super().__init__()
 
+        kernel_size = 3
+        stride = 1
+        filters = 32
+
         self.n_models = n_models
 
-        self.nets = nn.ModuleList([Net() for i in range(n_models)])
+        _shape = convOutShape(input_shape, kernel_size, stride)
+        _shape = convOutShape(_shape, kernel_size, stride)
+        _shape = convOutShape(_shape, kernel_size, stride)
+        flat_in = _shape[0] * _shape[1] * filters
+
+        n_fc = 256
+
+        # member i owns channel group i of every conv and slice i of the stacked fc weights,
+        # so all members run in one pass without seeing each other
+        width = n_models * filters
+        self.conv1 = nn.Conv2d(n_models, width, kernel_size, stride, groups=n_models)
+        self.conv2 = nn.Conv2d(width, width, kernel_size, stride, groups=n_models)
+        self.conv3 = nn.Conv2d(width, width, kernel_size, stride, groups=n_models)
+
+        self.fc1_weight = nn.Parameter(torch.empty(n_models, flat_in, n_fc))
+        self.fc1_bias = nn.Parameter(torch.empty(n_models, 1, n_fc))
+        self.fc_out_weight = nn.Parameter(torch.empty(n_models, n_fc, 2))
+        self.fc_out_bias = nn.Parameter(torch.empty(n_models, 1, 2))
+
+        # same ranges as the nn.Linear default
+        for w, b in [(self.fc1_weight, self.fc1_bias), (self.fc_out_weight, self.fc_out_bias)]:
+            bound = w.shape[1] ** -0.5
+            nn.init.uniform_(w, -bound, bound)
+            nn.init.uniform_(b, -bound, bound)
+
+        self.out_ubound = nn.Parameter(torch.tensor([1e2, 1e3]), requires_grad=False)
+        self.out_lbound = nn.Parameter(torch.tensor([0, eps]), requires_grad=False)
 
     def forward(self, x):
+        """
+        (n_models, batch, 2) member outputs
+        """
+        x = x.expand(-1, self.n_models, -1, -1)
 
-        if self.training:
-            m = torch.randint(0, self.n_models-1, (1,))
-            return self.nets[n](x)
-        else:
-            r = [n(x) for n in self.nets]
-            return torch.mean(torch.stack(r))
+        x = F.relu(self.conv1(x))
+        x = F.relu(self.conv2(x))
+        x = F.relu(self.conv3(x))
+
+        x = x.reshape(x.shape[0], self.n_models, -1).transpose(0, 1)
+        x = F.relu(torch.baddbmm(self.fc1_bias, x, self.fc1_weight))
+        x = torch.sigmoid(torch.baddbmm(self.fc_out_bias, x, self.fc_out_weight))
+
+        x = x * self.out_ubound + self.out_lbound
+        return x
 
 
 class WeakGaussianLL(nn.Module):
@@ -102,11 +191,26 @@ class GaussianLL(nn.Module):
 
 
 class Model_VV(Model):
-    def __init__(self, weighted=False, ewc=False, ewc_lambda=1, loss_type='kldiv', **kwarg):
+    def __init__(self, weighted=False, ewc=False, ewc_lambda=1, loss_type='kldiv', backend='torch',
+                 calibration='data/dump.npz', **kwarg):
+
+        if backend not in backends:
+            raise ValueError('Unknown backend {}, expected one of {}'.format(backend, backends))
+        if backend_support(backend):
+            raise ValueError(backend_support(backend))
+        # quantized kernels are CPU only
+        if backend.startswith('int8'):
+            kwarg['use_cuda'] = False
+
         super().__init__(**kwarg)
 
         self.weighted = weighted
 
+        self.backend = backend
+        self.calibration = calibration
+        self.backend_model = None
+        self.backend_version = None
+
         self.ewc = ewc
         self.ewc_lambda = ewc_lambda
 
@@ -133,7 +237,7 @@ class Model_VV(Model):
 
         self.scheduler = None
 
-    def _loss(self, batch, variance_clip=variance_bound, weighted=False):
+    def _loss(self, batch, variance_clip=variance_bound, weighted=False, model=None):
 
         batch_tensor = [torch.as_tensor(b, dtype=torch.float, device=self.device) for b in batch]
 
@@ -141,7 +245,11 @@ class Model_VV(Model):
 
         variance.clamp_(min=variance_clip)
 
-        _v, _var = self.model(state).split(1, dim=1)
+        if model is None:
+            model = self.model
+
+        # ensemble outputs carry a leading member axis, the targets broadcast over it
+        _v, _var = model(state).split(1, dim=-1)
         if self.loss_type == 'mle' or self.loss_type == 'kldiv':
             if weighted:
                 std, mean = torch.std_mean(weight * self.l_func(_var, _v, variance, value), unbiased=False)
@@ -207,15 +315,113 @@ class Model_VV(Model):
 
         self.fisher = fisher
 
+    def save(self, filename=EXP_PATH + 'model_checkpoint', verbose=True):
+
+        super().save(filename, verbose)
+
+        self.export_weights(filename + '_weights.npz')
+
+    def export_weights(self, filename=EXP_PATH + 'model_checkpoint_weights.npz'):
+        """
+        weights only, loadable by Model_VV_CPU without torch
+        """
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        tmp = filename + '.tmp.npz'
+        np.savez(tmp, **{k: v.detach().cpu().numpy() for k, v in self.model.state_dict().items()})
+        os.replace(tmp, filename)
+
+    def calibration_data(self, validation_fraction=0.1):
+        """
+        states to calibrate on and a held-out batch to compare losses on,
+        split like train_data splits a dump
+        """
+        if not os.path.isfile(self.calibration):
+            return None, None
+
+        with np.load(self.calibration) as data:
+            batch = [data['states'], data['values'], data['variance'], data['weights']]
+        batch[-1] = batch[-1] / batch[-1].mean()
+
+        validation_size = max(int(len(batch[0]) * validation_fraction), 1)
+
+        return batch[0][:-validation_size], [d[-validation_size:] for d in batch]
+
+    def build_backend(self, calibration_size=4096):
+
+        if self.backend == 'torch':
+            return self.model
+
+        states, validation = self.calibration_data()
+
+        if self.backend == 'frozen':
+            model = torch.jit.optimize_for_inference(torch.jit.freeze(self.model))
+        else:
+            net = Net()
+            net.load_state_dict(self.model.state_dict())
+            net.eval()
+
+            if self.backend == 'int8' and states is None:
+                print('Calibration data {} not found, quantizing dynamically'.format(self.calibration), **perr)
+
+            if self.backend == 'int8_dynamic' or states is None:
+                model = torch.quantization.quantize_dynamic(net, {nn.Linear}, dtype=torch.qint8)
+            else:
+                model = QuantizedNet(net)
+                model.eval()
+                model.fuse()
+                model.qconfig = torch.quantization.get_default_qconfig('fbgemm')
+                torch.quantization.prepare(model, inplace=True)
+
+                idx = np.random.choice(len(states), size=min(calibration_size, len(states)), replace=False)
+                with torch.no_grad():
+                    for c in range(0, len(idx), 1024):
+                        model(torch.as_tensor(states[idx[c:c+1024]], dtype=torch.float))
+
+                torch.quantization.convert(model, inplace=True)
+
+            model = torch.jit.script(model)
+            # int8 kernels run the same unfrozen, freezing only folds the attributes when torch has it
+            if hasattr(torch.jit, 'freeze'):
+                model = torch.jit.freeze(model)
+
+        if validation is not None:
+            loss = self.compute_loss(validation, weighted=self.weighted)['loss']
+            loss_b = self.compute_loss(validation, weighted=self.weighted, model=model)['loss']
+            print('Backend {}: validation loss {:.4f}    fp32 {:.4f}    difference {:+.4f}'.format(
+                self.backend, loss_b, loss, loss_b - loss), **perr)
+
+        return model
+
+    def inference_model(self):
+
+        if self.backend == 'torch' or self.model.training:
+            return self.model
+
+        # rebuilt whenever training or loading changed the weights
+        if self.backend_version != self.version:
+            self.backend_model = self.build_backend()
+            self.backend_version = self.version
+
+        return self.backend_model
+
     def inference(self, batch):
 
         b = torch.as_tensor(batch, dtype=torch.float, device=self.device)
 
         with torch.no_grad():
-            output = self.model(b).cpu().split(1, dim=1)
+            output = self.inference_model()(b).cpu().split(1, dim=1)
 
         return [o.numpy() for o in output]
 
+    def inference_into(self, batch, out):
+        """
+        value and variance written into out, float32 (n, 2)
+        """
+        b = torch.as_tensor(batch, dtype=torch.float, device=self.device)
+
+        with torch.no_grad():
+            torch.from_numpy(out).copy_(self.inference_model()(b))
+
     def inference_stochastic(self, batch):
 
         result = self.inference(batch)
@@ -264,3 +470,59 @@ class Model_VV(Model):
 #            pred_net = f.read()
 #
 #        self.model_caffe = workspace.Predictor(init_net, pred_net)
+
+
+class Model_VV_Ensemble(Model_VV):
+    def __init__(self, n_models=5, backend='torch', **kwarg):
+
+        if backend != 'torch' and backend != 'frozen':
+            raise ValueError('Model_VV_Ensemble supports the torch and frozen backends only')
+
+        self.n_models = n_models
+
+        super().__init__(backend=backend, **kwarg)
+
+    def _init_model(self):
+
+        self.model = Ensemble(self.n_models)
+        if self.use_cuda and torch.cuda.is_available():
+            self.model = self.model.cuda()
+        self.model = torch.jit.script(self.model)
+
+        self.optimizer = Yogi(self.model.parameters(), lr=1e-3, eps=1e-3, weight_decay=1e-3)
+
+        self.scheduler = None
+
+    def save(self, filename=EXP_PATH + 'ensemble_checkpoint', verbose=True):
+
+        # the weights-only export is laid out for a single Net
+        Model.save(self, filename, verbose)
+
+    def load(self, filename=EXP_PATH + 'ensemble_checkpoint'):
+
+        super().load(filename)
+
+    def inference_members(self, batch):
+        """
+        value and variance of every member, (n_models, batch, 2)
+        """
+        b = torch.as_tensor(batch, dtype=torch.float, device=self.device)
+
+        with torch.no_grad():
+            return self.inference_model()(b).cpu().numpy()
+
+    def inference(self, batch):
+
+        output = self.inference_members(batch)
+
+        # moments of the uniform mixture of the members
+        value = output[..., 0].mean(axis=0)
+        variance = output[..., 1].mean(axis=0) + output[..., 0].var(axis=0)
+
+        return [value[:, None], variance[:, None]]
+
+    def inference_into(self, batch, out):
+
+        value, variance = self.inference(batch)
+        out[:, 0] = value[:, 0]
+        out[:, 1] = variance[:, 0]
@@ -0,0 +1,99 @@
+import os
+import numpy as np
+import cppimport
+
+cppimport.imp('model.cppmodule.vv_cpu')
+from model.cppmodule.vv_cpu import NetVV
+
+# same location as Model_VV checkpoints, kept here so loading does not import torch
+weights_path = './pytorch_model/model_checkpoint_weights.npz'
+
+board_shape = (20, 10)
+packed_size = (board_shape[0] * board_shape[1] + 7) // 8
+
+conv_layers = ('head.conv1', 'head.conv2', 'head.conv3')
+
+
+def pack_boards(batch):
+    """
+    one bit per cell for 0/1 boards, (n, 25) uint8
+    """
+    batch = np.asarray(batch).reshape(-1, board_shape[0] * board_shape[1])
+
+    return np.packbits(batch != 0, axis=1)
+
+
+class Model_VV_CPU:
+
+    def __init__(self, filename=weights_path):
+
+        self.version = 0
+        self.params = None
+        self.net = None
+
+        if filename is not None:
+            self.load(filename)
+
+    def load(self, filename=weights_path):
+
+        if not os.path.isfile(filename):
+            raise FileNotFoundError('Exported weights not found: {}'.format(filename))
+
+        with np.load(filename) as f:
+            self.load_state({k: f[k] for k in f.files})
+
+    def load_state(self, state):
+        """
+        Model_VV state_dict as numpy arrays
+        """
+        params = []
+        for layer in conv_layers:
+            # (out, in, kh, kw) -> (kh, kw, in, out)
+            params.append(np.ascontiguousarray(state[layer + '.weight'].transpose(2, 3, 1, 0), dtype=np.float32))
+            params.append(np.ascontiguousarray(state[layer + '.bias'], dtype=np.float32))
+
+        # torch flattens CHW, the kernel keeps activations HWC
+        fc_w = state['head.fc1.weight']
+        channels = params[-2].shape[3]
+        h, w = board_shape
+        for layer in conv_layers:
+            k = state[layer + '.weight'].shape[2]
+            h, w = h - k + 1, w - k + 1
+        fc_w = fc_w.reshape(-1, channels, h, w).transpose(2, 3, 1, 0)
+        params.append(np.ascontiguousarray(fc_w, dtype=np.float32))
+        params.append(np.ascontiguousarray(state['head.fc1.bias'], dtype=np.float32))
+
+        params.append(np.ascontiguousarray(state['head.fc_out.weight'], dtype=np.float32))
+        params.append(np.ascontiguousarray(state['head.fc_out.bias'], dtype=np.float32))
+        params.append(np.ascontiguousarray(state['out_ubound'], dtype=np.float32))
+        params.append(np.ascontiguousarray(state['out_lbound'], dtype=np.float32))
+
+        # output bounds are applied in the same pass as the sigmoid
+        self.params = params
+        self.net = NetVV(params)
+        self.version += 1
+
+    def training(self, mode=True):
+
+        if mode:
+            raise ValueError('Model_VV_CPU is inference only')
+
+    def inference(self, batch):
+
+        batch = np.asarray(batch)
+
+        if batch.ndim == 2 and batch.shape[1] == packed_size and batch.dtype == np.uint8:
+            result = self.net.forward_packed(np.ascontiguousarray(batch))
+        else:
+            # int8 and float32 boards are converted inside the kernel
+            if batch.dtype != np.int8 and batch.dtype != np.float32:
+                batch = batch.astype(np.float32)
+            result = self.net.forward(np.ascontiguousarray(batch))
+
+        return [result[:, :1], result[:, 1:]]
+
+    def inference_into(self, batch, out):
+        """
+        int8 boards, value and variance written into out, float32 (n, 2)
+        """
+        self.net.forward_into(batch, out)
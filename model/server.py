@@ -0,0 +1,340 @@
+import os
+import time
+import argparse
+import threading
+import numpy as np
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client, wait, deliver_challenge, answer_challenge
+from sys import stderr
+
+perr = dict(file=stderr, flush=True)
+
+board_shape = (20, 10)
+default_shm_dir = '/dev/shm/' if os.path.isdir('/dev/shm') else './tmp/'
+
+authkey_env = 'TETRIS_INFERENCE_AUTHKEY'
+
+RELOAD = -1
+CLOSE = 0
+
+
+def check_address(address):
+    """
+    unix socket path, clients map the server's buffers so they must share its machine
+    """
+    host, _, port = address.rpartition(':')
+    if host and '/' not in host and port.isdigit():
+        raise ValueError('The inference server only listens on unix sockets, got {}'.format(address))
+    return address
+
+
+def get_authkey(authkey=None):
+    """
+    explicit key or the TETRIS_INFERENCE_AUTHKEY environment variable, there is no default
+    """
+    if authkey is None:
+        authkey = os.environ.get(authkey_env)
+    if not authkey:
+        raise ValueError('The inference server needs an authkey, pass one or set {}'.format(authkey_env))
+    if isinstance(authkey, str):
+        authkey = authkey.encode()
+    return authkey
+
+
+# plain files under /dev/shm rather than multiprocessing.shared_memory: the server and its clients are unrelated
+# processes, and the resource tracker of every client would unlink a shared_memory segment it only attached to
+def open_buffers(path, max_rows, mode):
+
+    boards = np.memmap(path + '_boards', dtype=np.int8, mode=mode, shape=(max_rows, 1, *board_shape))
+    results = np.memmap(path + '_results', dtype=np.float32, mode=mode, shape=(max_rows, 2))
+
+    return boards, results
+
+
+def remove_buffers(path):
+
+    for suffix in ('_boards', '_results'):
+        try:
+            os.remove(path + suffix)
+        except OSError:
+            pass
+
+
+class InferenceServer:
+
+    def __init__(self, address, authkey=None, checkpoint=None, max_batch=256, max_wait=0.002,
+                 reload_interval=5., shm_dir=default_shm_dir, backend='torch'):
+
+        self.authkey = get_authkey(authkey)
+        address = check_address(address)
+
+        from model.model_vv import Model_VV
+
+        self.model = Model_VV(backend=backend)
+        if checkpoint:
+            self.checkpoint = checkpoint
+            self.model.load(checkpoint)
+        else:
+            self.checkpoint = None
+            self.model.load()
+        self.model.training(False)
+
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.reload_interval = reload_interval
+        self.checkpoint_mtime = self.get_mtime()
+        self.last_check = time.time()
+
+        self.shm_dir = shm_dir
+        self.prefix = os.path.join(shm_dir, 'tetris_inference_{}_'.format(os.getpid()))
+
+        if os.path.exists(address):
+            os.remove(address)
+
+        # the socket file is only reachable by this user, the authkey is checked per connection
+        umask = os.umask(0o077)
+        try:
+            self.listener = Listener(address, family='AF_UNIX')
+        finally:
+            os.umask(umask)
+        self.clients = {}
+        self.new_clients = []
+        self.lock = threading.Lock()
+        self.n_clients = 0
+
+        self.n_batches = 0
+        self.n_rows = 0
+
+        self.accepting = threading.Thread(target=self.accept, daemon=True)
+        self.accepting.start()
+
+    def get_mtime(self):
+
+        from model.model import EXP_PATH
+
+        path = self.checkpoint or EXP_PATH + 'model_checkpoint'
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return None
+
+    def accept(self):
+
+        while True:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                break
+
+            # a client stalled in the handshake only holds up its own thread
+            threading.Thread(target=self.handshake, args=(conn,), daemon=True).start()
+
+    def handshake(self, conn):
+
+        try:
+            deliver_challenge(conn, self.authkey)
+            answer_challenge(conn, self.authkey)
+            max_rows = conn.recv()
+            if not isinstance(max_rows, int) or max_rows <= 0:
+                raise ValueError('bad buffer size {!r}'.format(max_rows))
+        except (EOFError, OSError, AuthenticationError, ValueError) as e:
+            print('Inference server: client rejected ({})'.format(e), **perr)
+            conn.close()
+            return
+
+        with self.lock:
+            self.n_clients += 1
+            path = self.prefix + str(self.n_clients)
+        boards, results = open_buffers(path, max_rows, 'w+')
+
+        try:
+            conn.send((path, max_rows, self.model.version))
+        except (EOFError, OSError):
+            conn.close()
+            remove_buffers(path)
+            return
+
+        with self.lock:
+            self.new_clients.append((conn, (path, boards, results)))
+
+    def reload(self):
+
+        if self.checkpoint:
+            self.model.load(self.checkpoint)
+        else:
+            self.model.load()
+        self.model.training(False)
+        self.checkpoint_mtime = self.get_mtime()
+
+        print('Checkpoint reloaded, model version {}'.format(self.model.version), **perr)
+
+    def check_checkpoint(self):
+
+        now = time.time()
+        if now - self.last_check < self.reload_interval:
+            return
+        self.last_check = now
+
+        mtime = self.get_mtime()
+        if mtime is not None and mtime != self.checkpoint_mtime:
+            self.reload()
+
+    def drop(self, conn):
+
+        path = self.clients.pop(conn)[0]
+        conn.close()
+        remove_buffers(path)
+
+    def gather(self, timeout):
+
+        with self.lock:
+            for conn, buffers in self.new_clients:
+                self.clients[conn] = buffers
+            self.new_clients.clear()
+
+        pending = []
+        submitted = set()
+        rows = 0
+        deadline = None
+        while rows < self.max_batch:
+            idle = [c for c in self.clients if c not in submitted]
+            if not idle:
+                if deadline is None:
+                    time.sleep(timeout)
+                break
+
+            if deadline is None:
+                ready = wait(idle, timeout)
+                deadline = time.time() + self.max_wait
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                ready = wait(idle, remaining)
+
+            if not ready:
+                break
+
+            for conn in ready:
+                try:
+                    n = conn.recv()
+                except (EOFError, OSError):
+                    self.drop(conn)
+                    continue
+
+                if n == CLOSE:
+                    self.drop(conn)
+                elif n == RELOAD:
+                    self.reload()
+                    conn.send(self.model.version)
+                else:
+                    pending.append((conn, n))
+                    submitted.add(conn)
+                    rows += n
+
+        return pending
+
+    def serve_forever(self, poll=0.1):
+
+        print('Inference server listening on {}'.format(self.listener.address), **perr)
+
+        try:
+            while True:
+                pending = self.gather(poll)
+
+                if pending:
+                    self.run_batch(pending)
+                # rate limited by reload_interval, a busy server still picks up new checkpoints
+                self.check_checkpoint()
+        finally:
+            self.close()
+
+    def run_batch(self, pending):
+
+        batch = np.concatenate([self.clients[conn][1][:n] for conn, n in pending])
+
+        v, var = self.model.inference(batch)
+
+        self.n_batches += 1
+        self.n_rows += len(batch)
+
+        offset = 0
+        for conn, n in pending:
+            results = self.clients[conn][2]
+            results[:n, 0] = v[offset:offset+n, 0]
+            results[:n, 1] = var[offset:offset+n, 0]
+            offset += n
+            try:
+                conn.send(self.model.version)
+            except (EOFError, OSError):
+                self.drop(conn)
+
+    def close(self):
+
+        self.listener.close()
+        for conn in list(self.clients):
+            self.drop(conn)
+
+        if self.n_batches:
+            print('Inference server: {} batches, mean batch size {:.1f}'.format(
+                self.n_batches, self.n_rows / self.n_batches), **perr)
+
+
+class InferenceClient:
+
+    def __init__(self, address, authkey=None, max_rows=512):
+
+        self.conn = Client(check_address(address), family='AF_UNIX', authkey=get_authkey(authkey))
+        self.conn.send(max_rows)
+        path, self.max_rows, self.version = self.conn.recv()
+
+        self.boards, self.results = open_buffers(path, self.max_rows, 'r+')
+
+    def inference(self, batch):
+
+        batch = np.asarray(batch).reshape(-1, 1, *board_shape)
+        n = len(batch)
+
+        v = np.empty((n, 1), dtype=np.float32)
+        var = np.empty((n, 1), dtype=np.float32)
+
+        for i in range(0, n, self.max_rows):
+            m = min(self.max_rows, n - i)
+            self.boards[:m] = batch[i:i+m]
+            self.conn.send(m)
+            self.version = self.conn.recv()
+            v[i:i+m, 0] = self.results[:m, 0]
+            var[i:i+m, 0] = self.results[:m, 1]
+
+        return [v, var]
+
+    def reload(self):
+
+        self.conn.send(RELOAD)
+        self.version = self.conn.recv()
+
+    def close(self):
+
+        try:
+            self.conn.send(CLOSE)
+        except (EOFError, OSError):
+            pass
+        self.conn.close()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--address', default='./tmp/inference.sock', type=str, help='Unix socket path to listen on, the authkey is read from TETRIS_INFERENCE_AUTHKEY')
+    parser.add_argument('--backend', default='torch', type=str, help='Inference backend (torch, frozen, int8_dynamic, int8)')
+    parser.add_argument('--checkpoint', default=None, type=str, help='Checkpoint to serve (default: latest model checkpoint)')
+    parser.add_argument('--max_batch', default=256, type=int, help='Maximum number of boards per forward pass')
+    parser.add_argument('--max_wait', default=0.002, type=float, help='Seconds to wait for more requests once one is pending')
+    parser.add_argument('--reload_interval', default=5., type=float, help='Seconds between checkpoint modification checks')
+    parser.add_argument('--shm_dir', default=default_shm_dir, type=str, help='Directory for the shared board/result buffers')
+    args = parser.parse_args()
+
+    server = InferenceServer(args.address, checkpoint=args.checkpoint, max_batch=args.max_batch,
+                             max_wait=args.max_wait, reload_interval=args.reload_interval, shm_dir=args.shm_dir,
+                             backend=args.backend)
+    server.serve_forever()
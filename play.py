@@ -1,6 +1,7 @@
 from pyTetris import Tetris
 import numpy as np
 import argparse
+import inspect
 from util.gui import GUI
 from util.Data import DataSaver
 from importlib import import_module
@@ -40,6 +41,19 @@ class ScoreTracker:
         self.scores = []
 
 
+def accepted_options(Agent):
+    """
+    keyword arguments named by the python constructors along the agent's MRO
+    """
+    names = set()
+    for cls in Agent.__mro__:
+        try:
+            names.update(inspect.signature(cls.__dict__['__init__']).parameters)
+        except (KeyError, TypeError, ValueError):
+            pass
+    return names
+
+
 """
 ARGUMENTS
 """
@@ -49,24 +63,40 @@ parser.add_argument('--app', default=1, type=int, help='Actions-per-drop')
 parser.add_argument('--benchmark', default=False, help='Benchmark mode for agent', action='store_true')
 parser.add_argument('--cycle', default=0, type=int, help='Number of cycle')
 parser.add_argument('--endless', default=False, help='Endless plays', action='store_true')
+parser.add_argument('--ensemble', default=0, type=int, help='Members of a single-pass Model_VV ensemble, 0 uses the single network')
+parser.add_argument('--eval_cache', default=0, type=float, help='Memory budget (MB) of the neural evaluation cache, 0 disables it')
 parser.add_argument('--gamma', default=0.9, type=float, help='Discount factor')
 parser.add_argument('--gui', default=False, help='A simple GUI', action='store_true')
+parser.add_argument('--inference_server', default=None, type=str, help='Unix socket of a shared inference server, the authkey is read from TETRIS_INFERENCE_AUTHKEY')
 parser.add_argument('--interactive', default=False, help='Text interactive interface', action='store_true')
+parser.add_argument('--mcts_batch', default=1, type=int, help='Number of leaves evaluated per batch (virtual loss)')
 parser.add_argument('--mcts_const', default=5.0, type=float, help='PUCT constant')
 parser.add_argument('--mcts_sims', default=50, type=int, help='Number of MCTS sims')
 parser.add_argument('--mcts_tau', default=1.0, type=float, help='Temperature constant')
 parser.add_argument('--min_visit', default=40, type=int, help='Minimum visits for node storage')
+parser.add_argument('--model_backend', default='torch', type=str, help='Inference backend of Model_VV agents (torch, frozen, int8_dynamic, int8)')
+parser.add_argument('--native_model', default=False, help='Evaluate Model_VV inside the C++ search, no python callbacks (ValueSimC only)', action='store_true')
 parser.add_argument('--ngames', default=50, type=int, help='Number of episodes to play')
 parser.add_argument('--online', default=False, help='Online agent training', action='store_true')
+parser.add_argument('--parallel_games', default=1, type=int, help='Number of games played in lock-step with shared inference batches')
 parser.add_argument('--printboard', default=False, help='Print board', action='store_true')
 parser.add_argument('--print_board_to_file', default=False, help='Print board to file', action='store_true')
 parser.add_argument('--realtime_status', default=False, help='Save realtime game status through numpy memmap', action='store_true')
+parser.add_argument('--rollout_policy', default=0, type=int, help='Playout policy of rollout agents (0: uniform random, 1: greedy one-step lookahead)')
+parser.add_argument('--rollout_threads', default=1, type=int, help='Number of playout threads of rollout agents')
+parser.add_argument('--rollouts', default=1, type=int, help='Number of playouts per leaf for rollout agents')
+parser.add_argument('--root_parallel', default=1, type=int, help='Number of root-parallel search processes')
 parser.add_argument('--save', default=False, help='Save self-play episodes', action='store_true')
 parser.add_argument('--save_dir', default='./data/', type=str, help='Directory for save')
 parser.add_argument('--save_file', default='data', type=str, help='Filename to save')
 parser.add_argument('--save_tree', default=False, help='Save expanded tree nodes', action='store_true')
+parser.add_argument('--seed', default=None, type=int, help='Base seed of the root-parallel search processes (default: random per run)')
 parser.add_argument('--tetris_randomizer', default=0, type=int, help='Queue randomizer used by Tetris (0: bag, 1: uniform)')
 parser.add_argument('--tetris_scoring', default=0, type=int, help='Scoring system used by Tetris (0: official guideline, 1: line clears)')
+parser.add_argument('--threads', default=1, type=int, help='Number of search threads (C++ agents only)')
+parser.add_argument('--tt_size', default=0, type=int, help='Transposition table entries kept across moves and episodes (C++ agents only)')
+parser.add_argument('--virtual_loss', default=0., type=float, help='Virtual loss applied to pending traces in batched MCTS')
+parser.add_argument('--zero_copy', default=False, help='Evaluate through agent-owned input and output buffers filled in place (ValueSimC only)', action='store_true')
 args = parser.parse_args()
 
 """
@@ -77,6 +107,11 @@ game = Tetris(*env_args)
 
 ngames = 0
 
+if args.parallel_games > 1 and args.online:
+    parser.error('--online trains one model per game, lock-step games all evaluate through the first one')
+if args.parallel_games > 1 and args.root_parallel > 1:
+    parser.error('--root_parallel and --parallel_games cannot be combined')
+
 if args.agent_type:
     _agent_module = import_module('agents.' + args.agent_type)
     Agent = getattr(_agent_module, args.agent_type)
@@ -87,8 +122,36 @@ if args.agent_type:
             benchmark=args.benchmark,
             online=args.online,
             min_visit=args.min_visit)
-    agent = Agent(**agent_args)
-    agent.update_root(game)
+
+    # agent specific options are passed only when set, and only to agents whose constructors take them
+    accepted = accepted_options(Agent)
+    for key, name in [('batch_size', 'mcts_batch'), ('virtual_loss', 'virtual_loss'), ('threads', 'threads'),
+                      ('tt_size', 'tt_size'), ('ensemble', 'ensemble'), ('eval_cache', 'eval_cache'),
+                      ('inference_server', 'inference_server'), ('model_backend', 'model_backend'),
+                      ('native_model', 'native_model'), ('zero_copy', 'zero_copy'), ('rollouts', 'rollouts'),
+                      ('rollout_policy', 'rollout_policy'), ('rollout_threads', 'rollout_threads')]:
+        value = getattr(args, name)
+        if value == parser.get_default(name):
+            continue
+        if key not in accepted:
+            parser.error('--{} is not supported by {}'.format(name, args.agent_type))
+        agent_args[key] = value
+
+    if args.root_parallel > 1:
+        from agents.RootParallel import RootParallel
+        agent = RootParallel(args.agent_type, processes=args.root_parallel, seed=args.seed, **agent_args)
+    elif args.parallel_games > 1:
+        from agents.lockstep import Lockstep
+        agent = Lockstep([Agent(**agent_args) for _ in range(args.parallel_games)])
+        games = [game] + [Tetris(*env_args) for _ in range(args.parallel_games - 1)]
+    else:
+        agent = Agent(**agent_args)
+
+    if args.parallel_games > 1:
+        for a, g in zip(agent.agents, games):
+            a.update_root(g)
+    else:
+        agent.update_root(game)
 else:
     agent = None
 
@@ -113,9 +176,51 @@ if args.realtime_status:
     _lines = np.memmap('./tmp/lines', dtype=np.int32, mode='w+', shape=(1, ))
     _line_stats = np.memmap('./tmp/line_stats', dtype=np.int32, mode='w+', shape=(4, ))
 """
+LOCK-STEP GAME LOOP
+"""
+if args.parallel_games > 1:
+    playing = list(range(args.parallel_games))
+    episode = list(range(args.parallel_games))
+    started = args.parallel_games
+    # train.py reads an episode as a contiguous run of rows, each game's rows are written when it ends
+    rows = [[] for _ in range(args.parallel_games)]
+    while playing:
+        actions = agent.play(playing)
+
+        for i, action in zip(playing, actions):
+            g, a = games[i], agent.agents[i]
+            if args.save:
+                rows[i].append(saver.collect(episode[i], action, a, g))
+            g.play(action)
+            a.update_root(g)
+
+        for i in list(playing):
+            g = games[i]
+            if not g.end:
+                continue
+
+            ngames += 1
+            tracker.append(g.score, g.line_clears)
+            tracker.printStats()
+
+            if args.save:
+                for row in rows[i]:
+                    saver.add_raw(*row)
+                saver.save_episode()
+                rows[i].clear()
+
+            if started < args.ngames:
+                g.reset()
+                agent.agents[i].update_root(g)
+                episode[i] = started
+                started += 1
+            else:
+                playing.remove(i)
+
+"""
 MAIN GAME LOOP
 """
-while True:
+while args.parallel_games == 1:
     if args.interactive:
         game.printState()
         print('Current score: {}'.format(game.score))
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# tests import the repo packages the same way play.py and train.py do, from the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,51 @@
+/*
+
+*/
+#include<cstdint>
+#include<string>
+#include<vector>
+#include<pybind11/pybind11.h>
+#include<pybind11/stl.h>
+#include<index_table.h>
+#include<transposition.h>
+
+namespace py = pybind11;
+
+// test-only bindings of the header-only tables the node pool uses
+
+PYBIND11_MODULE(tables, m){
+    py::class_<IndexTable>(m, "IndexTable")
+        .def(py::init<size_t>())
+        .def("insert", &IndexTable::insert)
+        .def("erase", &IndexTable::erase)
+        .def("find", [](const IndexTable &t, uint64_t key, int value){
+            return t.find(key, [&](int v){ return v == value; });
+        })
+        .def("clear", &IndexTable::clear)
+        .def("size", &IndexTable::size)
+        .def("capacity", &IndexTable::capacity)
+        .def("slots", [](const IndexTable &t){
+            std::vector<std::pair<uint64_t, int>> s;
+            for(auto &slot : t.slots)
+                s.emplace_back(slot.key, slot.value);
+            return s;
+        });
+
+    py::class_<TranspositionTable>(m, "TranspositionTable")
+        .def(py::init<int, size_t>())
+        .def("store", [](TranspositionTable &t, uint64_t key, const std::string &state, int visit, float value, float variance){
+            t.store(key, state.data(), visit, value, variance);
+        })
+        .def("lookup", [](TranspositionTable &t, uint64_t key, const std::string &state) -> py::object {
+            int visit;
+            float value, variance;
+            if(!t.lookup(key, state.data(), visit, value, variance))
+                return py::none();
+            return py::make_tuple(visit, value, variance);
+        })
+        .def("clear", &TranspositionTable::clear)
+        .def("size", &TranspositionTable::size)
+        .def_readwrite("version", &TranspositionTable::version)
+        .def_readonly("hits", &TranspositionTable::hits)
+        .def_readonly("misses", &TranspositionTable::misses);
+}
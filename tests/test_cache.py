@@ -0,0 +1,95 @@
+import numpy as np
+
+from model.cache import EvalCache, entry_overhead
+
+
+class CountingModel:
+
+    def __init__(self):
+
+        self.version = 0
+        self.rows = 0
+        self.calls = 0
+
+    def inference(self, batch):
+
+        self.calls += 1
+        self.rows += len(batch)
+        s = batch.reshape(len(batch), -1).sum(axis=1, keepdims=True).astype(np.float32)
+        return [s, s * 2]
+
+
+def boards(ids):
+
+    b = np.zeros((len(ids), 1, 20, 10), dtype=np.int8)
+    for i, k in enumerate(ids):
+        b[i].flat[:k] = 1
+    return b
+
+
+def test_matches_the_model_and_counts_hits():
+
+    model = CountingModel()
+    cache = EvalCache(model)
+
+    first = cache(boards([1, 2, 3]))
+    second = cache(boards([3, 2, 4]))
+
+    for out, ids in ((first, [1, 2, 3]), (second, [3, 2, 4])):
+        expected = CountingModel().inference(boards(ids))
+        assert all(np.array_equal(o, e) for o, e in zip(out, expected))
+
+    assert (cache.hits, cache.misses) == (2, 4)
+    assert model.rows == 4
+
+
+def test_duplicates_in_a_batch_are_evaluated_once():
+
+    model = CountingModel()
+    cache = EvalCache(model)
+
+    v, var = cache(boards([5, 5, 6, 5]))
+
+    assert model.rows == 2
+    assert v[:, 0].tolist() == [5, 5, 6, 5]
+    assert var[:, 0].tolist() == [10, 10, 12, 10]
+
+
+def test_evicts_the_least_recently_used_board():
+
+    model = CountingModel()
+    cache = EvalCache(model)
+    cache.max_entries = 2
+
+    cache(boards([1]))
+    cache(boards([2]))
+    cache(boards([1]))
+    cache(boards([3]))
+
+    assert len(cache.entries) == 2
+    rows = model.rows
+    cache(boards([1]))
+    assert model.rows == rows
+    cache(boards([2]))
+    assert model.rows == rows + 1
+
+
+def test_model_update_clears_the_cache():
+
+    model = CountingModel()
+    cache = EvalCache(model)
+
+    cache(boards([1, 2]))
+    model.version += 1
+    cache(boards([1, 2]))
+
+    assert model.rows == 4
+    assert cache.hits == 0
+
+
+def test_size_follows_the_memory_budget():
+
+    cache = EvalCache(CountingModel(), max_mb=1)
+    cache(boards([1]))
+
+    assert cache.max_entries == 2 ** 20 // (200 + entry_overhead)
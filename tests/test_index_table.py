@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+cppimport = pytest.importorskip('cppimport')
+tables = cppimport.imp('tests.cppmodule.tables')
+
+
+def occupied(t):
+
+    return {i: s for i, s in enumerate(t.slots()) if s[1] != 0}
+
+
+def test_erase_shifts_the_probe_chain_back():
+
+    t = tables.IndexTable(8)
+    assert t.capacity() == 16
+
+    # all three keys hash to slot 1
+    for v, k in enumerate((1, 17, 33), 1):
+        t.insert(k, v)
+
+    t.erase(17, 2)
+
+    assert occupied(t) == {1: (1, 1), 2: (33, 3)}
+    assert t.find(33, 3) == 3
+    assert t.find(17, 2) == 0
+    assert t.size() == 2
+
+
+def test_erase_leaves_entries_at_their_home_slot():
+
+    t = tables.IndexTable(8)
+    t.insert(1, 1)
+    t.insert(17, 2)
+    t.insert(3, 3)
+    t.insert(19, 4)
+
+    # 17 moves into the freed slot, 3 is already home and stops 19 from moving past it
+    t.erase(1, 1)
+
+    assert occupied(t) == {1: (17, 2), 3: (3, 3), 4: (19, 4)}
+    assert [t.find(k, v) for k, v in ((17, 2), (3, 3), (19, 4))] == [2, 3, 4]
+
+
+def test_erase_wraps_around():
+
+    t = tables.IndexTable(8)
+    t.insert(15, 1)
+    t.insert(31, 2)
+    t.insert(16, 3)
+
+    assert occupied(t) == {15: (15, 1), 0: (31, 2), 1: (16, 3)}
+
+    t.erase(15, 1)
+
+    assert occupied(t) == {15: (31, 2), 0: (16, 3)}
+    assert t.find(31, 2) == 2
+    assert t.find(16, 3) == 3
+
+
+def test_matches_a_dict_under_random_inserts_and_erases():
+
+    rng = np.random.RandomState(0)
+    t = tables.IndexTable(256)
+    live = {}
+
+    for value in range(1, 5000):
+        # few distinct low bits so probe chains get long
+        key = int(rng.randint(0, 64)) * 1024 + int(rng.randint(0, 16))
+        if len(live) < 200:
+            t.insert(key, value)
+            live[value] = key
+        victim = int(rng.choice(list(live)))
+        if rng.rand() < 0.5:
+            t.erase(live.pop(victim), victim)
+
+    assert t.size() == len(live)
+    assert all(t.find(k, v) == v for v, k in live.items())
+
+    for v, k in list(live.items()):
+        t.erase(k, v)
+
+    assert t.size() == 0
+    assert not occupied(t)
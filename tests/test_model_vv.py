@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from model.model_vv import Net, QuantizedNet, backend_support
+
+
+def boards(n, seed=0):
+
+    rng = np.random.RandomState(seed)
+    return torch.as_tensor(rng.randint(0, 2, (n, 1, 20, 10)), dtype=torch.float)
+
+
+def test_quantized_net_keeps_every_activation():
+
+    net = Net().eval()
+    q = QuantizedNet(net).eval()
+
+    names = list(q.head._modules)
+    assert names == ['conv1', 'act1', 'conv2', 'act2', 'conv3', 'act3', 'flatten', 'fc1', 'fc_act1', 'fc_out']
+
+    # before prepare the stubs are identities, the rebuilt head is the float network
+    x = boards(32)
+    with torch.no_grad():
+        assert torch.allclose(q(x), net(x), rtol=1e-5, atol=1e-4)
+
+
+def test_quantized_net_fuses():
+
+    q = QuantizedNet(Net().eval()).eval()
+    q.fuse()
+
+    assert all(isinstance(q.head._modules[a], torch.nn.Identity) for a in ('act1', 'act2', 'act3', 'fc_act1'))
+
+
+@pytest.mark.skipif(backend_support('int8') is not None, reason='no int8 support in this torch build')
+def test_int8_matches_float():
+
+    net = Net().eval()
+    q = QuantizedNet(net).eval()
+    q.fuse()
+    q.qconfig = torch.quantization.get_default_qconfig('fbgemm')
+    torch.quantization.prepare(q, inplace=True)
+    with torch.no_grad():
+        q(boards(512, seed=1))
+    torch.quantization.convert(q, inplace=True)
+
+    x = boards(64, seed=2)
+    with torch.no_grad():
+        diff = (q(x) - net(x)).abs()
+
+    # output bounds are 1e2 for the value and 1e3 for the variance
+    assert diff[:, 0].max() < 1.
+    assert diff[:, 1].max() < 10.
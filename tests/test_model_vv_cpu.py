@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('cppimport')
+
+from model.model_vv import Model_VV
+from model.model_vv_cpu import Model_VV_CPU, pack_boards
+
+
+@pytest.fixture(scope='module')
+def models(tmp_path_factory):
+
+    torch.manual_seed(0)
+    model = Model_VV(use_cuda=False)
+    model.training(False)
+
+    path = str(tmp_path_factory.mktemp('weights') / 'model_checkpoint_weights.npz')
+    model.export_weights(path)
+
+    return model, Model_VV_CPU(path)
+
+
+def boards(n, seed=0):
+
+    return np.random.RandomState(seed).randint(0, 2, (n, 1, 20, 10)).astype(np.int8)
+
+
+def assert_close(result, expected):
+
+    for r, e in zip(result, expected):
+        assert r.shape == e.shape
+        np.testing.assert_allclose(r, e, rtol=1e-4, atol=1e-3)
+
+
+@pytest.mark.parametrize('dtype', [np.int8, np.float32, np.float64])
+def test_matches_torch(models, dtype):
+
+    model, cpu = models
+    b = boards(37)
+
+    assert_close(cpu.inference(b.astype(dtype)), model.inference(b))
+
+
+def test_packed_boards_match_torch(models):
+
+    model, cpu = models
+    b = boards(19, seed=1)
+
+    assert_close(cpu.inference(pack_boards(b)), model.inference(b))
+
+
+def test_inference_into_matches_torch(models):
+
+    model, cpu = models
+    b = boards(8, seed=2)
+    out = np.zeros((8, 2), dtype=np.float32)
+
+    cpu.inference_into(b, out)
+
+    v, var = model.inference(b)
+    assert_close([out[:, :1], out[:, 1:]], [v, var])
+
+
+def test_load_state_matches_the_export(models):
+
+    model, cpu = models
+    b = boards(5, seed=3)
+
+    direct = Model_VV_CPU(None)
+    direct.load_state({k: v.detach().numpy() for k, v in model.model.state_dict().items()})
+
+    assert_close(direct.inference(b), cpu.inference(b))
+
+
+def test_missing_weights_raise(tmp_path):
+
+    with pytest.raises(FileNotFoundError):
+        Model_VV_CPU(str(tmp_path / 'missing.npz'))
+
+
+def test_inference_only(models):
+
+    with pytest.raises(ValueError):
+        models[1].training(True)
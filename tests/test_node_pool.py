@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+pyTetris = pytest.importorskip('pyTetris')
+
+import agents.helper
+from agents.cppmodule.agent import TreeAgent
+
+env_args = ((20, 10), 1, 0, 0)
+n_actions = 7
+
+
+class Pool(TreeAgent):
+
+    def __init__(self, max_nodes):
+
+        super().__init__(max_nodes=max_nodes)
+        self.collects = 0
+        self.freed = 0
+        self.child = self.pool_views()[0]['child']
+
+    def collect_released(self):
+
+        self.collects += 1
+        self.freed += len(self.released)
+
+
+def reachable(pool):
+
+    seen, todo = {pool.root}, [pool.root]
+    while todo:
+        for c in pool.child[todo.pop()]:
+            if c != 0 and c not in seen:
+                seen.add(c)
+                todo.append(c)
+    return seen
+
+
+def grow(pool, game):
+    """
+    expand the root and each of its children
+    """
+    pool.expand(game)
+    g = pyTetris.Tetris(*env_args)
+    for c in set(pool.child[pool.root]):
+        pool.get_game(int(c), g)
+        pool.expand(g)
+
+
+def play(pool, moves):
+
+    game = pyTetris.Tetris(*env_args)
+    pool.update_root(game)
+    for i in range(moves):
+        grow(pool, game)
+        yield game
+        if game.end:
+            break
+        game.play(i % n_actions)
+        pool.update_root(game)
+
+
+def test_tree_below_the_root_survives_reclaim():
+
+    pool = Pool(max_nodes=300)
+    g = pyTetris.Tetris(*env_args)
+    expected = pyTetris.Tetris(*env_args)
+
+    for game in play(pool, 30):
+        live = reachable(pool)
+        assert live <= set(pool.occupied)
+        assert len(pool.occupied) <= pool.max_nodes
+
+        # children still hold the games their actions lead to
+        for a, c in enumerate(pool.child[pool.root]):
+            expected.copy_from(game)
+            expected.play(a)
+            pool.get_game(int(c), g)
+            assert np.array_equal(g.getState(), expected.getState())
+            assert g.score == expected.score
+
+    assert pool.freed > 0
+
+
+def test_reclaim_runs_the_hooks_once_per_batch():
+
+    pool = Pool(max_nodes=300)
+    for _ in play(pool, 30):
+        pass
+
+    assert pool.collects > 0
+    assert pool.freed >= 8 * pool.collects
+
+
+def test_remove_nodes_keeps_exactly_the_reachable_nodes():
+
+    pool = Pool(max_nodes=5000)
+    for _ in play(pool, 3):
+        pass
+
+    assert set(pool.occupied) > reachable(pool)
+
+    pool.remove_nodes()
+
+    assert set(pool.occupied) == reachable(pool)
+    assert not pool.released
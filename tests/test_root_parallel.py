@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('pyTetris')
+
+from agents.RootParallel import merge_stats
+
+
+def summary(samples):
+
+    return len(samples), np.mean(samples), np.var(samples)
+
+
+def test_pools_mean_and_variance_of_the_samples():
+
+    rng = np.random.RandomState(0)
+    # [process][action] samples, action 2 only visited by the first process
+    samples = [[rng.normal(a, 1 + a, size=rng.randint(1, 50)) for a in range(7)] for _ in range(3)]
+    for p in (1, 2):
+        samples[p][2] = samples[p][2][:0]
+
+    stats = np.zeros((3, 3, 7), dtype=np.float32)
+    for p in range(3):
+        for a in range(7):
+            if len(samples[p][a]):
+                stats[p, :, a] = summary(samples[p][a])
+
+    n, mean, var = merge_stats(stats)
+
+    for a in range(7):
+        pooled = np.concatenate([samples[p][a] for p in range(3)])
+        assert n[a] == len(pooled)
+        assert mean[a] == pytest.approx(pooled.mean(), rel=1e-5)
+        assert var[a] == pytest.approx(pooled.var(), rel=1e-4)
+
+
+def test_single_process_is_unchanged():
+
+    stats = np.array([[[3, 0, 5], [1., 2., 3.], [.5, .25, 1.]]], dtype=np.float32)
+
+    np.testing.assert_allclose(merge_stats(stats), stats[0])
+
+
+def test_unvisited_actions_average_the_estimates():
+
+    stats = np.zeros((2, 3, 2), dtype=np.float32)
+    stats[:, 0, 0] = 4
+    stats[:, 1] = [[1., 2.], [3., 6.]]
+    stats[:, 2] = [[.5, 1.], [.5, 3.]]
+
+    n, mean, var = merge_stats(stats)
+
+    assert n.tolist() == [8, 0]
+    assert mean.tolist() == [2., 4.]
+    # the visited action pools the spread between processes
+    assert var.tolist() == [1.5, 2.]
@@ -0,0 +1,185 @@
+import os
+import time
+import threading
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from multiprocessing import AuthenticationError
+from model.model_vv import Model_VV
+from model.server import InferenceServer, InferenceClient, check_address, get_authkey, authkey_env
+
+authkey = 'test-key'
+
+
+@pytest.fixture(scope='module')
+def served(tmp_path_factory):
+
+    root = tmp_path_factory.mktemp('server')
+    cwd = os.getcwd()
+    os.chdir(str(root))
+    try:
+        torch.manual_seed(0)
+        model = Model_VV(use_cuda=False)
+        checkpoint = str(root / 'model_checkpoint')
+        model.save(checkpoint, verbose=False)
+        model.training(False)
+
+        address = str(root / 'inference.sock')
+        server = InferenceServer(address, authkey=authkey, checkpoint=checkpoint, shm_dir=str(root) + '/')
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        yield address, model, server
+    finally:
+        os.chdir(cwd)
+
+
+def boards(n, seed=0):
+
+    return np.random.RandomState(seed).randint(0, 2, (n, 1, 20, 10)).astype(np.int8)
+
+
+def assert_matches(result, model, b):
+
+    for r, e in zip(result, model.inference(b)):
+        np.testing.assert_allclose(r, e, rtol=1e-5, atol=1e-4)
+
+
+def test_round_trip_matches_the_model(served):
+
+    address, model, _ = served
+    client = InferenceClient(address, authkey=authkey, max_rows=16)
+    try:
+        # more rows than the client buffers, sent in chunks
+        b = boards(40)
+        assert_matches(client.inference(b), model, b)
+    finally:
+        client.close()
+
+
+def test_concurrent_clients_get_their_own_rows(served):
+
+    address, model, _ = served
+    results = {}
+
+    def run(seed):
+        client = InferenceClient(address, authkey=authkey, max_rows=8)
+        try:
+            results[seed] = [client.inference(boards(8, seed + i)) for i in range(5)]
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=run, args=(seed,)) for seed in (10, 20, 30)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(60)
+
+    assert sorted(results) == [10, 20, 30]
+    for seed, outputs in results.items():
+        for i, out in enumerate(outputs):
+            assert_matches(out, model, boards(8, seed + i))
+
+
+def test_reload_bumps_the_version(served):
+
+    address, _, _ = served
+    client = InferenceClient(address, authkey=authkey)
+    try:
+        version = client.version
+        client.reload()
+        assert client.version == version + 1
+    finally:
+        client.close()
+
+
+def test_wrong_authkey_is_rejected(served):
+
+    address, model, _ = served
+    with pytest.raises(AuthenticationError):
+        InferenceClient(address, authkey='wrong')
+
+    client = InferenceClient(address, authkey=authkey)
+    try:
+        b = boards(3)
+        assert_matches(client.inference(b), model, b)
+    finally:
+        client.close()
+
+
+def test_socket_is_private(served):
+
+    address = served[0]
+
+    assert os.stat(address).st_mode & 0o077 == 0
+
+
+def test_only_unix_sockets():
+
+    assert check_address('./tmp/inference.sock') == './tmp/inference.sock'
+    for address in ('localhost:5000', '127.0.0.1:5000'):
+        with pytest.raises(ValueError):
+            check_address(address)
+
+
+def test_authkey_has_no_default(monkeypatch):
+
+    monkeypatch.delenv(authkey_env, raising=False)
+    with pytest.raises(ValueError):
+        get_authkey()
+
+    monkeypatch.setenv(authkey_env, 'from-env')
+    assert get_authkey() == b'from-env'
+    assert get_authkey('explicit') == b'explicit'
+
+
+def serve(root, **kwargs):
+
+    torch.manual_seed(0)
+    checkpoint = str(root / 'model_checkpoint')
+    Model_VV(use_cuda=False).save(checkpoint, verbose=False)
+
+    address = str(root / 'inference.sock')
+    server = InferenceServer(address, authkey=authkey, checkpoint=checkpoint, shm_dir=str(root) + '/', **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return address, checkpoint
+
+
+def test_batch_runs_once_every_client_submitted(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    address, _ = serve(tmp_path, max_wait=5.)
+
+    client = InferenceClient(address, authkey=authkey)
+    try:
+        start = time.time()
+        for i in range(3):
+            client.inference(boards(4, i))
+        assert time.time() - start < 5.
+    finally:
+        client.close()
+
+
+def test_checkpoint_reloads_under_load(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    address, checkpoint = serve(tmp_path, reload_interval=0.05)
+
+    client = InferenceClient(address, authkey=authkey)
+    try:
+        client.inference(boards(2))
+        version = client.version
+
+        mtime = os.path.getmtime(checkpoint)
+        Model_VV(use_cuda=False).save(checkpoint, verbose=False)
+        os.utime(checkpoint, (mtime + 10, mtime + 10))
+
+        deadline = time.time() + 30
+        while client.version == version and time.time() < deadline:
+            client.inference(boards(2))
+
+        assert client.version > version
+    finally:
+        client.close()
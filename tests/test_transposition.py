@@ -0,0 +1,105 @@
+import pytest
+
+cppimport = pytest.importorskip('cppimport')
+tables = cppimport.imp('tests.cppmodule.tables')
+
+stride = 4
+
+
+def board(i):
+
+    return bytes([i % 256, i // 256, 0, 1])
+
+
+def test_lookup_returns_stored_stats():
+
+    t = tables.TranspositionTable(4, stride)
+    t.store(7, board(7), 10, 1.5, 0.25)
+
+    assert t.lookup(7, board(7)) == (10, 1.5, 0.25)
+    assert t.lookup(8, board(8)) is None
+    assert (t.hits, t.misses) == (1, 1)
+
+
+def test_same_key_different_board_is_a_miss():
+
+    t = tables.TranspositionTable(4, stride)
+    t.store(7, board(7), 10, 1.5, 0.25)
+    t.store(7, board(9), 3, 2.5, 0.5)
+
+    assert t.size() == 2
+    assert t.lookup(7, board(7)) == (10, 1.5, 0.25)
+    assert t.lookup(7, board(9)) == (3, 2.5, 0.5)
+
+
+def test_store_keeps_the_better_visited_stats():
+
+    t = tables.TranspositionTable(4, stride)
+    t.store(1, board(1), 10, 1., 1.)
+    t.store(1, board(1), 5, 2., 2.)
+
+    assert t.lookup(1, board(1)) == (10, 1., 1.)
+
+    t.store(1, board(1), 20, 3., 3.)
+
+    assert t.lookup(1, board(1)) == (20, 3., 3.)
+
+
+def test_evicts_the_least_recently_used_entry():
+
+    t = tables.TranspositionTable(3, stride)
+    for i in (1, 2, 3):
+        t.store(i, board(i), i, 0., 0.)
+
+    # lookups and stores both refresh an entry
+    assert t.lookup(1, board(1)) is not None
+    t.store(2, board(2), 1, 0., 0.)
+
+    t.store(4, board(4), 4, 0., 0.)
+
+    assert t.size() == 3
+    assert t.lookup(3, board(3)) is None
+    assert all(t.lookup(i, board(i)) is not None for i in (1, 2, 4))
+
+
+def test_entries_of_an_older_version_are_dropped():
+
+    t = tables.TranspositionTable(3, stride)
+    t.store(1, board(1), 10, 1., 1.)
+    t.store(2, board(2), 10, 1., 1.)
+
+    t.version += 1
+
+    assert t.lookup(1, board(1)) is None
+    assert t.size() == 1
+
+    # the stale entry does not keep its visits either
+    t.store(2, board(2), 1, 5., 5.)
+
+    assert t.lookup(2, board(2)) == (1, 5., 5.)
+
+
+def test_clear_and_refill():
+
+    t = tables.TranspositionTable(2, stride)
+    for i in range(10):
+        t.store(i, board(i), i, 0., 0.)
+    t.clear()
+
+    assert t.size() == 0
+    assert t.lookup(9, board(9)) is None
+
+    for i in range(10, 13):
+        t.store(i, board(i), i, 0., 0.)
+
+    assert t.size() == 2
+    assert t.lookup(12, board(12)) == (12, 0., 0.)
+
+
+def test_zero_capacity_stores_nothing():
+
+    t = tables.TranspositionTable(0, stride)
+    t.store(1, board(1), 1, 0., 0.)
+
+    assert t.size() == 0
+    assert t.lookup(1, board(1)) is None
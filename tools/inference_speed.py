@@ -1,9 +1,199 @@
-from model.model_vv import Model_VV as Model
+import sys
+import os
+import json
+import time
+import argparse
+import platform
+import tempfile
 import numpy as np
-from tqdm import tqdm 
+from sys import stderr
+sys.path.append('.')
+import torch
 
-batch_size = 5
-m = Model(training=False)
-b = np.ones((batch_size, 1, 20, 10))
-for i in tqdm(range(10000)):
-    m.inference(b)
+perr = dict(file=stderr, flush=True)
+
+"""
+ARG PARSE
+"""
+parser = argparse.ArgumentParser(description='Inference latency and throughput benchmark')
+
+parser.add_argument('--backends', default=['scripted'], nargs='*',
+                    help='eager, scripted, frozen, int8_dynamic, int8 (Model_VV only), native (Model_VV only)')
+parser.add_argument('--baseline', default=None, type=str, help='JSON of an earlier run to compare against')
+parser.add_argument('--batch_sizes', default=[1, 4, 16, 64, 256, 1024], type=int, nargs='*', help='Batch sizes to sweep')
+parser.add_argument('--cuda', default=False, help='Run torch backends on the GPU', action='store_true')
+parser.add_argument('--iters', default=200, type=int, help='Timed calls per configuration')
+parser.add_argument('--max_seconds', default=10., type=float, help='Time budget per configuration, cuts iters short')
+parser.add_argument('--models', default=['vv'], nargs='*', help='vv, vp, dist')
+parser.add_argument('--output', default=None, type=str, help='Write the results as JSON to this file')
+parser.add_argument('--threads', default=[1], type=int, nargs='*', help='torch intra-op thread counts to sweep')
+parser.add_argument('--tolerance', default=0.1, type=float, help='Relative slowdown against the baseline reported as a regression')
+parser.add_argument('--warmup', default=10, type=int, help='Untimed calls per configuration')
+args = parser.parse_args()
+
+quantized = ('frozen', 'int8_dynamic', 'int8')
+
+
+def load_model(name, backend):
+
+    if name == 'vv':
+        from model.model_vv import Model_VV, Net, backend_support
+        if backend in quantized and backend_support(backend):
+            print(backend_support(backend), **perr)
+            return None, (20, 10)
+        if backend == 'native':
+            m = Model_VV(use_cuda=False)
+        else:
+            m = Model_VV(use_cuda=args.cuda, backend=backend if backend in quantized else 'torch')
+        shape = (20, 10)
+    elif name == 'vp':
+        from model.model_vp import Model_VP as M, Net
+        m = M(use_cuda=args.cuda)
+        shape = (22, 10)
+    elif name == 'dist':
+        from model.model_distributional import Model_Dist as M, Net
+        m = M(use_cuda=args.cuda)
+        shape = (22, 10)
+    else:
+        raise ValueError('Unknown model {}'.format(name))
+
+    if backend in quantized + ('native',) and name != 'vv':
+        return None, shape
+
+    m.load()
+    m.training(False)
+
+    if backend == 'eager':
+        net = Net().to(m.device)
+        net.load_state_dict(m.model.state_dict())
+        m.model = net.eval()
+    elif backend == 'native':
+        from model.model_vv_cpu import Model_VV_CPU
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, 'weights.npz')
+            m.export_weights(filename)
+            m = Model_VV_CPU(filename)
+
+    return m, shape
+
+
+def rss_mb():
+
+    # resident set size right now
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+def reset_peak_rss():
+
+    # 5 resets VmHWM to the current RSS, ru_maxrss would keep the peak of the whole process
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')
+
+
+def peak_rss_mb():
+
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 2 ** 10
+
+
+def bench(m, shape, batch_size):
+
+    reset_peak_rss()
+    rss_start = rss_mb()
+
+    b = np.random.randint(0, 2, (batch_size, 1, *shape)).astype(np.float32)
+
+    for i in range(args.warmup):
+        m.inference(b)
+
+    t_end = time.perf_counter() + args.max_seconds
+    latency = []
+    for i in range(args.iters):
+        t = time.perf_counter()
+        # stop before a call that the last one says would run past the budget
+        if latency and t + latency[-1] > t_end:
+            break
+        m.inference(b)
+        latency.append(time.perf_counter() - t)
+
+    peak = peak_rss_mb()
+    latency = np.array(latency) * 1e3
+    p50, p95, p99 = np.percentile(latency, [50, 95, 99])
+
+    return dict(calls=len(latency), mean_ms=latency.mean(), p50_ms=p50, p95_ms=p95, p99_ms=p99,
+                boards_per_sec=batch_size / latency.mean() * 1e3, peak_rss_mb=peak, peak_delta_mb=peak - rss_start)
+
+
+def key(r):
+
+    return r['model'], r['backend'], r['threads'], r['batch_size']
+
+
+def compare(results, baseline):
+
+    base = {key(r): r for r in baseline['results']}
+
+    regressions = 0
+    print('{:>5} {:>12} {:>7} {:>6}  {:>10} {:>10} {:>8}'.format(
+        'model', 'backend', 'threads', 'batch', 'p50 ms', 'base ms', 'speedup'), **perr)
+    for r in results:
+        b = base.get(key(r))
+        if b is None:
+            continue
+        speedup = b['p50_ms'] / r['p50_ms']
+        flag = ''
+        if speedup < 1 / (1 + args.tolerance):
+            flag = '  regression'
+            regressions += 1
+        print('{:>5} {:>12} {:>7} {:>6}  {:>10.3f} {:>10.3f} {:>7.2f}x{}'.format(
+            *key(r), r['p50_ms'], b['p50_ms'], speedup, flag), **perr)
+
+    return regressions
+
+
+"""
+BENCHMARK
+"""
+results = []
+
+print('{:>5} {:>12} {:>7} {:>6}  {:>9} {:>9} {:>9} {:>12} {:>9} {:>9}'.format(
+    'model', 'backend', 'threads', 'batch', 'p50 ms', 'p95 ms', 'p99 ms', 'boards/s', 'peak MB', 'delta MB'), **perr)
+
+for name in args.models:
+    for backend in args.backends:
+        m, shape = load_model(name, backend)
+        if m is None:
+            print('{:>5} {:>12}  not supported, skipped'.format(name, backend), **perr)
+            continue
+        for threads in args.threads:
+            torch.set_num_threads(threads)
+            for batch_size in args.batch_sizes:
+                r = dict(model=name, backend=backend, threads=threads, batch_size=batch_size)
+                r.update(bench(m, shape, batch_size))
+                results.append(r)
+                print('{:>5} {:>12} {:>7} {:>6}  {:>9.3f} {:>9.3f} {:>9.3f} {:>12.0f} {:>9.0f} {:>+9.1f}'.format(
+                    *key(r), r['p50_ms'], r['p95_ms'], r['p99_ms'], r['boards_per_sec'], r['peak_rss_mb'],
+                    r['peak_delta_mb']), **perr)
+        del m
+
+report = dict(
+        machine=dict(platform=platform.platform(), processor=platform.processor(), cpu_count=os.cpu_count(),
+                     python=platform.python_version(), torch=torch.__version__, numpy=np.__version__,
+                     cuda=args.cuda and torch.cuda.is_available()),
+        settings=dict(iters=args.iters, warmup=args.warmup, max_seconds=args.max_seconds),
+        results=results)
+
+if args.output:
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+else:
+    print(json.dumps(report, indent=2))
+
+if args.baseline:
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if compare(results, baseline):
+        sys.exit(1)
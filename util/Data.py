@@ -62,22 +62,17 @@ class DataSaver:
 
     def add(self, episode, action, agent, game):
 
+        self.add_raw(*self.collect(episode, action, agent, game))
+
+    def collect(self, episode, action, agent, game):
+        """
+        the add_raw fields of a move, for callers that write episodes later
+        """
         def check(key):
             return hasattr(agent, key) and callable(getattr(agent, key))
 
-        self.iter += 1
-        self.state['episode'] = episode
-        self.state['board'] = game.getState()
-        if check('get_prob'):
-            self.state['policy'] = agent.get_prob()
-        self.state['action'] = action
-        self.state['combo'] = game.combo
-        self.state['lines'] = game.line_clears
-        self.state['line_stats'] = game.line_stats
-        self.state['score'] = game.score
-        if check('get_stats'):
-            self.state['child_stats'] = agent.get_stats()
-        self.state['cycle'] = self.cycle
+        policy = agent.get_prob() if check('get_prob') else np.zeros(n_actions, dtype=np.float32)
+        child_stats = agent.get_stats() if check('get_stats') else np.zeros((3, n_actions), dtype=np.float32)
         if check('get_value_and_variance'):
             v, var = agent.get_value_and_variance()
         elif check('get_value'):
@@ -85,15 +80,9 @@ class DataSaver:
             var = 0
         else:
             v, var = 0, 0
-        self.state['value'] = v
-        self.state['variance'] = var
 
-        self.state.append()
-
-        self.iter = self.iter % self.chunksize
-
-        if self.iter == 0:
-            self.table.flush()
+        return (episode, np.array(game.getState()), np.array(policy), action, game.combo,
+                game.line_clears, game.line_stats, game.score, np.array(child_stats), v, var)
 
     def add_raw(self, episode, board,
                 policy, action, combo,